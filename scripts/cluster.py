@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Cluster - удалённые воркеры: тесты с нескольких точек замера (vantage points)
+
+Координатор - обычный web_api.py: задания и задачи лежат в run_state, воркеры
+ходят к нему по HTTP (/api/cluster/*). Воркер на другом сервере (например,
+европейском) регистрируется со своей точкой замера, забирает шард задач этой
+точки, запускает test_config у себя и отправляет каждый результат сразу, как
+он готов. Пропавший воркер перестаёт отмечаться - его задачи возвращаются
+в очередь и достаются другим воркерам той же точки (re-sharding).
+
+    # на координаторе
+    curl -X POST localhost:5000/api/test -d '{"vantages": ["local", "europe"]}' -H 'Content-Type: application/json'
+
+    # на удалённом сервере
+    python3 cluster.py http://coordinator:5000 --vantage europe --parallel 2
+"""
+
+import argparse
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from run_state import JOB_HEARTBEAT
+from vpn_tester import VpnTester, VlessConfig
+
+CLUSTER_TOKEN = os.environ.get('CLUSTER_TOKEN', '')  # общий секрет координатора и воркеров
+CLUSTER_POLL = 3  # секунд между запросами задач, когда очередь пуста
+CLUSTER_TIMEOUT = 30  # секунд на запрос к координатору
+CLUSTER_RESULT_RETRIES = 5  # попыток отправить результат (потом задачу переотдаст координатор)
+
+
+class RemoteWorker:
+    """Воркер точки замера vantage: берёт задачи у координатора и тестирует их локально"""
+
+    def __init__(self, coordinator: str, vantage: str, parallel: int = 1, name: str = None,
+                 token: str = CLUSTER_TOKEN):
+        self.coordinator = coordinator.rstrip('/')
+        self.vantage = vantage
+        self.parallel = parallel
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.tester = VpnTester()
+        self.session = requests.Session()
+        if token:
+            self.session.headers['X-Cluster-Token'] = token
+        self.active = set()  # id задач в работе
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        payload = dict(payload, name=self.name, vantage=self.vantage)
+        response = self.session.post(f"{self.coordinator}/api/cluster/{path}", json=payload,
+                                     timeout=CLUSTER_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def _active(self) -> list:
+        with self._lock:
+            return sorted(self.active)
+
+    def _heartbeat_loop(self):
+        """
+        Отметка "живой" - пока она идёт, координатор не отдаёт наши задачи другим.
+        Отмечаются только задачи из active: брошенные (результат не отправлен,
+        ответ на claim потерялся) координатор вернёт в очередь.
+        """
+        while not self._stop.wait(JOB_HEARTBEAT):
+            try:
+                self._post('heartbeat', {'parallel': self.parallel, 'active': self._active()})
+            except requests.RequestException as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
+    def _run_task(self, task: dict):
+        try:
+            config = VlessConfig(task['url'])
+            print(f"[{self.vantage}] Testing {config.name}...")
+            error = None
+            try:
+                result = self.tester.test_config(config, task.get('profile'))
+            except Exception as e:
+                error = str(e)
+                result = {'name': config.name, 'info': config.info, 'status': 'error', 'error': error}
+
+            # Результат уходит сразу; координатор недоступен - несколько повторов
+            for attempt in range(CLUSTER_RESULT_RETRIES):
+                try:
+                    reply = self._post('results', {'task_id': task['id'], 'result': result, 'error': error})
+                    if not reply.get('accepted'):
+                        print(f"⚠️ {config.name}: result rejected (task reassigned)")
+                    break
+                except requests.RequestException as e:
+                    print(f"⚠️ {config.name}: result upload failed ({e}), retry {attempt + 1}")
+                    self._stop.wait(2 ** attempt)
+            print(f"[{self.vantage}] {config.name}: {result.get('status', 'unknown')}")
+        finally:
+            with self._lock:
+                self.active.discard(task['id'])
+
+    def run(self):
+        """Забирать задачи, пока не остановят (Ctrl+C)"""
+        self._post('register', {'parallel': self.parallel, 'host': socket.gethostname()})
+        print(f"🛰️ Worker {self.name} ({self.vantage}) registered at {self.coordinator}")
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            while not self._stop.is_set():
+                with self._lock:
+                    free = self.parallel - len(self.active)
+                tasks = []
+                if free > 0:
+                    try:
+                        tasks = self._post('claim', {'limit': free, 'parallel': self.parallel,
+                                                     'active': self._active()})['tasks']
+                    except requests.RequestException as e:
+                        print(f"⚠️ Coordinator unavailable: {e}")
+                for task in tasks:
+                    with self._lock:
+                        self.active.add(task['id'])
+                    pool.submit(self._run_task, task)
+                self._stop.wait(1 if tasks or free <= 0 else CLUSTER_POLL)
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Remote VPN tester worker')
+    parser.add_argument('coordinator', help='Адрес API координатора, например http://host:5000')
+    parser.add_argument('--vantage', required=True, help='Точка замера (колонка в отчёте)')
+    parser.add_argument('--parallel', type=int, default=1, help='Конфигов одновременно')
+    parser.add_argument('--name', help='Имя воркера (по умолчанию host:pid)')
+    args = parser.parse_args()
+
+    worker = RemoteWorker(args.coordinator, args.vantage, args.parallel, args.name)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Instrumentation - замер времени по фазам тестирования, профилирование и хуки
+
+Хук - любая функция hook(phase, duration, context), где duration в секундах,
+а context - словарь с деталями (например, {'config': 'name'}).
+
+    import instrumentation
+    instrumentation.add_hook(lambda phase, duration, ctx: print(phase, duration))
+"""
+
+import cProfile
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Подписать внешний сборщик на завершение фаз"""
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def remove_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def emit(phase: str, duration: float, context: dict = None):
+    """Передать замер всем подписчикам (ошибки хуков не ломают тест)"""
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(phase, duration, context or {})
+        except Exception as e:
+            print(f"Instrumentation hook error: {e}")
+
+
+@contextmanager
+def span(phase: str, timings: dict = None, **context):
+    """Замер фазы: время пишется в timings[phase] (секунды) и уходит в хуки"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if timings is not None:
+            timings[phase] = round(timings.get(phase, 0) + duration, 3)
+        emit(phase, duration, context)
+
+
+@contextmanager
+def profiled(name: str, enabled: bool, out_dir: Path):
+    """
+    cProfile на время блока. Результат - .prof файл в out_dir
+    (смотреть через `python -m pstats <file>` или snakeviz).
+    Отдаёт словарь, в который после выхода попадает путь к файлу.
+    """
+    info = {}
+    if not enabled:
+        yield info
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield info
+    finally:
+        profiler.disable()
+        safe_name = re.sub(r'[^\w.-]+', '_', name)
+        path = Path(out_dir) / f"profile_{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"
+        try:
+            profiler.dump_stats(str(path))
+            info['path'] = str(path)
+        except OSError as e:
+            print(f"Profile save error: {e}")
+
+
+def aggregate(results: list) -> dict:
+    """Сводка по фазам для набора результатов: {phase: {total, mean, max, count}}"""
+    summary = {}
+    for result in results:
+        for phase, duration in result.get('timings', {}).items():
+            entry = summary.setdefault(phase, {'total': 0.0, 'max': 0.0, 'count': 0})
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['count'] += 1
+    for entry in summary.values():
+        entry['mean'] = entry['total'] / entry['count']
+    return summary
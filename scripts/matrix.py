@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Matrix - подбор параметров REALITY: варианты конфига по осям и сводная таблица
+
+Берёт базовый vless:// конфиг и оси (sni, fp, port, spx, sid, flow), строит
+варианты VlessConfig и проверяет их параллельно: на каждый вариант один Xray
+и несколько gate запросов (доля успехов + задержка).
+
+Полное произведение осей растёт быстро, поэтому сначала отсев: каждое
+значение оси проверяется в паре с несколькими случайными значениями других
+осей. Значения, которые не прошли ни разу (когда другие значения той же оси
+проходят), в полное произведение не попадают.
+
+    python3 matrix.py "<vless://...|имя конфига>" --axis sni=microsoft.com,apple.com \\
+        --axis fp=chrome,firefox,safari --axis port=32000,32001 --rows sni --cols fp
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, quote
+
+from vpn_tester import VpnTester, VlessConfig, REPORTS_DIR, write_report_file, _free_port
+
+MATRIX_SAMPLES = 3  # gate запросов на вариант
+MATRIX_PARALLEL = 4  # вариантов одновременно (у каждого свой Xray)
+MATRIX_SCREEN_COMBOS = 3  # случайных сочетаний на значение оси при отсеве
+
+# Имя оси -> параметр vless:// ссылки (port - часть адреса)
+AXIS_PARAMS = {
+    'sni': 'sni', 'fp': 'fp', 'fingerprint': 'fp', 'spx': 'spx', 'spiderx': 'spx',
+    'sid': 'sid', 'flow': 'flow', 'type': 'type', 'port': None,
+}
+
+
+def variant(base: VlessConfig, values: dict) -> VlessConfig:
+    """Базовый конфиг с заменёнными параметрами; config.axes - значения осей"""
+    p = base.parsed
+    params = dict(p['params'])
+    port = p['port']
+    for axis, value in values.items():
+        if axis == 'port':
+            port = int(value)
+        else:
+            params[AXIS_PARAMS[axis]] = value
+    host = f"[{p['host']}]" if ':' in p['host'] else p['host']
+    # Имя идёт в путь xray_config_<name>_<pid>_<port>.json - без '/' и пробелов
+    label = '-'.join(f"{axis}={value}" for axis, value in values.items())
+    name = re.sub(r'[^\w.=,-]+', '_', f"{base.name}-{label}")
+    config = VlessConfig(f"vless://{p['uuid']}@{host}:{port}?{urlencode(params)}#{quote(name)}")
+    config.axes = dict(values)
+    return config
+
+
+def expand(base: VlessConfig, axes: dict) -> list:
+    """Полное произведение осей: {'sni': [...], 'fp': [...]} -> [VlessConfig]"""
+    names = list(axes)
+    return [variant(base, dict(zip(names, combo))) for combo in itertools.product(*axes.values())]
+
+
+class MatrixRunner:
+    """Отсев по осям, затем параллельная проверка оставшегося произведения"""
+
+    def __init__(self, base: VlessConfig, axes: dict, samples: int = MATRIX_SAMPLES,
+                 parallel: int = MATRIX_PARALLEL, tester: VpnTester = None):
+        unknown = [axis for axis in axes if axis not in AXIS_PARAMS]
+        if unknown:
+            raise ValueError(f"Unknown axes: {', '.join(unknown)} (known: {', '.join(AXIS_PARAMS)})")
+        if not base.parsed:
+            raise ValueError(f"Cannot parse base config {base.name}")
+        self.base = base
+        # Синонимы (fingerprint, spiderx) - к имени параметра, чтобы --rows/--cols совпадали
+        self.axes = {AXIS_PARAMS[axis] or axis: list(dict.fromkeys(values)) for axis, values in axes.items()}
+        self.samples = samples
+        self.parallel = parallel
+        self.tester = tester or VpnTester()
+        self._probes = {}  # url -> результат (варианты отсева не проверяются повторно)
+
+    def probe(self, config: VlessConfig) -> dict:
+        """Один Xray, до samples gate запросов. Два провала подряд без успехов - хватит"""
+        if config.url in self._probes:
+            return self._probes[config.url]
+        result = {'name': config.name, 'axes': config.axes, 'ok': 0, 'samples': 0, 'latency_ms': None}
+        http_port = _free_port()
+        try:
+            proc = self.tester.start_xray(config, _free_port(), http_port)
+        except OSError as e:
+            result.update(failure_class='failed_to_start', error=str(e), success_rate=0.0)
+            self._probes[config.url] = result
+            return result
+        try:
+            if proc.poll() is not None:
+                proc.output.wait()
+                result['failure_class'] = proc.output.failure_class or 'failed_to_start'
+            else:
+                times = []
+                for _ in range(self.samples):
+                    status, time_ms = self.tester.gate_request(http_port)
+                    result['samples'] += 1
+                    if status == 'ok':
+                        result['ok'] += 1
+                        times.append(time_ms)
+                    elif result['ok'] == 0 and result['samples'] >= 2:
+                        break
+                if times:
+                    result['latency_ms'] = round(statistics.median(times))
+                elif result['samples']:
+                    result['failure_class'] = proc.output.failure_class or 'no_connectivity'
+        finally:
+            self.tester.stop_xray(proc)
+        result['success_rate'] = round(result['ok'] / result['samples'], 2) if result['samples'] else 0.0
+        self._probes[config.url] = result
+        return result
+
+    def _probe_all(self, configs: list) -> list:
+        with ThreadPoolExecutor(max_workers=max(1, self.parallel)) as pool:
+            return list(pool.map(self.probe, configs))
+
+    def _screen_round(self, targets: dict, partners: dict, rng: random.Random) -> dict:
+        """Каждое значение из targets - в паре с MATRIX_SCREEN_COMBOS сочетаниями partners: {ось: {значение: ok}}"""
+        checks = []  # (ось, значение, вариант)
+        for axis, values in targets.items():
+            others = {a: v for a, v in partners.items() if a != axis}
+            combos = list(itertools.product(*others.values()))
+            for value in values:
+                for combo in rng.sample(combos, min(MATRIX_SCREEN_COMBOS, len(combos))):
+                    chosen = dict(zip(others, combo), **{axis: value})
+                    # Порядок осей как в self.axes - тот же url, что у варианта из expand (кэш проб)
+                    checks.append((axis, value, variant(self.base, {a: chosen[a] for a in self.axes})))
+
+        self._probe_all(list({config.url: config for _, _, config in checks}.values()))
+        passed = {}
+        for axis, value, config in checks:
+            passed.setdefault(axis, {}).setdefault(value, 0)
+            passed[axis][value] += self._probes[config.url]['ok']
+        return passed
+
+    def screen(self) -> dict:
+        """
+        Отсев: {ось: [отброшенные значения]}. Первый круг - со случайными партнёрами;
+        не прошедшие значения перепроверяются с партнёрами, которые прошли
+        (иначе хорошее значение можно отбросить из-за плохого соседа).
+        """
+        rng = random.Random(0)
+        passed = self._screen_round(self.axes, self.axes, rng)
+        suspects = {axis: [v for v, ok in counts.items() if ok == 0] for axis, counts in passed.items()
+                    if any(counts.values())}  # ось, где всё провалилось, ничего не говорит о значениях
+        good = {axis: [v for v in values if passed[axis][v] > 0] or values for axis, values in self.axes.items()}
+
+        retest = self._screen_round({a: v for a, v in suspects.items() if v}, good, rng)
+        return {axis: [v for v in values if retest.get(axis, {}).get(v, 0) == 0]
+                for axis, values in suspects.items()}
+
+    def run(self, prune: bool = True) -> dict:
+        started = time.time()
+        full_size = 1
+        for values in self.axes.values():
+            full_size *= len(values)
+
+        pruned = self.screen() if prune and len(self.axes) > 1 else {}
+        kept = {axis: [v for v in values if v not in pruned.get(axis, [])] for axis, values in self.axes.items()}
+        for axis, values in pruned.items():
+            if values:
+                print(f"✂️ {axis}: pruned {', '.join(map(str, values))}")
+
+        aborted = None
+        if prune and self._probes and not any(r['ok'] for r in self._probes.values()):
+            # Ни один вариант отсева не прошёл - сервер недоступен, произведение не запускаем
+            aborted = 'no variant passed screening'
+            print(f"❌ {aborted}, full product skipped")
+            configs, results = [], list(self._probes.values())
+        else:
+            configs = expand(self.base, kept)
+            print(f"🧮 Testing {len(configs)} of {full_size} variants ({len(self._probes)} already probed)")
+            results = self._probe_all(configs)
+        return {
+            'aborted': aborted,
+            'base': self.base.name,
+            'axes': self.axes,
+            'pruned': {axis: values for axis, values in pruned.items() if values},
+            'full_size': full_size,
+            'tested': len(configs),
+            'probes': len(self._probes),
+            'samples': self.samples,
+            'elapsed': round(time.time() - started, 1),
+            'results': results,
+        }
+
+
+def pivot(results: list, rows: str, cols: str) -> dict:
+    """Сводная таблица: (строка, колонка) -> доля успехов и медиана задержки по всем вариантам ячейки"""
+    cells = {}
+    for r in results:
+        key = (str(r['axes'].get(rows, '-')), str(r['axes'].get(cols, '-')))
+        cell = cells.setdefault(key, {'ok': 0, 'samples': 0, 'latencies': []})
+        cell['ok'] += r['ok']
+        cell['samples'] += r['samples']
+        if r['latency_ms'] is not None:
+            cell['latencies'].append(r['latency_ms'])
+    return {key: {'success_rate': cell['ok'] / cell['samples'] if cell['samples'] else 0.0,
+                  'latency_ms': round(statistics.median(cell['latencies'])) if cell['latencies'] else None}
+            for key, cell in cells.items()}
+
+
+def render_md(summary: dict, rows: str, cols: str) -> str:
+    table = pivot(summary['results'], rows, cols)
+    row_values = list(dict.fromkeys(key[0] for key in table))
+    col_values = list(dict.fromkeys(key[1] for key in table))
+
+    md = f"""# 🧮 REALITY Matrix: {summary['base']}
+
+**Generated:** {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+| Metric | Value |
+|--------|-------|
+| Variants (full product) | {summary['full_size']} |
+| Variants tested | {summary['tested']} |
+| Probes (incl. screening) | {summary['probes']} |
+| Gate samples per variant | {summary['samples']} |
+| Elapsed | {summary['elapsed']}s |
+"""
+    if summary['aborted']:
+        md += f"\n**❌ Aborted:** {summary['aborted']} (table below - screening probes only)\n"
+    if summary['pruned']:
+        md += "\n## ✂️ Pruned\n\n" + ''.join(
+            f"- **{axis}**: {', '.join(map(str, values))}\n" for axis, values in summary['pruned'].items())
+
+    md += f"\n## 📊 {rows} × {cols} (success rate / median latency)\n\n"
+    md += f"| {rows} \\ {cols} | " + " | ".join(col_values) + " |\n"
+    md += "|---|" + "|".join('---' for _ in col_values) + "|\n"
+    for row in row_values:
+        cells = []
+        for col in col_values:
+            cell = table.get((row, col))
+            if cell is None:
+                cells.append('—')
+            else:
+                latency = f" / {cell['latency_ms']} ms" if cell['latency_ms'] is not None else ''
+                cells.append(f"{cell['success_rate'] * 100:.0f}%{latency}")
+        md += f"| {row} | " + " | ".join(cells) + " |\n"
+
+    md += "\n## ✅ Best Variants\n\n| Variant | Success | Latency |\n|---------|---------|---------|\n"
+    best = sorted((r for r in summary['results'] if r['ok']),
+                  key=lambda r: (-r['success_rate'], r['latency_ms']))[:10]
+    for r in best:
+        md += f"| {r['name']} | {r['success_rate'] * 100:.0f}% | {r['latency_ms']} ms |\n"
+    return md
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='REALITY parameter matrix')
+    parser.add_argument('base', help='vless:// ссылка или имя конфига из configs/')
+    parser.add_argument('--axis', action='append', required=True, metavar='NAME=V1,V2',
+                        help=f"Ось перебора ({', '.join(AXIS_PARAMS)}), можно несколько раз")
+    parser.add_argument('--rows', default='sni', help='Ось строк сводной таблицы')
+    parser.add_argument('--cols', default='fp', help='Ось колонок сводной таблицы')
+    parser.add_argument('--samples', type=int, default=MATRIX_SAMPLES)
+    parser.add_argument('--parallel', type=int, default=MATRIX_PARALLEL)
+    parser.add_argument('--no-prune', action='store_true', help='Без отсева - всё произведение')
+    args = parser.parse_args()
+
+    tester = VpnTester()
+    if args.base.startswith('vless://'):
+        base = VlessConfig(args.base)
+    else:
+        tester.load_configs()
+        base = next((c for c in tester.configs if c.name == args.base), None)
+        if base is None:
+            parser.error(f"Config {args.base} not found")
+
+    axes = {}
+    for spec in args.axis:
+        name, _, values = spec.partition('=')
+        axes[name.strip().lower()] = [v.strip() for v in values.split(',') if v.strip()]
+
+    summary = MatrixRunner(base, axes, args.samples, args.parallel, tester).run(prune=not args.no_prune)
+    md = render_md(summary, args.rows, args.cols)
+    print(md)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    write_report_file(REPORTS_DIR / f"matrix_{timestamp}.md", md)
+    write_report_file(REPORTS_DIR / f"matrix_{timestamp}.json", json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"📄 Saved: {REPORTS_DIR / f'matrix_{timestamp}.md'}")
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Metrics - счётчики и гистограммы в формате Prometheus (text exposition 0.0.4)
+
+Значения обновляются на месте по мере тестирования (через хуки instrumentation),
+/metrics только сериализует текущее состояние - никакого чтения отчётов.
+
+Тесты идут в процессах worker_daemon.py: каждый раз в METRICS_EXPORT_INTERVAL
+выгружает своё состояние в файл (export), а /metrics API складывает их со своим
+(collect): counters и гистограммы - сумма по всем файлам, gauges - только по
+свежим (процесс жив).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import instrumentation
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_EXPORT_INTERVAL = 5  # секунд между выгрузками процесса-воркера
+METRICS_STALE = 30  # секунд: gauges из файла старше не учитываются (процесс умер)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _merge(a, b):
+        return a + b
+
+    def snapshot(self) -> list:
+        """Состояние для выгрузки в файл: [[[[label, value], ...], value], ...]"""
+        with self._lock:
+            return [[[list(pair) for pair in key], value] for key, value in self._values.items()]
+
+    def _collect(self, foreign: list) -> list:
+        """Свои значения + значения других процессов (snapshot), сложенные по меткам"""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in foreign:
+            key = tuple(tuple(pair) for pair in key)
+            values[key] = self._merge(values[key], value) if key in values else value
+        return list(values.items())
+
+    def render(self, foreign: list = ()) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, value in self._collect(foreign):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Значение вычисляется при сериализации (для дешёвых len()/атрибутов)"""
+        self._function = function
+
+    def _refresh(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception:
+                pass
+
+    def snapshot(self) -> list:
+        self._refresh()
+        return super().snapshot()
+
+    def render(self, foreign: list = ()) -> list:
+        self._refresh()
+        return super().render(foreign)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @staticmethod
+    def _merge(a, b):
+        return {'counts': [x + y for x, y in zip(a['counts'], b['counts'])],
+                'sum': a['sum'] + b['sum'], 'count': a['count'] + b['count']}
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[[list(pair) for pair in key], dict(state, counts=list(state['counts']))]
+                    for key, state in self._values.items()]
+
+    def render(self, foreign: list = ()) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        items = [(key, state['counts'], state['sum'], state['count'])
+                 for key, state in self._collect(foreign)]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, foreign: dict = None) -> str:
+        foreign = foreign or {}
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(foreign.get(metric.name, ())))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PROBE_LATENCY = REGISTRY.register(Histogram(
+    'vpn_tester_probe_latency_seconds', 'Warm p50 latency of ping probes per target',
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+PHASE_DURATION = REGISTRY.register(Histogram(
+    'vpn_tester_phase_duration_seconds', 'Duration of test_config phases',
+    (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)))
+THROUGHPUT = REGISTRY.register(Histogram(
+    'vpn_tester_throughput_mbps', 'Aggregate speed test throughput',
+    (1, 5, 10, 25, 50, 100, 250, 500, 1000)))
+CONFIG_RESULTS = REGISTRY.register(Counter(
+    'vpn_tester_config_results_total', 'Config test outcomes (pass/fail)'))
+XRAY_PROCESSES = REGISTRY.register(Gauge(
+    'vpn_tester_xray_processes', 'Live Xray processes started by the tester'))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'vpn_tester_queue_depth', 'Configs left in the current test run'))
+TELEGRAM_DELIVERY = REGISTRY.register(Histogram(
+    'vpn_tester_telegram_delivery_seconds', 'Time to deliver a batch from the Telegram outbox, including proxy setup',
+    (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)))
+TELEGRAM_UPLOAD_BYTES = REGISTRY.register(Counter(
+    'vpn_tester_telegram_upload_bytes_total', 'Bytes of report attachments uploaded to Telegram'))
+TELEGRAM_OUTBOX = REGISTRY.register(Gauge(
+    'vpn_tester_telegram_outbox_pending', 'Telegram messages and documents waiting for delivery'))
+
+
+def observe_result(result: dict):
+    """Разложить результат test_config по метрикам"""
+    name = result.get('name', 'Unknown')
+    CONFIG_RESULTS.inc(config=name, result='pass' if result.get('status') == 'working' else 'fail')
+
+    for target, data in result.get('ping', {}).items():
+        if data.get('status') == 'ok':
+            PROBE_LATENCY.observe(data.get('time_ms', 0) / 1000, target=target, region=data.get('region', 'XX'))
+
+    for data in result.get('speed', {}).values():
+        if data.get('status') == 'ok':
+            THROUGHPUT.observe(data.get('speed_mbps', 0))
+
+
+def _on_phase(phase: str, duration: float, context: dict):
+    if phase == 'total':
+        if 'result' in context:
+            observe_result(context['result'])
+        return
+    PHASE_DURATION.observe(duration, phase=phase)
+
+
+def install():
+    """Подписаться на замеры instrumentation (идемпотентно)"""
+    instrumentation.add_hook(_on_phase)
+
+
+def export(directory: Path, name: str):
+    """Выгрузить состояние этого процесса в <directory>/<name>.json (атомарно)"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / (re.sub(r'[^\w.-]+', '_', name) + '.json')
+    tmp_file = path.with_suffix('.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump({'at': time.time(), 'metrics': REGISTRY.snapshot()}, f, separators=(',', ':'))
+    os.replace(tmp_file, path)
+
+
+def collect(directory: Path) -> dict:
+    """Выгрузки других процессов: {metric: [[key, value], ...]}"""
+    foreign = {}
+    gauges = {metric.name for metric in REGISTRY._metrics if isinstance(metric, Gauge)}
+    for path in sorted(Path(directory).glob("*.json")) if directory and Path(directory).is_dir() else []:
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        fresh = time.time() - data.get('at', 0) <= METRICS_STALE
+        for name, values in data.get('metrics', {}).items():
+            # Счётчики умершего процесса остаются в сумме, его gauges - уже нет
+            if name in gauges and not fresh:
+                continue
+            foreign.setdefault(name, []).extend(values)
+    return foreign
+
+
+def reset(directory: Path):
+    """Удалить выгрузки (старт демона: процессы прошлого запуска уже не придут)"""
+    for path in Path(directory).glob("*.json") if Path(directory).is_dir() else []:
+        path.unlink(missing_ok=True)
+
+
+def render(directory: Path = None) -> str:
+    """Метрики этого процесса + выгрузки процессов-воркеров из directory"""
+    return REGISTRY.render(collect(directory) if directory else None)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Retention - хранение отчётов и логов: свёртка старых прогонов, архив, бюджет диска
+
+Свежие прогоны хранятся полностью. Прогоны старше RETENTION_DAYS сворачиваются
+в reports/rollup.json (по дням и конфигам: доля успехов и перцентили задержки),
+а сырые файлы уходят в reports/archive/ (gzip) или удаляются. Если reports/ + logs/
+всё равно больше бюджета - удаляется самое старое, начиная с архива.
+
+Никогда не трогаются: последние RETENTION_KEEP_RUNS прогонов и отчётов,
+незавершённые прогоны моложе RETENTION_DAYS, latest.*, history.json, rollup.json.
+
+    import retention
+    summary = retention.enforce(reports_dir, logs_dir, dry_run=True)
+"""
+
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from stats import median_ping
+
+RETENTION_DAYS = int(os.environ.get('REPORT_RETENTION_DAYS', 14))  # полная детализация
+RETENTION_KEEP_RUNS = 10  # последних прогонов/отчётов храним всегда, независимо от возраста
+RETENTION_MODE = os.environ.get('REPORT_RETENTION_MODE', 'archive')  # archive | delete
+DISK_BUDGET_MB = int(os.environ.get('REPORTS_DISK_BUDGET_MB', 500))  # reports/ + logs/
+LOG_STALE_HOURS = 24  # xray_*.json старше - остались от упавших процессов
+ROLLUP_LATENCY_SAMPLES = 288  # замеров задержки на конфиг в день (раз в 5 минут)
+
+_lock = threading.Lock()  # один проход за раз в процессе
+# ...и между процессами (API, воркеры worker_daemon.py, CLI): rollup.json - read-modify-write
+RETENTION_LOCK = "retention.lock"
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _size(path: Path) -> int:
+    try:
+        if path.is_dir():
+            return sum(_size(p) for p in path.iterdir())
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _archive(path: Path, archive_dir: Path) -> Path:
+    """Сжать файл в archive_dir (уже готовый <file>.gz переносится как есть)"""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    target = archive_dir / (path.name + '.gz')
+    gz_sibling = path.with_name(path.name + '.gz')
+    if gz_sibling.exists():
+        os.replace(gz_sibling, target)
+    else:
+        with open(path, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+    path.unlink()
+    return target
+
+
+def _journal_rows(f):
+    """Результаты из открытого журнала прогона (jsonl), битые строки пропускаются"""
+    for line in f:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+class Rollup:
+    """
+    Свёрнутая статистика по дням: {day: {config: {attempts, successes,
+    success_rate, latency_ms: [...], p50_ms, p95_ms}}}.
+    Уже свёрнутые прогоны помнятся по run_id - повторная свёртка ничего не удваивает.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault('days', {})
+        data.setdefault('runs', [])
+        return data
+
+    def save(self):
+        tmp_file = self.path.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.data, f, separators=(',', ':'))
+        os.replace(tmp_file, self.path)
+
+    def add_run(self, run_id: str, started: float, results) -> bool:
+        """Свернуть результаты прогона в статистику дня его запуска"""
+        if run_id in self.data['runs']:
+            return False
+        day = datetime.fromtimestamp(started).strftime('%Y-%m-%d')
+        configs = self.data['days'].setdefault(day, {})
+        for result in results:
+            entry = configs.setdefault(result.get('name', 'Unknown'),
+                                       {'attempts': 0, 'successes': 0, 'latency_ms': []})
+            entry['attempts'] += 1
+            if result.get('status') == 'working':
+                entry['successes'] += 1
+                latency = median_ping(result)
+                if latency is not None:
+                    entry['latency_ms'] = (entry['latency_ms'] + [round(latency)])[-ROLLUP_LATENCY_SAMPLES:]
+            entry['success_rate'] = round(entry['successes'] / entry['attempts'], 3)
+            if entry['latency_ms']:
+                entry['p50_ms'] = _percentile(entry['latency_ms'], 0.5)
+                entry['p95_ms'] = _percentile(entry['latency_ms'], 0.95)
+        self.data['runs'].append(run_id)
+        return True
+
+    def query(self, config: str = None, days: int = None) -> dict:
+        """Статистика по дням (без сырых замеров), опционально по одному конфигу"""
+        selected = sorted(self.data['days'].items(), reverse=True)
+        if days:
+            selected = selected[:days]
+        out = {}
+        for day, configs in selected:
+            rows = {name: {k: v for k, v in entry.items() if k != 'latency_ms'}
+                    for name, entry in configs.items() if config is None or name == config}
+            if rows:
+                out[day] = rows
+        return out
+
+
+class _Pass:
+    """Один проход политики: собирает список действий и выполняет их (если не dry_run)"""
+
+    def __init__(self, reports_dir: Path, logs_dir: Path, dry_run: bool):
+        self.reports_dir = reports_dir
+        self.logs_dir = logs_dir
+        self.runs_dir = reports_dir / "runs"
+        self.archive_dir = reports_dir / "archive"
+        self.dry_run = dry_run
+        self.archive = RETENTION_MODE == 'archive'
+        self.rollup = Rollup(reports_dir / "rollup.json")
+        self.summary = {'rolled_up': [], 'archived': [], 'deleted': [], 'freed_bytes': 0}
+
+    def _drop(self, path: Path, archive: bool):
+        if not path.exists():
+            return
+        if self.dry_run:
+            self.summary['freed_bytes'] += _size(path)
+            self.summary['archived' if archive else 'deleted'].append(path.name)
+        elif archive and path.is_file():
+            before = _size(path) + _size(path.with_name(path.name + '.gz'))
+            target = _archive(path, self.archive_dir)
+            self.summary['freed_bytes'] += before - _size(target)
+            self.summary['archived'].append(path.name)
+        else:
+            self.summary['freed_bytes'] += _size(path)
+            _remove(path)
+            self.summary['deleted'].append(path.name)
+
+    def runs(self) -> list:
+        """Журналы прогонов от новых к старым: (run_id, meta, started)"""
+        runs = []
+        for meta_file in sorted(self.runs_dir.glob("run_*.meta.json"), reverse=True):
+            run_id = meta_file.name[len('run_'):-len('.meta.json')]
+            try:
+                with open(meta_file, 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            runs.append((run_id, meta, meta.get('created') or meta_file.stat().st_mtime))
+        return runs
+
+    def reports(self) -> list:
+        """Отчёты от новых к старым: (stem, mtime)"""
+        reports = []
+        for html_file in sorted(self.reports_dir.glob("report_*.html"), reverse=True):
+            try:
+                reports.append((html_file.stem, html_file.stat().st_mtime))
+            except OSError:
+                continue
+        return reports
+
+    def expire_run(self, run_id: str, meta: dict, started: float, archive: bool):
+        """Свернуть журнал в rollup и убрать сырые файлы (вместе с его отчётом)"""
+        journal = self.runs_dir / f"run_{run_id}.jsonl"
+        if journal.exists() and not self.dry_run:
+            with open(journal, 'r') as f:
+                added = self.rollup.add_run(run_id, started, _journal_rows(f))  # построчно, не списком
+            if added:
+                self.rollup.save()  # до удаления журнала - иначе данные теряются при сбое
+        self.summary['rolled_up'].append(run_id)
+        self._drop(journal, archive)
+        self._drop(self.runs_dir / f"run_{run_id}.meta.json", False)
+        if meta.get('report'):
+            self.expire_report(Path(meta['report']).stem, archive)
+
+    def expire_report(self, stem: str, archive: bool):
+        """HTML/MD сжимаются в архив, .data (копия журнала) удаляется"""
+        for suffix in ('.html', '.md', '.diff.md'):
+            self._drop(self.reports_dir / f"{stem}{suffix}", archive)
+            self._drop(self.reports_dir / f"{stem}{suffix}.gz", False)
+        self._drop(self.reports_dir / f"{stem}.data", False)
+
+    def clean_logs(self, cutoff: float):
+        now = time.time()
+        for pattern, max_age in (("access_*.log", 0), ("error_*.log", 0),
+                                 ("xray_*.json", LOG_STALE_HOURS * 3600),
+                                 ("profile_*.prof", now - cutoff)):
+            for path in self.logs_dir.glob(pattern):
+                try:
+                    if now - path.stat().st_mtime >= max_age:
+                        self._drop(path, False)
+                except OSError:
+                    continue
+
+    def usage(self) -> int:
+        return _size(self.reports_dir) + _size(self.logs_dir)
+
+
+def enforce(reports_dir: Path, logs_dir: Path, dry_run: bool = False, days: int = None,
+            budget_mb: int = None) -> dict:
+    """
+    Применить политику хранения. Возвращает сводку:
+    {rolled_up, archived, deleted, freed_bytes, usage_bytes, budget_bytes}
+    """
+    days = RETENTION_DAYS if days is None else days
+    budget = (DISK_BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024
+    cutoff = time.time() - days * 86400
+
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    with _lock, open(reports_dir / RETENTION_LOCK, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        p = _Pass(reports_dir, logs_dir, dry_run)
+        runs = p.runs()
+        expired_reports = set()
+
+        # 1. По возрасту: старые прогоны -> rollup + архив
+        for run_id, meta, started in runs[RETENTION_KEEP_RUNS:]:
+            if started < cutoff:
+                p.expire_run(run_id, meta, started, p.archive)
+                if meta.get('report'):
+                    expired_reports.add(Path(meta['report']).stem)
+
+        # Отчёты без журнала (старые версии, одиночные тесты) - только по возрасту файла
+        for stem, mtime in p.reports()[RETENTION_KEEP_RUNS:]:
+            if mtime < cutoff and stem not in expired_reports:
+                p.expire_report(stem, p.archive)
+
+        p.clean_logs(cutoff)
+
+        # 2. Бюджет диска: архив, затем самые старые прогоны и отчёты сверх защищённых
+        usage, freed = p.usage(), p.summary['freed_bytes']
+
+        def over_budget() -> bool:
+            return usage - (p.summary['freed_bytes'] - freed) > budget
+
+        if not dry_run and over_budget():
+            archived = sorted(p.archive_dir.glob("*"), key=lambda f: f.stat().st_mtime) \
+                if p.archive_dir.exists() else []
+            for path in archived:
+                if not over_budget():
+                    break
+                p._drop(path, False)
+            for run_id, meta, started in reversed(p.runs()[RETENTION_KEEP_RUNS:]):
+                if not over_budget():
+                    break
+                if meta.get('completed') or started < cutoff:
+                    p.expire_run(run_id, meta, started, False)
+            for stem, _ in reversed(p.reports()[RETENTION_KEEP_RUNS:]):
+                if not over_budget():
+                    break
+                p.expire_report(stem, False)
+
+        p.summary['usage_bytes'] = p.usage()
+        p.summary['budget_bytes'] = budget
+        return p.summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Report retention policy')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет сделано')
+    parser.add_argument('--days', type=int, default=None, help=f'Полная детализация, дней (по умолчанию {RETENTION_DAYS})')
+    parser.add_argument('--budget-mb', type=int, default=None, help=f'Бюджет диска (по умолчанию {DISK_BUDGET_MB})')
+    args = parser.parse_args()
+
+    print(json.dumps(enforce(base_dir / "reports", base_dir / "logs", args.dry_run, args.days, args.budget_mb),
+                     indent=2))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Run Diff - сравнение прогона с предыдущим и компактный отчёт об изменениях
+
+Что считается изменением:
+  up / down          - конфиг начал / перестал работать
+  new / removed      - конфиг появился / пропал из прогона
+  latency / speed    - медиана пинга выросла или скорость упала больше порога
+
+    import run_diff
+    delta = run_diff.diff_runs(previous_results, current_results)
+    print(run_diff.render_md(delta))
+"""
+
+import html
+
+from stats import median_ping
+
+LATENCY_THRESHOLD = 0.25  # рост медианы пинга на 25%+ - регрессия
+LATENCY_MIN_DELTA_MS = 20  # ...но не меньше чем на 20 мс (шум на быстрых конфигах)
+SPEED_THRESHOLD = 0.25  # падение скорости на 25%+ - регрессия
+TELEGRAM_ROWS = 15  # строк на раздел в сообщении Telegram
+
+
+def _speed(result: dict) -> float:
+    speeds = [data.get('speed_mbps', 0) for data in result.get('speed', {}).values()
+              if data.get('status') == 'ok']
+    return max(speeds) if speeds else None
+
+
+def _working(result: dict) -> bool:
+    return result.get('status') == 'working'
+
+
+def diff_runs(previous: list, current: list, latency_threshold: float = LATENCY_THRESHOLD,
+              speed_threshold: float = SPEED_THRESHOLD) -> dict:
+    """Сравнить результаты двух прогонов (списки result из журнала)"""
+    before = {r.get('name', 'Unknown'): r for r in previous}
+    after = {r.get('name', 'Unknown'): r for r in current}
+
+    delta = {'up': [], 'down': [], 'new': [], 'removed': [],
+             'latency_regressions': [], 'speed_regressions': [],
+             'working': sum(1 for r in after.values() if _working(r)),
+             'working_before': sum(1 for r in before.values() if _working(r)),
+             'total': len(after), 'total_before': len(before)}
+
+    for name, result in after.items():
+        old = before.get(name)
+        if old is None:
+            delta['new'].append({'name': name, 'status': result.get('status')})
+            continue
+        if _working(result) != _working(old):
+            delta['up' if _working(result) else 'down'].append(
+                {'name': name, 'status_before': old.get('status'), 'status': result.get('status'),
+                 'failure_class': result.get('failure_class')})
+            continue
+        if not _working(result):
+            continue
+
+        ping_before, ping_after = median_ping(old), median_ping(result)
+        if ping_before and ping_after and ping_after - ping_before >= LATENCY_MIN_DELTA_MS \
+                and ping_after > ping_before * (1 + latency_threshold):
+            delta['latency_regressions'].append(
+                {'name': name, 'before_ms': round(ping_before), 'after_ms': round(ping_after),
+                 'change': round(ping_after / ping_before - 1, 3)})
+
+        speed_before, speed_after = _speed(old), _speed(result)
+        if speed_before and speed_after is not None and speed_after < speed_before * (1 - speed_threshold):
+            delta['speed_regressions'].append(
+                {'name': name, 'before_mbps': speed_before, 'after_mbps': speed_after,
+                 'change': round(speed_after / speed_before - 1, 3)})
+
+    delta['removed'] = [{'name': name, 'status_before': old.get('status')}
+                        for name, old in before.items() if name not in after]
+    for key in ('latency_regressions', 'speed_regressions'):
+        delta[key].sort(key=lambda row: row['change'], reverse=key == 'latency_regressions')
+    delta['changed'] = any(delta[key] for key in ('up', 'down', 'new', 'removed',
+                                                  'latency_regressions', 'speed_regressions'))
+    return delta
+
+
+def _lines(delta: dict, limit: int = None) -> list:
+    """Разделы отчёта: [(заголовок, [строки])] - общий код для MD и Telegram"""
+    sections = [
+        ('🟢 UP', [f"{r['name']} ({r['status_before']} → working)" for r in delta['up']]),
+        ('🔴 DOWN', [f"{r['name']} ({r['status']}{', ' + r['failure_class'] if r.get('failure_class') else ''})"
+                    for r in delta['down']]),
+        ('🐢 LATENCY', [f"{r['name']}: {r['before_ms']} → {r['after_ms']} ms (+{r['change'] * 100:.0f}%)"
+                       for r in delta['latency_regressions']]),
+        ('📉 SPEED', [f"{r['name']}: {r['before_mbps']:.2f} → {r['after_mbps']:.2f} Mbps ({r['change'] * 100:.0f}%)"
+                     for r in delta['speed_regressions']]),
+        ('➕ NEW', [f"{r['name']} ({r['status']})" for r in delta['new']]),
+        ('➖ REMOVED', [r['name'] for r in delta['removed']]),
+    ]
+    out = []
+    for title, rows in sections:
+        if not rows:
+            continue
+        total = len(rows)
+        if limit and total > limit:
+            rows = rows[:limit] + [f"... +{total - limit} more"]
+        out.append((f"{title} ({total})", rows))
+    return out
+
+
+def _counts(delta: dict) -> str:
+    return (f"Working: {delta['working_before']} → {delta['working']} "
+            f"(of {delta['total_before']} → {delta['total']})")
+
+
+def render_md(delta: dict, title: str = 'VPN Test Delta') -> str:
+    """Компактный MD отчёт об изменениях"""
+    md = f"# {title}\n\n{_counts(delta)}\n"
+    if not delta['changed']:
+        return md + "\nNo changes since the previous run.\n"
+    for section, rows in _lines(delta):
+        md += f"\n## {section}\n\n" + ''.join(f"- {row}\n" for row in rows)
+    return md
+
+
+def render_telegram(delta: dict, limit: int = TELEGRAM_ROWS) -> str:
+    """Тот же отчёт в HTML разметке Telegram (укладывается в одно сообщение)"""
+    text = f"<b>{html.escape(_counts(delta))}</b>\n"
+    if not delta['changed']:
+        return text + "\nNo changes since the previous run."
+    for section, rows in _lines(delta, limit):
+        text += f"\n<b>{section}</b>\n" + ''.join(f"• <code>{html.escape(row)}</code>\n" for row in rows)
+    return text
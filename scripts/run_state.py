@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Run State - общее состояние прогонов в SQLite (WAL)
+
+Задания (jobs) и их прогресс лежат в базе, а не в глобальной переменной
+процесса: статус читается из любого процесса WSGI сервера, чтение не мешает
+записи (WAL), а прогон может идти в отдельном процессе.
+
+Исполнитель задания раз в JOB_HEARTBEAT секунд обновляет heartbeat. Задание
+со старым heartbeat (процесс умер) считается потерянным и не блокирует новые.
+
+Задание делится на задачи (tasks) - по одной на конфиг и точку замера
+(vantage). Их разбирают процессы worker_daemon.py и удалённые воркеры cluster.py
+(только задачи своей точки); задача умершего воркера возвращается в очередь.
+
+    state = RunState(REPORTS_DIR / "state.db")
+    job_id = state.create_job('test', {'resume': None})   # None - уже идёт другой
+    job = state.claim_job('worker-1')                     # воркер: queued -> running
+    state.add_tasks(job['id'], [{'name': ..., 'url': ...}])
+    task = state.claim_task('worker-1')
+    state.finish_task(task['id'])
+    state.claim_finalize(job['id'])                       # True - последний, строит отчёт
+    state.finish(job_id)
+    state.status()                                        # формат /api/test/status
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+JOB_HEARTBEAT = 15  # секунд между отметками "живой"
+JOB_STALE = 90  # секунд без отметки - исполнитель потерян
+TASK_MAX_ATTEMPTS = 2  # задача, дважды потерянная вместе с воркером, - failed
+TASK_CLAIM_GRACE = 2 * JOB_HEARTBEAT  # секунд: только что взятая задача может ещё не дойти до воркера
+DEFAULT_VANTAGE = 'local'  # точка замера по умолчанию - этот сервер
+
+ACTIVE_STATES = ('queued', 'running', 'finalizing')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'queued',
+    run_id TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    current INTEGER NOT NULL DEFAULT 0,
+    current_config TEXT NOT NULL DEFAULT '',
+    error TEXT,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    vantage TEXT NOT NULL DEFAULT 'local',
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, job_id, id);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    vantage TEXT NOT NULL,
+    parallel INTEGER NOT NULL DEFAULT 1,
+    host TEXT,
+    registered REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+MIGRATIONS = [
+    ('tasks', 'vantage', "TEXT NOT NULL DEFAULT 'local'"),
+]
+
+
+class RunState:
+    """Задания прогонов в SQLite: одно соединение на поток, запись - короткими транзакциями"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            for table, column, definition in MIGRATIONS:
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone()
+                if exists and column not in {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'] or '{}')
+        return job
+
+    def _expire_stale(self, conn: sqlite3.Connection):
+        """Задания, чей исполнитель перестал отмечаться, - в failed"""
+        conn.execute(
+            "UPDATE jobs SET state = 'failed', error = 'worker lost (no heartbeat)', finished = ? "
+            "WHERE state IN ('running', 'finalizing') AND heartbeat < ?",
+            (time.time(), time.time() - JOB_STALE))
+
+    def _requeue_stale(self, conn: sqlite3.Connection):
+        """Задачи умерших воркеров - обратно в очередь (или в failed после TASK_MAX_ATTEMPTS)"""
+        stale = time.time() - JOB_STALE
+        conn.execute(
+            "UPDATE tasks SET state = 'failed', error = 'worker lost (no heartbeat)' "
+            "WHERE state = 'running' AND heartbeat < ? AND attempts >= ?", (stale, TASK_MAX_ATTEMPTS))
+        conn.execute(
+            "UPDATE tasks SET state = 'queued', worker = NULL "
+            "WHERE state = 'running' AND heartbeat < ?", (stale,))
+
+    def _transaction(self, fn):
+        """fn(conn) в одной транзакции с блокировкой записи (несколько процессов)"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def create_job(self, kind: str, params: dict = None, exclusive: bool = True) -> int:
+        """
+        Новое задание в очереди. exclusive - только если нет активного задания
+        того же вида (иначе None). Проверка и вставка - одна транзакция.
+        """
+        def create(conn):
+            self._expire_stale(conn)
+            if exclusive and conn.execute(
+                    f"SELECT 1 FROM jobs WHERE kind = ? AND state IN {ACTIVE_STATES}", (kind,)).fetchone():
+                return None
+            return conn.execute(
+                "INSERT INTO jobs (kind, params, created) VALUES (?, ?, ?)",
+                (kind, json.dumps(params or {}), time.time())).lastrowid
+        return self._transaction(create)
+
+    def start(self, job_id: int, worker: str = None):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET state = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+            (worker, now, now, job_id))
+
+    def update(self, job_id: int, **fields):
+        """Прогресс: total, current, current_config, run_id (заодно heartbeat)"""
+        fields['heartbeat'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def heartbeat(self, job_id: int, task_id: int = None):
+        self.update(job_id)
+        if task_id is not None:
+            self._connect().execute("UPDATE tasks SET heartbeat = ? WHERE id = ?", (time.time(), task_id))
+
+    def claim_job(self, worker: str, job_id: int = None) -> dict:
+        """Взять старейшее задание из очереди (или конкретное job_id): queued -> running"""
+        def claim(conn):
+            self._expire_stale(conn)
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' AND (? IS NULL OR id = ?) ORDER BY id LIMIT 1",
+                (job_id, job_id)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET state = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                         (worker, now, now, row['id']))
+            return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+        return self._transaction(claim)
+
+    def add_tasks(self, job_id: int, tasks: list):
+        """Задачи задания: [{'name': ..., 'vantage': ..., ...}] - весь словарь уходит в payload"""
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT INTO tasks (job_id, name, vantage, payload) VALUES (?, ?, ?, ?)",
+            [(job_id, task['name'], task.get('vantage', DEFAULT_VANTAGE), json.dumps(task, ensure_ascii=False))
+             for task in tasks]))
+
+    @staticmethod
+    def _live_workers(conn: sqlite3.Connection, vantage: str) -> int:
+        return conn.execute("SELECT COUNT(*) FROM workers WHERE vantage = ? AND last_seen >= ?",
+                            (vantage, time.time() - JOB_STALE)).fetchone()[0]
+
+    def claim_tasks(self, worker: str, limit: int = 1, job_id: int = None,
+                    vantage: str = DEFAULT_VANTAGE, fair: bool = False) -> list:
+        """
+        Взять до limit задач своей точки замера (задания в состоянии running).
+        fair - не больше своей доли очереди среди живых воркеров этой точки:
+        каждый получает свой шард, а не всё первым же запросом.
+        """
+        def claim(conn):
+            self._expire_stale(conn)
+            self._requeue_stale(conn)
+            where = ("FROM tasks JOIN jobs ON jobs.id = tasks.job_id WHERE tasks.state = 'queued' "
+                     "AND jobs.state = 'running' AND tasks.vantage = ? AND (? IS NULL OR jobs.id = ?)")
+            args = (vantage, job_id, job_id)
+            count = limit
+            if fair:
+                queued = conn.execute(f"SELECT COUNT(*) {where}", args).fetchone()[0]
+                count = min(limit, -(-queued // max(self._live_workers(conn, vantage), 1)))
+            ids = [row['id'] for row in conn.execute(
+                f"SELECT tasks.id {where} ORDER BY tasks.id LIMIT ?", (*args, count))]
+            now = time.time()
+            conn.executemany("UPDATE tasks SET state = 'running', worker = ?, attempts = attempts + 1, "
+                             "heartbeat = ? WHERE id = ?", [(worker, now, task_id) for task_id in ids])
+            tasks = []
+            for task_id in ids:
+                task = dict(conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone())
+                task['payload'] = json.loads(task['payload'])
+                tasks.append(task)
+            return tasks
+        return self._transaction(claim)
+
+    def claim_task(self, worker: str, job_id: int = None, vantage: str = DEFAULT_VANTAGE) -> dict:
+        """Взять одну задачу из очереди. None - брать нечего"""
+        tasks = self.claim_tasks(worker, 1, job_id, vantage)
+        return tasks[0] if tasks else None
+
+    def running_task(self, task_id: int) -> dict:
+        """Задача, если она сейчас в работе (None - уже готова или возвращена в очередь)"""
+        row = self._connect().execute("SELECT id, job_id, name, vantage, worker FROM tasks "
+                                      "WHERE id = ? AND state = 'running'", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def finish_task(self, task_id: int, error: str = None, worker: str = None, on_finish=None) -> bool:
+        """
+        Задача готова: +1 к прогрессу задания. С worker - только если задача всё ещё
+        у него (иначе её уже вернули в очередь и отдали другому) - тогда False.
+        on_finish() - только для засчитанной задачи, в той же транзакции: до него
+        claim_finalize её не видит, ошибка в нём оставляет задачу running.
+        """
+        def finish(conn):
+            row = conn.execute("SELECT job_id, worker FROM tasks WHERE id = ? AND state = 'running'",
+                               (task_id,)).fetchone()
+            if row is None or (worker is not None and row['worker'] != worker):
+                return False
+            conn.execute("UPDATE tasks SET state = ?, error = ?, heartbeat = ? WHERE id = ?",
+                         ('failed' if error else 'done', error, time.time(), task_id))
+            conn.execute("UPDATE jobs SET current = current + 1, heartbeat = ? WHERE id = ?",
+                         (time.time(), row['job_id']))
+            if on_finish is not None:
+                on_finish()
+            return True
+        return self._transaction(finish)
+
+    def worker_seen(self, name: str, vantage: str = DEFAULT_VANTAGE, parallel: int = 1, host: str = None,
+                    active: list = None):
+        """
+        Воркер жив: запись в реестре, heartbeat его задач и заданий, которые
+        ждут его точку замера (задание не считается потерянным, пока есть кому его делать).
+
+        active - id задач, которые воркер сейчас выполняет (cluster.py): отмечаются
+        только они, остальные его задачи (результат так и не отправлен, ответ на claim
+        потерялся) возвращаются в очередь, если взяты раньше TASK_CLAIM_GRACE.
+        None - отмечаются все его задачи.
+        """
+        def seen(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT INTO workers (name, vantage, parallel, host, registered, last_seen) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET vantage = excluded.vantage, parallel = excluded.parallel, "
+                "host = COALESCE(excluded.host, host), last_seen = excluded.last_seen",
+                (name, vantage, parallel, host, now, now))
+            if active is None:
+                conn.execute("UPDATE tasks SET heartbeat = ? WHERE worker = ? AND state = 'running'", (now, name))
+            else:
+                self._sync_active(conn, name, {int(task_id) for task_id in active}, now)
+            conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND id IN "
+                "(SELECT job_id FROM tasks WHERE vantage = ? AND state IN ('queued', 'running'))", (now, vantage))
+        self._transaction(seen)
+
+    @staticmethod
+    def _sync_active(conn: sqlite3.Connection, name: str, active: set, now: float):
+        rows = conn.execute("SELECT id, attempts, heartbeat FROM tasks WHERE worker = ? AND state = 'running'",
+                            (name,)).fetchall()
+        conn.executemany("UPDATE tasks SET heartbeat = ? WHERE id = ?",
+                         [(now, row['id']) for row in rows if row['id'] in active])
+        dropped = [row for row in rows if row['id'] not in active and row['heartbeat'] < now - TASK_CLAIM_GRACE]
+        conn.executemany("UPDATE tasks SET state = 'failed', error = 'dropped by worker' WHERE id = ?",
+                         [(row['id'],) for row in dropped if row['attempts'] >= TASK_MAX_ATTEMPTS])
+        conn.executemany("UPDATE tasks SET state = 'queued', worker = NULL WHERE id = ?",
+                         [(row['id'],) for row in dropped if row['attempts'] < TASK_MAX_ATTEMPTS])
+
+    def workers(self) -> list:
+        """Реестр воркеров: живые (отмечались за JOB_STALE секунд) и сколько задач у каждого"""
+        now = time.time()
+        rows = self._connect().execute(
+            "SELECT workers.*, (SELECT COUNT(*) FROM tasks WHERE tasks.worker = workers.name "
+            "AND tasks.state = 'running') AS running FROM workers ORDER BY vantage, name").fetchall()
+        return [dict(row, alive=row['last_seen'] >= now - JOB_STALE) for row in rows]
+
+    def finalizable(self) -> list:
+        """Задания, у которых все задачи готовы, а отчёт ещё никто не строит"""
+        return [row['id'] for row in self._connect().execute(
+            "SELECT id FROM jobs WHERE state = 'running' AND EXISTS (SELECT 1 FROM tasks WHERE job_id = jobs.id) "
+            "AND NOT EXISTS (SELECT 1 FROM tasks WHERE job_id = jobs.id AND state IN ('queued', 'running'))")]
+
+    def claim_finalize(self, job_id: int) -> bool:
+        """Все задачи готовы - ровно один воркер получает True и строит отчёт"""
+        def claim(conn):
+            if conn.execute("SELECT 1 FROM tasks WHERE job_id = ? AND state IN ('queued', 'running')",
+                            (job_id,)).fetchone():
+                return False
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'finalizing', current_config = 'Generating report...', heartbeat = ? "
+                "WHERE id = ? AND state = 'running'", (time.time(), job_id))
+            return cursor.rowcount == 1
+        return self._transaction(claim)
+
+    def tasks(self, job_id: int) -> list:
+        return [dict(row) for row in self._connect().execute(
+            "SELECT id, name, vantage, state, attempts, worker, error FROM tasks WHERE job_id = ? ORDER BY id", (job_id,))]
+
+    def finish(self, job_id: int, error: str = None):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, error = ?, finished = ?, heartbeat = ? WHERE id = ?",
+            ('failed' if error else 'done', error, time.time(), time.time(), job_id))
+
+    def get(self, job_id: int) -> dict:
+        return self._row(self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def latest(self, kind: str = 'test') -> dict:
+        conn = self._connect()
+        self._expire_stale(conn)
+        return self._row(conn.execute(
+            "SELECT * FROM jobs WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)).fetchone())
+
+    def status(self, kind: str = 'test') -> dict:
+        """Последнее задание в формате /api/test/status"""
+        job = self.latest(kind)
+        if job is None:
+            return {'running': False, 'total': 0, 'current': 0, 'current_config': '', 'completed': False,
+                    'error': None, 'start_time': None, 'end_time': None, 'run_id': None}
+        return {
+            'running': job['state'] in ACTIVE_STATES,
+            'state': job['state'],
+            'job_id': job['id'],
+            'total': job['total'],
+            'current': job['current'],
+            'current_config': job['current_config'],
+            'completed': job['state'] == 'done',
+            'error': job['error'],
+            'start_time': job['started'] or job['created'],
+            'end_time': job['finished'],
+            'run_id': job['run_id']
+        }
+
+
+class Heartbeat:
+    """Фоновая отметка "живой" для задания (и задачи task_id), пока идёт блок with"""
+
+    def __init__(self, state: RunState, job_id: int, interval: float = JOB_HEARTBEAT, task_id: int = None):
+        self.state = state
+        self.job_id = job_id
+        self.task_id = task_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.state.heartbeat(self.job_id, self.task_id)
+            except sqlite3.Error as e:
+                print(f"Heartbeat error: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Soak - длительная проверка туннелей (часы) с прореживанием временного ряда
+
+Туннели (Xray) держатся открытыми всё время, через каждый с постоянным шагом
+идёт gate запрос. Результаты копятся в кольцевых буферах фиксированного
+размера на нескольких разрешениях: последние пробы как есть, дальше корзины
+по 1 минуте и по 15 минут. Память не растёт, сколько бы ни шёл прогон.
+
+Раз в SOAK_SNAPSHOT секунд и в конце пишется отчёт reports/soak_<ts>.md (+ .json):
+по каждому конфигу аптайм, простои, перезапуски Xray и задержка во времени.
+
+    python3 soak.py cfg1 cfg2 --duration 8h --interval 10
+    python3 soak.py --first 3 --duration 30m
+    python3 vpn_tester.py soak ...      # то же самое
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from vpn_tester import VpnTester, VlessConfig, REPORTS_DIR, write_report_file, _free_port
+
+SOAK_INTERVAL = 10  # секунд между пробами одного конфига
+SOAK_DURATION = 8 * 60 * 60  # как TEST_DURATION в mass_test_europe.py
+SOAK_SNAPSHOT = 15 * 60  # секунд между промежуточными отчётами
+SOAK_RAW_POINTS = 360  # последних проб как есть (час при шаге 10 с)
+# Прореживание: (шаг корзины в секундах, сколько корзин хранить)
+SOAK_RESOLUTIONS = [(60, 24 * 60), (15 * 60, 7 * 24 * 4)]  # сутки поминутно, неделя по 15 минут
+SPARK = '▁▂▃▄▅▆▇█'
+
+
+class Bucket:
+    """Агрегат проб за интервал [start, start + step)"""
+
+    __slots__ = ('start', 'count', 'ok', 'latency_sum', 'latency_min', 'latency_max')
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.ok = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+
+    def add(self, ok: bool, latency_ms: float = None):
+        self.count += 1
+        if ok:
+            self.ok += 1
+            self.latency_sum += latency_ms
+            self.latency_min = latency_ms if self.latency_min is None else min(self.latency_min, latency_ms)
+            self.latency_max = latency_ms if self.latency_max is None else max(self.latency_max, latency_ms)
+
+    def to_dict(self) -> dict:
+        return {
+            'start': self.start,
+            'count': self.count,
+            'uptime': round(self.ok / self.count, 4) if self.count else None,
+            'latency_avg_ms': round(self.latency_sum / self.ok, 1) if self.ok else None,
+            'latency_min_ms': round(self.latency_min, 1) if self.ok else None,
+            'latency_max_ms': round(self.latency_max, 1) if self.ok else None,
+        }
+
+
+class RingSeries:
+    """Временной ряд одного конфига: кольца фиксированного размера на каждом разрешении"""
+
+    def __init__(self, raw_points: int = SOAK_RAW_POINTS, resolutions: list = None):
+        self.raw = deque(maxlen=raw_points)  # (время, ok, задержка)
+        self.levels = [(step, deque(maxlen=size)) for step, size in (resolutions or SOAK_RESOLUTIONS)]
+        self._current = [None] * len(self.levels)  # незакрытая корзина каждого уровня
+        self.total = Bucket(time.time())
+        self.longest_outage = 0.0
+        self._outage_start = None
+        self._lock = threading.Lock()
+
+    def add(self, ts: float, ok: bool, latency_ms: float = None):
+        with self._lock:
+            self.raw.append((ts, ok, latency_ms))
+            self.total.add(ok, latency_ms)
+            for i, (step, ring) in enumerate(self.levels):
+                start = ts - ts % step
+                current = self._current[i]
+                if current is not None and current.start != start:
+                    ring.append(current)  # старейшая корзина вытесняется сама (maxlen)
+                    current = None
+                if current is None:
+                    current = self._current[i] = Bucket(start)
+                current.add(ok, latency_ms)
+
+            # Простой - от первой неудачной пробы до следующей удачной
+            if not ok and self._outage_start is None:
+                self._outage_start = ts
+            elif ok and self._outage_start is not None:
+                self.longest_outage = max(self.longest_outage, ts - self._outage_start)
+                self._outage_start = None
+
+    def buckets(self, step: int) -> list:
+        """Корзины уровня step (включая незакрытую) в виде словарей"""
+        with self._lock:
+            for i, (level_step, ring) in enumerate(self.levels):
+                if level_step == step:
+                    tail = [self._current[i]] if self._current[i] is not None else []
+                    return [bucket.to_dict() for bucket in list(ring) + tail]
+        raise ValueError(f"No resolution with step {step}")
+
+    def summary(self) -> dict:
+        with self._lock:
+            outage = self.longest_outage
+            if self._outage_start is not None and self.raw:
+                outage = max(outage, self.raw[-1][0] - self._outage_start)
+            recent = [latency for _, ok, latency in self.raw if ok]
+            return dict(self.total.to_dict(), longest_outage_s=round(outage),
+                        latency_p50_recent_ms=round(statistics.median(recent)) if recent else None)
+
+
+class SoakRunner:
+    """Держит туннели открытыми и пробует их с постоянным шагом"""
+
+    def __init__(self, configs: list, interval: float = SOAK_INTERVAL, duration: float = SOAK_DURATION,
+                 snapshot: float = SOAK_SNAPSHOT, tester: VpnTester = None):
+        self.configs = configs
+        self.interval = interval
+        self.duration = duration
+        self.snapshot = snapshot
+        self.tester = tester or VpnTester()
+        self.series = {config.name: RingSeries() for config in configs}
+        self.restarts = {config.name: 0 for config in configs}
+        self.started = None
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._stop = threading.Event()
+
+    def _probe_loop(self, config: VlessConfig, offset: float):
+        series = self.series[config.name]
+        proc, http_port = None, None
+        # Разносим пробы разных конфигов по шагу, чтобы не шли пачкой
+        next_at = self.started + offset
+        try:
+            while not self._stop.is_set():
+                if self._stop.wait(max(next_at - time.time(), 0)):
+                    break
+                next_at += self.interval
+
+                if proc is None or proc.poll() is not None:
+                    if proc is not None:
+                        self.tester.stop_xray(proc)
+                        self.restarts[config.name] += 1
+                        print(f"♻️ {config.name}: Xray exited, restarting")
+                    http_port = _free_port()
+                    try:
+                        proc = self.tester.start_xray(config, _free_port(), http_port, self._stop)
+                    except OSError as e:
+                        print(f"❌ {config.name}: cannot start Xray: {e}")
+                        proc = None
+                        series.add(time.time(), False)
+                        continue
+
+                status, time_ms = self.tester.gate_request(http_port, self._stop)
+                if status != 'cancelled':
+                    series.add(time.time(), status == 'ok', time_ms)
+        finally:
+            if proc is not None:
+                self.tester.stop_xray(proc)
+
+    def run(self) -> tuple:
+        """Прогон до duration или Ctrl+C. Возвращает (md_file, json_file) итогового отчёта"""
+        self.started = time.time()
+        deadline = self.started + self.duration
+        threads = [threading.Thread(target=self._probe_loop, daemon=True,
+                                    args=(config, i * self.interval / len(self.configs)))
+                   for i, config in enumerate(self.configs)]
+        for thread in threads:
+            thread.start()
+        print(f"🕒 Soak: {len(self.configs)} configs, every {self.interval}s for {self.duration / 3600:.1f}h")
+
+        try:
+            next_snapshot = self.started + self.snapshot
+            while time.time() < deadline:
+                time.sleep(min(1.0, max(deadline - time.time(), 0)))
+                if time.time() >= next_snapshot:
+                    self.write_report()
+                    next_snapshot += self.snapshot
+        except KeyboardInterrupt:
+            print("🛑 Interrupted, writing report...")
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=15)
+        return self.write_report()
+
+    def write_report(self) -> tuple:
+        data = {
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'elapsed_s': round(time.time() - self.started),
+            'interval_s': self.interval,
+            'configs': {name: {'summary': series.summary(), 'restarts': self.restarts[name],
+                               'minutes': series.buckets(60), 'quarters': series.buckets(900)}
+                        for name, series in self.series.items()},
+        }
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        md_file = REPORTS_DIR / f"soak_{self.timestamp}.md"
+        json_file = REPORTS_DIR / f"soak_{self.timestamp}.json"
+        write_report_file(md_file, render_md(data))
+        write_report_file(json_file, json.dumps(data, ensure_ascii=False))
+        print(f"📄 Soak report: {md_file}")
+        return md_file, json_file
+
+
+def _sparkline(values: list) -> str:
+    known = [v for v in values if v is not None]
+    if not known:
+        return ''
+    low, high = min(known), max(known)
+    scale = (high - low) or 1
+    return ''.join(' ' if v is None else SPARK[int((v - low) / scale * (len(SPARK) - 1))] for v in values)
+
+
+def render_md(data: dict) -> str:
+    md = f"""# 🕒 VPN Soak Test
+
+**Started:** {data['started']}
+**Elapsed:** {data['elapsed_s'] / 3600:.2f} h, probe every {data['interval_s']}s
+
+| Config | Uptime | Probes | Longest outage | Xray restarts | Avg latency | p50 (recent) |
+|--------|--------|--------|----------------|---------------|-------------|--------------|
+"""
+    for name, config in data['configs'].items():
+        s = config['summary']
+        uptime = f"{s['uptime'] * 100:.2f}%" if s['uptime'] is not None else 'N/A'
+        md += (f"| {name} | {uptime} | {s['count']} | {s['longest_outage_s']}s | {config['restarts']} | "
+               f"{s['latency_avg_ms'] or 'N/A'} ms | {s['latency_p50_recent_ms'] or 'N/A'} ms |\n")
+
+    for name, config in data['configs'].items():
+        quarters = config['quarters']
+        md += f"\n## {name}\n\n"
+        md += f"Latency (1 min): `{_sparkline([b['latency_avg_ms'] for b in config['minutes'][-120:]])}`\n\n"
+        md += "| Time | Uptime | Avg latency | Min | Max |\n|------|--------|-------------|-----|-----|\n"
+        for b in quarters:
+            uptime = f"{b['uptime'] * 100:.0f}%" if b['uptime'] is not None else 'N/A'
+            md += (f"| {datetime.fromtimestamp(b['start']).strftime('%m-%d %H:%M')} | {uptime} | "
+                   f"{b['latency_avg_ms'] or '—'} | {b['latency_min_ms'] or '—'} | {b['latency_max_ms'] or '—'} |\n")
+    return md
+
+
+def _seconds(value: str) -> float:
+    """'8h', '90m', '45s', '3600' -> секунды"""
+    units = {'h': 3600, 'm': 60, 's': 1}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='soak', description='Long-duration soak test')
+    parser.add_argument('configs', nargs='*', help='Имена конфигов из configs/ (или vless:// ссылки)')
+    parser.add_argument('--first', type=int, help='Взять N первых рабочих конфигов')
+    parser.add_argument('--duration', type=_seconds, default=SOAK_DURATION, help='Например 8h, 30m')
+    parser.add_argument('--interval', type=_seconds, default=SOAK_INTERVAL, help='Шаг проб одного конфига')
+    parser.add_argument('--snapshot', type=_seconds, default=SOAK_SNAPSHOT, help='Шаг промежуточных отчётов')
+    args = parser.parse_args(argv)
+
+    tester = VpnTester()
+    tester.load_configs()
+    by_name = {config.name: config for config in tester.configs}
+    configs = [VlessConfig(name) if name.startswith('vless://') else by_name.get(name) for name in args.configs]
+    missing = [name for name, config in zip(args.configs, configs) if config is None]
+    if missing:
+        parser.error(f"Configs not found: {', '.join(missing)}")
+    if args.first:
+        configs += [w['config'] for w in tester.find_working(args.first)]
+    if not configs:
+        parser.error("No configs to soak (names or --first N)")
+
+    SoakRunner(configs, args.interval, args.duration, args.snapshot, tester).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Speed Test - многопоточное скачивание через curl с подсчётом байт в реальном времени
+"""
+
+import subprocess
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+SAMPLE_INTERVAL = 0.25  # секунд между замерами скорости
+CONVERGE_SPAN = 3  # секунд истории для оценки сходимости
+
+# DPI детектор
+DPI_BURST_WINDOW = 0.5  # секунд "начального всплеска" после первого байта
+DPI_THROTTLE_RATIO = 0.25  # хвост медленнее всплеска в 4+ раза - троттлинг
+
+
+class DownloadStream:
+    """Один поток скачивания: curl пишет в pipe, фоновый поток считает байты"""
+
+    def __init__(self, url: str, proxy: str = None, max_time: float = 60, connect_timeout: float = 15):
+        self.url = url
+        self.proxy = proxy
+        self.max_time = max_time
+        self.connect_timeout = connect_timeout
+        self.bytes = 0  # Всего получено (с учётом перезапусков)
+        self.restarts = 0
+        self.returncode = None
+        self.proc = None
+        self._reader = None
+        self._start()
+
+    def _start(self):
+        cmd = ['curl', '-s', '-f', '-L', '-N', '-o', '-',
+               '--connect-timeout', str(self.connect_timeout),
+               '--max-time', str(self.max_time)]
+        if self.proxy:
+            cmd += ['--proxy', self.proxy]
+        cmd.append(self.url)
+
+        self.returncode = None
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+
+    def _drain(self):
+        stdout = self.proc.stdout
+        while True:
+            chunk = stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.bytes += len(chunk)
+        self.returncode = self.proc.wait()
+
+    @property
+    def finished(self) -> bool:
+        return self.returncode is not None
+
+    def restart(self):
+        """Файл скачан целиком - начинаем заново, чтобы поток не простаивал"""
+        self.restarts += 1
+        self._start()
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self._reader.join(timeout=5)
+
+
+def _converged(rates: list, tolerance: float) -> bool:
+    """95% доверительный интервал среднего укладывается в ±tolerance"""
+    if len(rates) < 2:
+        return False
+    mean = sum(rates) / len(rates)
+    if mean <= 0:
+        return False
+    variance = sum((r - mean) ** 2 for r in rates) / (len(rates) - 1)
+    half_width = 1.96 * (variance / len(rates)) ** 0.5
+    return half_width <= tolerance * mean
+
+
+def multi_stream_download(url: str, streams: int = 4, window: float = 10, proxy: str = None,
+                          connect_timeout: float = 15, min_time: float = None,
+                          tolerance: float = None) -> dict:
+    """
+    Скачивание в N потоков с замером суммарной скорости.
+
+    Окно начинается с первого полученного байта (время на connect не считается).
+    Потоки, скачавшие файл целиком, перезапускаются до конца окна.
+
+    Если задан tolerance, скорость семплируется каждые SAMPLE_INTERVAL секунд
+    и замер останавливается досрочно (не раньше min_time), как только оценка
+    по последним CONVERGE_SPAN секундам сошлась в пределах ±tolerance.
+    window - максимальная длительность замера.
+    """
+    pool = [DownloadStream(url, proxy, connect_timeout + window + 5, connect_timeout)
+            for _ in range(streams)]
+    converged = False
+    try:
+        # Ждём первые байты
+        deadline = time.time() + connect_timeout
+        while time.time() < deadline:
+            if any(s.bytes for s in pool) or all(s.finished for s in pool):
+                break
+            time.sleep(0.05)
+
+        window_start = time.time()
+        start_bytes = [s.bytes for s in pool]
+        window_end = window_start + window
+        min_end = window_start + (min_time or 0)
+
+        span = max(2, int(CONVERGE_SPAN / SAMPLE_INTERVAL))
+        rates = []
+        last_total = sum(start_bytes)
+        next_sample = window_start + SAMPLE_INTERVAL
+
+        while time.time() < window_end:
+            for s in pool:
+                if s.finished and s.returncode == 0:
+                    s.restart()
+            if all(s.finished for s in pool):
+                break
+
+            time.sleep(max(0.0, min(0.05, next_sample - time.time())))
+            if time.time() >= next_sample:
+                total_now = sum(s.bytes for s in pool)
+                rates.append((total_now - last_total) / SAMPLE_INTERVAL)
+                last_total = total_now
+                next_sample += SAMPLE_INTERVAL
+
+                if tolerance and time.time() >= min_end and _converged(rates[-span:], tolerance):
+                    converged = True
+                    break
+
+        elapsed = max(time.time() - window_start, 1e-6)
+        stream_bytes = [s.bytes - b0 for s, b0 in zip(pool, start_bytes)]
+    finally:
+        for s in pool:
+            s.stop()
+
+    total = sum(stream_bytes)
+    return {
+        'total_bytes': total,
+        'bytes_consumed': sum(s.bytes for s in pool),  # с учётом разгона до начала окна
+        'window_sec': round(elapsed, 2),
+        'time_saved_sec': round(max(0.0, window - elapsed), 2),
+        'converged': converged,
+        # Временной ряд скорости: кбит/с за каждые SAMPLE_INTERVAL секунд окна
+        'sample_interval_ms': int(SAMPLE_INTERVAL * 1000),
+        'samples_kbps': [int(r * 8 / 1000) for r in rates],
+        'speed_bps': total / elapsed,
+        'speed_mbps': round(total * 8 / elapsed / 1_000_000, 2),
+        'streams': [
+            {
+                'bytes': b,
+                'speed_mbps': round(b * 8 / elapsed / 1_000_000, 2),
+                'restarts': s.restarts,
+                'curl_code': s.returncode
+            }
+            for s, b in zip(pool, stream_bytes)
+        ]
+    }
+
+
+def _median(values: list) -> float:
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def dpi_probe(url: str, connections: int = 8, duration: float = 3, proxy: str = None,
+              stall_timeout: float = 1.5, connect_timeout: float = 8) -> dict:
+    """
+    Детектор DPI: много коротких соединений, фиксируем где каждое "замерзает".
+
+    Вердикт:
+      freeze    - большинство соединений встали после примерно одинакового объёма
+      throttled - после начального всплеска скорость падает в разы
+      clean     - данные идут без остановок
+      no_data   - ни одно соединение не получило данных
+    """
+    pool = [DownloadStream(url, proxy, connect_timeout + duration + 2, connect_timeout)
+            for _ in range(connections)]
+    started = time.time()
+    probes = [{'first_byte_at': None, 'last_change_at': None, 'last_bytes': 0,
+               'burst_bytes': None, 'stalled': False, 'done': False} for _ in pool]
+    try:
+        while not all(p['done'] for p in probes):
+            now = time.time()
+            for stream, p in zip(pool, probes):
+                if p['done']:
+                    continue
+                current = stream.bytes
+                if current != p['last_bytes']:
+                    p['last_bytes'] = current
+                    p['last_change_at'] = now
+                    if p['first_byte_at'] is None:
+                        p['first_byte_at'] = now
+                if p['first_byte_at'] is not None and p['burst_bytes'] is None \
+                        and now - p['first_byte_at'] >= DPI_BURST_WINDOW:
+                    p['burst_bytes'] = current
+
+                if stream.finished:
+                    p['done'] = True
+                elif p['first_byte_at'] is None:
+                    p['done'] = now - started >= connect_timeout
+                elif now - p['last_change_at'] >= stall_timeout:
+                    p['stalled'] = True
+                    p['done'] = True
+                elif now - p['first_byte_at'] >= duration:
+                    p['done'] = True
+                if p['done']:
+                    p['ended_at'] = now
+                    stream.stop()
+            time.sleep(0.05)
+    finally:
+        for stream in pool:
+            stream.stop()
+
+    results = []
+    for stream, p in zip(pool, probes):
+        entry = {'bytes': stream.bytes, 'stalled': p['stalled']}
+        if p['first_byte_at'] is not None:
+            active = max((p['last_change_at'] if p['stalled'] else p['ended_at']) - p['first_byte_at'], 1e-6)
+            burst = p['burst_bytes'] if p['burst_bytes'] is not None else stream.bytes
+            entry['stall_at_bytes'] = stream.bytes if p['stalled'] else None
+            entry['burst_kbps'] = int(burst * 8 / DPI_BURST_WINDOW / 1000)
+            tail_time = active - DPI_BURST_WINDOW
+            entry['tail_kbps'] = int((stream.bytes - burst) * 8 / tail_time / 1000) if tail_time > 0.2 else None
+        results.append(entry)
+
+    verdict = 'clean'
+    freeze_after = None
+    with_data = [r for r in results if r['bytes'] > 0]
+    stalled = [r for r in with_data if r['stalled']]
+    throttled = [r for r in with_data if not r['stalled'] and r.get('tail_kbps') is not None
+                 and r['tail_kbps'] < r['burst_kbps'] * DPI_THROTTLE_RATIO]
+    if not with_data:
+        verdict = 'no_data'
+    elif len(stalled) * 2 > len(with_data):
+        verdict = 'freeze'
+        freeze_after = int(_median([r['stall_at_bytes'] for r in stalled]))
+    elif len(throttled) * 2 > len(with_data):
+        verdict = 'throttled'
+
+    return {
+        'verdict': verdict,
+        'freeze_after_bytes': freeze_after,
+        'connections': len(results),
+        'stalled': len(stalled),
+        'throttled': len(throttled),
+        'time_sec': round(time.time() - started, 2),
+        'probes': results
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Multi-stream speed test')
+    parser.add_argument('url', nargs='?', help='URL для скачивания (по умолчанию - локальная заглушка)')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--window', type=float, default=5, help='Максимальная длительность замера')
+    parser.add_argument('--min-time', type=float, default=None)
+    parser.add_argument('--tolerance', type=float, default=None, help='Досрочная остановка при сходимости (0.1 = ±10%%)')
+    parser.add_argument('--proxy', default=None)
+    parser.add_argument('--rate', type=int, default=0, help='Ограничение скорости заглушки (байт/сек на поток)')
+    parser.add_argument('--dpi', action='store_true', help='Запустить DPI детектор вместо замера скорости')
+    parser.add_argument('--simulate', default='', help='Параметры DPI для заглушки, например freeze_after=16000')
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        from speedtest_server import start_server
+        server, base_url = start_server()
+        query = '&'.join(q for q in (f"rate={args.rate}" if args.rate else '', args.simulate) if q)
+        url = f"{base_url}/bytes/{10_000_000}" + (f"?{query}" if query else '')
+
+    if args.dpi:
+        print(json.dumps(dpi_probe(url, proxy=args.proxy), indent=2))
+    else:
+        print(json.dumps(multi_stream_download(url, args.streams, args.window, args.proxy,
+                                               min_time=args.min_time, tolerance=args.tolerance), indent=2))
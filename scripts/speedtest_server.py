@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Speedtest Server - локальный HTTP сервер-заглушка для проверки speed test без сети
+
+GET /bytes/<size>            - отдать <size> байт
+GET /bytes/<size>?rate=<Bps> - отдать с ограничением скорости (байт/сек)
+
+Имитация DPI (для проверки детектора в speedtest.dpi_probe):
+    freeze_after=<N>                 - после N байт замолчать, не закрывая соединение
+    throttle_after=<N>&throttle_rate=<Bps> - после N байт резко снизить скорость
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+_PAYLOAD = b'\0' * CHUNK_SIZE
+FREEZE_HOLD = 30  # секунд держим "замороженное" соединение
+
+
+class SpeedtestHandler(BaseHTTPRequestHandler):
+    """Отдаёт поток нулевых байт заданного размера"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Без логов в stdout на каждый запрос
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'bytes' or not parts[1].isdigit():
+            self.send_error(404)
+            return
+
+        size = int(parts[1])
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        rate = float(params.get('rate', 0))
+        freeze_after = int(params.get('freeze_after', 0))
+        throttle_after = int(params.get('throttle_after', 0))
+        throttle_rate = float(params.get('throttle_rate', 0))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+
+        start = time.time()
+        sent = 0
+        try:
+            while sent < size:
+                limit = size - sent
+                if freeze_after:
+                    limit = min(limit, freeze_after - sent)
+                    if limit <= 0:
+                        # "Заморозка": соединение открыто, данные не идут
+                        self.wfile.flush()
+                        time.sleep(FREEZE_HOLD)
+                        return
+                if throttle_after and sent >= throttle_after and throttle_rate > 0:
+                    # Медленно, мелкими порциями
+                    chunk = _PAYLOAD[:min(1024, size - sent)]
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    sent += len(chunk)
+                    time.sleep(len(chunk) / throttle_rate)
+                    continue
+                if throttle_after:
+                    limit = min(limit, max(throttle_after - sent, 1))
+
+                chunk = _PAYLOAD[:min(CHUNK_SIZE, limit)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate > 0:
+                    # Спим до момента, когда отправленный объём соответствует скорости
+                    delay = sent / rate - (time.time() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Клиент ушёл - обычное дело при остановке замера
+
+
+class SpeedtestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Обрывы соединений при остановке замера - норма
+
+
+def start_server(port: int = 0) -> tuple:
+    """Запустить сервер в фоне. Возвращает (server, base_url)"""
+    server = SpeedtestServer(('127.0.0.1', port), SpeedtestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 18080
+    server, base_url = start_server(port)
+    print(f"Speedtest stand-in server: {base_url}/bytes/<size>?rate=<Bps>")
+    print(f"  DPI simulation: ?freeze_after=<bytes> | ?throttle_after=<bytes>&throttle_rate=<Bps>")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Stats - общие статистики по результатам test_config
+
+Без зависимостей от остальных модулей: импортируется и из vpn_tester,
+и из retention / run_diff, которые vpn_tester сам импортирует.
+"""
+
+
+def median(values: list) -> float:
+    """Медиана (None - пустой список)"""
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def median_ping(result: dict) -> float:
+    """Медиана пинга по целям (p50 каждой цели) - устойчива к одиночным выбросам. None - нет замеров"""
+    return median([data.get('p50_ms', data.get('time_ms', 0))
+                   for data in result.get('ping', {}).values() if data.get('status') == 'ok'])
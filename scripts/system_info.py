@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+System Info - сведения о системе для сообщений Telegram с кэшем по полям
+
+У каждой группы полей свой TTL. Дешёвые (файлы /proc, /etc) при устаревании
+перечитываются сразу, медленные (docker --version, публичный IP) - в фоне:
+до обновления отдаётся прошлое значение, а до первого ответа 'Unknown'.
+Отправка никогда не ждёт api.ipify.org.
+
+    import system_info
+    system_info.PROVIDER.warm()   # при старте - заполнить кэш в фоне
+    info = system_info.PROVIDER.get()
+"""
+
+import json
+import os
+import platform
+import socket
+import subprocess
+import threading
+import time
+
+
+def _host() -> dict:
+    return {
+        'hostname': socket.gethostname(),
+        'local_ip': socket.gethostbyname(socket.gethostname()),
+        'os': f"{platform.system()} {platform.release()}",
+        'python_version': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _docker() -> dict:
+    try:
+        result = subprocess.run(['docker', '--version'], capture_output=True, text=True, timeout=5)
+        return {'docker_version': result.stdout.strip()}
+    except Exception:
+        return {'docker_version': 'Unknown'}
+
+
+def _ram() -> dict:
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return {'ram_gb': round(int(line.split()[1]) / 1024 / 1024, 2)}
+    except Exception:
+        pass
+    return {'ram_gb': 'Unknown'}
+
+
+def _public_ip() -> dict:
+    try:
+        result = subprocess.run(
+            ['curl', '-s', '--connect-timeout', '5', 'https://api.ipify.org?format=json'],
+            capture_output=True, text=True, timeout=10
+        )
+        if result.returncode == 0:
+            # Считаем что статический, если получили ответ
+            return {'public_ip': json.loads(result.stdout).get('ip', 'Unknown'), 'has_static_ip': True}
+    except Exception:
+        pass
+    return {'public_ip': 'Unknown', 'has_static_ip': False}
+
+
+def _dns() -> dict:
+    try:
+        with open('/etc/resolv.conf', 'r') as f:
+            servers = [line.split()[1] for line in f if line.strip().startswith('nameserver')]
+        return {'dns_servers': ', '.join(servers) if servers else 'Unknown'}
+    except Exception:
+        return {'dns_servers': 'Unknown'}
+
+
+# (сборщик, TTL в секундах, в фоне ли, значения до первого ответа)
+COLLECTORS = [
+    (_host, 3600, False, {}),
+    (_ram, 3600, False, {}),
+    (_dns, 300, False, {}),
+    (_docker, 86400, True, {'docker_version': 'Unknown'}),
+    (_public_ip, 900, True, {'public_ip': 'Unknown', 'has_static_ip': False}),
+]
+
+
+class SystemInfoProvider:
+    """Кэш сведений о системе: stale-while-revalidate по каждой группе полей"""
+
+    def __init__(self, collectors: list = None):
+        self.collectors = collectors or COLLECTORS
+        self._values = {}  # сборщик -> (значения, время получения)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _refresh(self, collector):
+        try:
+            values = collector()
+        except Exception as e:
+            print(f"System info error ({collector.__name__}): {e}")
+            values = None
+        with self._lock:
+            if values is not None:
+                self._values[collector] = (values, time.time())
+            self._refreshing.discard(collector)
+
+    def _refresh_async(self, collector):
+        with self._lock:
+            if collector in self._refreshing:
+                return
+            self._refreshing.add(collector)
+        threading.Thread(target=self._refresh, args=(collector,), daemon=True).start()
+
+    def warm(self):
+        """Заполнить кэш в фоне (при старте сервиса)"""
+        for collector, _, _, _ in self.collectors:
+            self._refresh_async(collector)
+
+    def get(self) -> dict:
+        info = {}
+        now = time.time()
+        for collector, ttl, background, defaults in self.collectors:
+            with self._lock:
+                cached = self._values.get(collector)
+            if cached is None or now - cached[1] >= ttl:
+                if background:
+                    self._refresh_async(collector)
+                else:
+                    self._refresh(collector)
+                    with self._lock:
+                        cached = self._values.get(collector, cached)
+            info.update(cached[0] if cached else defaults)
+        return info
+
+
+PROVIDER = SystemInfoProvider()
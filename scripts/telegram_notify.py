@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Telegram Notify - сообщение об итогах прогона и постановка отчёта в очередь
+
+Общий код для API (web_api.py) и процессов worker_daemon.py: отчёт строит тот,
+кто завершил прогон, а доставкой занимается telegram_outbox (очередь на диске
+общая, отправляет один процесс). Здесь - только постановка в очередь:
+отправщик запускает API (outbox.start() в web_api.py).
+
+    from telegram_notify import send_to_telegram
+    send_to_telegram(html_file, delta=delta, results=results)
+"""
+
+import os
+from pathlib import Path
+
+import run_diff
+import system_info
+import telegram_outbox
+from vpn_tester import REPORTS_DIR
+
+# Telegram Bot Integration
+# Token and Chat ID are loaded from environment variables or .env file
+# Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID in your environment
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '')
+# 1 - после прогона отправлять только изменения относительно предыдущего (без HTML файла)
+TELEGRAM_DELTA_ONLY = os.environ.get('TELEGRAM_DELTA_ONLY') == '1'
+# Свой прокси до Telegram (socks5h://host:port), 'direct' - без прокси; пусто - Xray на проверенном конфиге
+TELEGRAM_PROXY = os.environ.get('TELEGRAM_PROXY', '')
+# Адрес Bot API (для проверки без сети - заглушка telegram_server.py)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Очередь отправки: переживает перезапуск, доставляется одним потоком с повторами
+outbox = telegram_outbox.Outbox(REPORTS_DIR / "outbox", TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID,
+                                TELEGRAM_API_URL, TELEGRAM_PROXY)
+
+
+def get_system_info():
+    """Собрать информацию о системе (кэш с TTL по полям, публичный IP - в фоне)"""
+    return system_info.PROVIDER.get()
+
+
+def send_to_telegram(report_file: Path, test_duration: float = 0, working_config=None,
+                     delta: dict = None, delta_only: bool = None, results: list = None):
+    """
+    Поставить отчёт в очередь отправки в Telegram (telegram_outbox).
+
+    Доставкой занимается фоновый поток API с повторами: прокси берётся
+    в аренду (ProxyLease) - Xray на самом быстром конфиге, проверенном
+    в этом прогоне (results, working_config - пишутся в элементы очереди),
+    или уже поднятый ранее.
+    TELEGRAM_PROXY (например socks5h://host:port) - использовать свой прокси,
+    'direct' - отправлять напрямую (свой Bot API сервер, заглушка telegram_server.py).
+
+    delta - результат run_diff.diff_runs. При delta_only (по умолчанию
+    TELEGRAM_DELTA_ONLY) уходит только сообщение с изменениями, без HTML файла.
+    """
+    # Проверяем, есть ли токен и chat_id
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+        print("⚠️ Telegram bot token or chat ID not configured. Skipping Telegram send.")
+        print("   Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID environment variables.")
+        return False
+
+    # Текст сообщения: изменения с прошлого прогона или полный отчёт
+    if delta_only is None:
+        delta_only = TELEGRAM_DELTA_ONLY
+    delta_only = delta_only and delta is not None  # первый прогон - сравнивать не с чем
+
+    if delta_only:
+        message = f"""
+🔐 <b>VPN TESTER CS-CART - CHANGES</b>
+
+⏱️ <b>Test Duration:</b> <code>{test_duration:.1f} seconds</code>
+🔁 <b>Compared to run:</b> <code>{delta.get('previous_run_id', '?')}</code>
+
+{run_diff.render_telegram(delta)}
+"""
+    else:
+        system_info = get_system_info()
+        message = f"""
+🔐 <b>VPN TESTER CS-CART - TEST REPORT</b>
+
+⏱️ <b>Test Duration:</b> <code>{test_duration:.1f} seconds</code>
+
+🖥️ <b>SYSTEM INFO:</b>
+• Hostname: <code>{system_info['hostname']}</code>
+• Local IP: <code>{system_info['local_ip']}</code>
+• Public IP: <code>{system_info['public_ip']}</code>
+• Static IP: {'✅ Yes' if system_info['has_static_ip'] else '❌ No'}
+• OS: <code>{system_info['os']}</code>
+• RAM: <code>{system_info['ram_gb']} GB</code>
+• CPU Cores: <code>{system_info['cpu_count']}</code>
+• Docker: <code>{system_info['docker_version']}</code>
+• Python: <code>{system_info['python_version']}</code>
+• DNS: <code>{system_info.get('dns_servers', 'Unknown')}</code>
+
+📊 <b>HTML Report file attached below.</b>
+
+━━━━━━━━━━━━━━━━━━━━
+<b>by MatrixHasYou</b>
+"""
+
+    # Подсказка для аренды прокси: проверенные только что конфиги
+    proxy_hint = outbox.make_proxy_hint(results, working_config)
+    outbox.enqueue_message(message, proxy_hint=proxy_hint)
+    if not delta_only:
+        outbox.enqueue_report(report_file, proxy_hint=proxy_hint)
+    print(f"📥 Report queued for Telegram: {report_file.name} ({outbox.pending_count()} pending)")
+    return True
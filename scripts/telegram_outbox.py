@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Telegram Outbox - очередь отправки в Telegram на диске с повторами
+
+Сообщения и документы сначала пишутся в outbox (по файлу на элемент),
+затем их забирает один фоновый поток:
+  - одна requests.Session и один прокси (ProxyLease) на все отправки
+  - несколько сообщений, накопившихся за раз, склеиваются в одно
+  - несколько документов уходят одним sendMediaGroup (до 10)
+  - ошибки - повтор с экспоненциальной задержкой, 429 - ждём retry_after
+  - между запросами не меньше OUTBOX_MIN_INTERVAL (лимит Telegram на чат)
+  - после OUTBOX_MAX_ATTEMPTS или постоянной ошибки (4xx) - в outbox/dead/
+
+Очередь переживает перезапуск: неотправленное уйдёт после старта.
+Подсказка для аренды прокси (proxy_hint) лежит в самом элементе - ставить
+в очередь может любой процесс, а отправляет тот, кто держит outbox/.lock.
+Проверка без сети - заглушка telegram_server.py (api_url=base_url, proxy=PROXY_DIRECT).
+"""
+
+import base64
+import fcntl
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import metrics
+
+OUTBOX_MIN_INTERVAL = 1.0  # секунд между запросами к Bot API
+OUTBOX_BACKOFF_BASE = 5  # секунд до первого повтора, дальше x2
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_MAX_ATTEMPTS = 12  # ~ сутки повторов
+OUTBOX_COALESCE_WINDOW = 2  # секунд ждём, пока соберётся пачка
+OUTBOX_POLL = 10  # секунд между проверками каталога (задания кладут процессы worker_daemon.py)
+MESSAGE_LIMIT = 4096  # символов в одном сообщении Telegram
+MEDIA_GROUP_LIMIT = 10  # документов в одном sendMediaGroup
+MESSAGE_SEPARATOR = "\n━━━━━━━━━━━━━━━━━━━━\n"
+PROXY_DIRECT = 'direct'  # proxy: без прокси и без аренды туннеля (локальный Bot API, заглушка)
+# Bot API принимает файлы до 50 MB - режем с запасом
+UPLOAD_LIMIT = int(os.environ.get('TELEGRAM_UPLOAD_LIMIT_MB', 45)) * 1024 * 1024
+
+# HTML, который распаковывает сам себя в браузере (gzip + base64, DecompressionStream)
+SELF_EXTRACTING_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"><title>__TITLE__</title></head>
+<body style="background: #000; color: #0f0; font-family: monospace;">
+<p id="status">Unpacking report...</p>
+<script>
+const packed = "__PAYLOAD__";
+const bytes = Uint8Array.from(atob(packed), c => c.charCodeAt(0));
+new Response(new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip')))
+    .text()
+    .then(html => { document.open(); document.write(html); document.close(); })
+    .catch(e => { document.getElementById('status').textContent = 'Unpack failed: ' + e; });
+</script>
+</body>
+</html>
+"""
+
+
+def _split(path: Path, limit: int) -> list:
+    """Разрезать файл на части <file>.001, .002 ... (собираются cat или 7-Zip)"""
+    parts = []
+    with open(path, 'rb') as src:
+        while True:
+            chunk = src.read(limit)
+            if not chunk:
+                break
+            part = path.with_name(f"{path.name}.{len(parts) + 1:03d}")
+            with open(part, 'wb') as dst:
+                dst.write(chunk)
+            parts.append(part)
+    path.unlink()
+    return parts
+
+
+def pack_report(report_file: Path, out_dir: Path, limit: int = UPLOAD_LIMIT) -> list:
+    """
+    Вложения для отправки отчёта: [(path, caption)].
+
+    HTML сжимается в самораспаковывающийся HTML (открывается в браузере как есть).
+    Данные разбитого отчёта (report_<ts>.data/) - отдельным zip.
+    Всё, что больше limit, режется на части .001, .002 ...
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    attachments = []
+    raw = report_file.read_bytes()
+    packed = gzip.compress(raw, compresslevel=9)
+    html = SELF_EXTRACTING_HTML.replace('__TITLE__', report_file.stem) \
+        .replace('__PAYLOAD__', base64.b64encode(packed).decode())
+    if len(html) <= limit:
+        target = out_dir / report_file.name
+        target.write_text(html)
+        attachments.append((target, None))
+    else:
+        target = out_dir / f"{report_file.name}.gz"
+        target.write_bytes(packed)
+        parts = _split(target, limit)
+        attachments += [(part, f"{report_file.name}: cat {target.name}.* | gunzip > {report_file.name}"
+                         if n == 0 else None) for n, part in enumerate(parts)]
+
+    data_dir = report_file.with_suffix('.data')
+    if data_dir.is_dir():
+        target = out_dir / f"{data_dir.name}.zip"
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+            for f in sorted(data_dir.iterdir()):
+                if f.suffix == '.json':  # .gz копии для веб-сервера не нужны
+                    archive.write(f, f"{data_dir.name}/{f.name}")
+        caption = f"Full results for {report_file.name} (index.json, chunk_*.json)"
+        if target.stat().st_size <= limit:
+            attachments.append((target, caption))
+        else:
+            parts = _split(target, limit)
+            attachments += [(part, f"{caption}, split: open {parts[0].name} with 7-Zip" if n == 0 else None)
+                            for n, part in enumerate(parts)]
+
+    packed_size = sum(path.stat().st_size for path, _ in attachments)
+    print(f"📦 {report_file.name}: {len(raw) / 1024:.0f} KB → {packed_size / 1024:.0f} KB "
+          f"in {len(attachments)} file(s)")
+    return attachments
+
+
+class Outbox:
+    """Очередь на диске + фоновый отправщик"""
+
+    def __init__(self, directory: Path, token: str, chat_id: str,
+                 api_url: str = 'https://api.telegram.org', proxy: str = ''):
+        self.directory = Path(directory)
+        self.dead_dir = self.directory / "dead"
+        self.token = token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip('/')
+        self.proxy = proxy
+        # Подсказка для ProxyLease из последнего отправляемого элемента (proxy_hint)
+        self.proxy_hint = None
+        self.last_delivery = None
+        self._session = None
+        self._lease = None
+        self._next_send_at = 0.0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    # --- Очередь ---
+
+    def _write(self, item: dict):
+        path = self.directory / item['id']
+        tmp_file = path.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(item, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def _enqueue(self, item: dict, proxy_hint: dict = None) -> str:
+        if proxy_hint:
+            item['proxy_hint'] = proxy_hint
+        with self._lock:
+            self._seq += 1
+            item['id'] = f"{time.time_ns()}_{self._seq:04d}_{item['kind']}.json"
+        item.update(created=time.time(), attempts=0, next_attempt_at=0, last_error=None)
+        self._write(item)
+        self._wake.set()
+        return item['id']
+
+    @staticmethod
+    def make_proxy_hint(results: list = None, prefer=None) -> dict:
+        """Подсказка для ProxyLease в элемент очереди: рабочие конфиги прогона (имя и пинг) и prefer"""
+        hint = {}
+        if results:
+            hint['results'] = [{'name': r.get('name'), 'status': r.get('status'), 'ping': r.get('ping', {})}
+                               for r in results if r.get('status') == 'working']
+        if prefer is not None:
+            hint['prefer'] = {'url': prefer.url, 'name': prefer.name}
+        return hint or None
+
+    def enqueue_message(self, text: str, parse_mode: str = 'HTML', proxy_hint: dict = None) -> str:
+        return self._enqueue({'kind': 'message', 'text': text, 'parse_mode': parse_mode}, proxy_hint)
+
+    def enqueue_document(self, path: Path, caption: str = None, cleanup: bool = False,
+                         proxy_hint: dict = None) -> str:
+        """cleanup - файл принадлежит очереди и удаляется после отправки"""
+        return self._enqueue({'kind': 'document', 'path': str(path), 'caption': caption, 'cleanup': cleanup},
+                             proxy_hint)
+
+    def enqueue_report(self, report_file: Path, proxy_hint: dict = None) -> list:
+        """Сжать отчёт (pack_report) в outbox/files/ и поставить вложения в очередь"""
+        return [self.enqueue_document(path, caption, cleanup=True, proxy_hint=proxy_hint)
+                for path, caption in pack_report(report_file, self.directory / "files")]
+
+    def pending(self) -> list:
+        items = []
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                with open(path, 'r') as f:
+                    items.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return items
+
+    def pending_count(self) -> int:
+        return sum(1 for _ in self.directory.glob("*.json"))
+
+    def _done(self, items: list):
+        for item in items:
+            if item.get('cleanup'):
+                Path(item['path']).unlink(missing_ok=True)
+            (self.directory / item['id']).unlink(missing_ok=True)
+
+    def _fail(self, items: list, error: str, retry_after: float = None, permanent: bool = False) -> float:
+        """Пачка уходит на повтор целиком (одно время) - чтобы снова уйти вместе. Возвращает время повтора"""
+        retry = []
+        for item in items:
+            item['attempts'] += 1
+            item['last_error'] = error
+            if permanent or item['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                self.dead_dir.mkdir(exist_ok=True)
+                self._write(item)
+                os.replace(self.directory / item['id'], self.dead_dir / item['id'])
+                print(f"❌ Telegram outbox: giving up on {item['id']} after {item['attempts']} attempts: {error}")
+            else:
+                retry.append(item)
+        if not retry:
+            return None
+        attempts = max(item['attempts'] for item in retry)
+        delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+        delay = max(delay * random.uniform(0.8, 1.2), retry_after or 0)
+        retry_at = time.time() + delay
+        self._defer(retry, retry_at)
+        print(f"⚠️ Telegram outbox: {len(retry)} item(s) failed ({error}), retry in {delay:.0f}s")
+        return retry_at
+
+    def _defer(self, items: list, at: float):
+        for item in items:
+            item['next_attempt_at'] = at
+            self._write(item)
+
+    # --- Фоновый отправщик ---
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._release_proxy(invalidate=False)
+
+    def flush(self, timeout: float = 30) -> bool:
+        """Дождаться, пока очередь опустеет (для CLI и проверки)"""
+        deadline = time.time() + timeout
+        self._wake.set()
+        while time.time() < deadline:
+            if not any(item['next_attempt_at'] <= deadline for item in self.pending()):
+                return self.pending_count() == 0
+            time.sleep(0.1)
+        return False
+
+    def _run(self):
+        # Несколько процессов API - отправляет только тот, кто держит блокировку
+        with open(self.directory / ".lock", 'w') as lock_file:
+            while not self._stop.is_set():
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    self._stop.wait(5)
+            self._loop()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            items = self.pending()
+            now = time.time()
+            due = [item for item in items if item['next_attempt_at'] <= now]
+            if not due:
+                wait = min((item['next_attempt_at'] - now for item in items), default=OUTBOX_POLL)
+                self._wake.wait(min(wait, OUTBOX_POLL))
+                self._wake.clear()
+                continue
+
+            # Короткая пауза: сообщение и документ одного отчёта приходят друг за другом
+            if now - max(item['created'] for item in due) < OUTBOX_COALESCE_WINDOW:
+                self._stop.wait(OUTBOX_COALESCE_WINDOW)
+                continue
+            try:
+                self._deliver(due)
+            except Exception as e:
+                print(f"❌ Telegram outbox error: {e}")
+                self._fail(due, str(e))
+
+    def _deliver(self, items: list):
+        started = time.time()
+        hints = [item for item in items if item.get('proxy_hint')]
+        if hints:
+            self.proxy_hint = max(hints, key=lambda item: item['created'])['proxy_hint']
+        messages = [item for item in items if item['kind'] == 'message']
+        documents = [item for item in items if item['kind'] == 'document']
+
+        missing = [item for item in documents if not Path(item['path']).exists()]
+        if missing:
+            self._fail(missing, 'file not found', permanent=True)
+        documents = [item for item in documents if item not in missing]
+
+        # Сначала сообщения, потом документы - как их ставили в очередь
+        steps = [('message', batch) for batch in self._message_batches(messages)]
+        steps += [('document', documents[i:i + MEDIA_GROUP_LIMIT])
+                  for i in range(0, len(documents), MEDIA_GROUP_LIMIT)]
+        for n, (kind, batch) in enumerate(steps):
+            if kind == 'message':
+                result = self._call('sendMessage', json={
+                    'chat_id': self.chat_id, 'parse_mode': batch[0].get('parse_mode', 'HTML'),
+                    'text': MESSAGE_SEPARATOR.join(item['text'] for item in batch)})
+            else:
+                upload_start = time.time()
+                result = self._send_documents(batch)
+                size = sum(Path(item['path']).stat().st_size for item in batch)
+                seconds = time.time() - upload_start
+                metrics.TELEGRAM_UPLOAD_BYTES.inc(size)
+                print(f"📤 Telegram upload: {len(batch)} file(s), {size / 1024:.0f} KB in {seconds:.1f}s "
+                      f"({size / 1024 / max(seconds, 1e-3):.0f} KB/s)")
+            ok, error, retry_after, permanent = result
+            if ok:
+                self._done(batch)
+                continue
+            retry_at = self._fail(batch, error, retry_after, permanent)
+            if not permanent:
+                # Остальное не пробуем сейчас - уйдёт вместе с повтором
+                self._defer([item for _, rest in steps[n + 1:] for item in rest], retry_at or 0)
+                break
+
+        elapsed = time.time() - started
+        self.last_delivery = {'at': time.time(), 'items': len(items), 'seconds': round(elapsed, 2),
+                              'proxy': self._proxy_source()}
+        metrics.TELEGRAM_DELIVERY.observe(elapsed, proxy=self._proxy_source(),
+                                          result='ok' if not self.pending_count() else 'retry')
+        print(f"⏱️ Telegram outbox: {len(items)} item(s) in {elapsed:.1f}s via {self._proxy_source()}")
+
+    @staticmethod
+    def _message_batches(messages: list) -> list:
+        """Склеить сообщения, пока укладываемся в MESSAGE_LIMIT"""
+        batches, batch, size = [], [], 0
+        for item in messages:
+            length = len(item['text']) + len(MESSAGE_SEPARATOR)
+            if batch and (size + length > MESSAGE_LIMIT or item.get('parse_mode') != batch[0].get('parse_mode')):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(item)
+            size += length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _send_documents(self, batch: list) -> tuple:
+        files = {}
+        try:
+            if len(batch) == 1:
+                item = batch[0]
+                files['document'] = open(item['path'], 'rb')
+                data = {'chat_id': self.chat_id}
+                if item.get('caption'):
+                    data['caption'] = item['caption']
+                return self._call('sendDocument', data=data, files=files)
+
+            media = []
+            for n, item in enumerate(batch):
+                files[f"file{n}"] = open(item['path'], 'rb')
+                entry = {'type': 'document', 'media': f"attach://file{n}"}
+                if item.get('caption'):
+                    entry['caption'] = item['caption']
+                media.append(entry)
+            return self._call('sendMediaGroup', data={'chat_id': self.chat_id, 'media': json.dumps(media)},
+                              files=files)
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _call(self, method: str, **kwargs) -> tuple:
+        """Запрос к Bot API с учётом лимита: (ok, error, retry_after, permanent)"""
+        import requests
+
+        delay = self._next_send_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        session, proxies = self._connect()
+        try:
+            resp = session.post(f"{self.api_url}/bot{self.token}/{method}", proxies=proxies,
+                                timeout=120 if 'files' in kwargs else 30, **kwargs)
+        except requests.RequestException as e:
+            self._release_proxy(invalidate=True)  # туннель умер - следующий запрос поднимет другой
+            return False, f"{type(e).__name__}: {e}", None, False
+        finally:
+            self._next_send_at = time.time() + OUTBOX_MIN_INTERVAL
+
+        if resp.status_code == 200:
+            return True, None, None, False
+        try:
+            payload = resp.json()
+        except ValueError:
+            payload = {}
+        error = f"{resp.status_code}: {payload.get('description', resp.text[:200])}"
+        if resp.status_code == 429:
+            retry_after = payload.get('parameters', {}).get('retry_after', OUTBOX_BACKOFF_BASE)
+            self._next_send_at = time.time() + retry_after
+            return False, error, retry_after, False
+        # 4xx (кроме 429) - запрос неверный, повтор не поможет
+        return False, error, None, 400 <= resp.status_code < 500
+
+    def _connect(self) -> tuple:
+        """Одна сессия на все отправки; прокси - TELEGRAM_PROXY (или PROXY_DIRECT) либо аренда туннеля"""
+        import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+        if self.proxy == PROXY_DIRECT:
+            return self._session, None
+        if self.proxy:
+            return self._session, {'http': self.proxy, 'https': self.proxy}
+        from vpn_tester import ProxyLease, VlessConfig
+
+        hint = self.proxy_hint or {}
+        prefer = hint.get('prefer')
+        self._lease = ProxyLease.acquire(results=hint.get('results'),
+                                         prefer=VlessConfig(prefer['url'], prefer['name']) if prefer else None)
+        return self._session, self._lease.proxies if self._lease else None
+
+    def _release_proxy(self, invalidate: bool):
+        if self._lease is not None and invalidate:
+            from vpn_tester import ProxyLease
+
+            ProxyLease.invalidate(self._lease)
+        self._lease = None
+
+    def _proxy_source(self) -> str:
+        if self.proxy and self.proxy != PROXY_DIRECT:
+            return 'env'
+        if self._lease is None:
+            return 'direct'
+        return 'lease_reused' if self._lease.reused else 'lease_new'
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Telegram outbox')
+    parser.add_argument('command', choices=['status', 'flush', 'retry-dead'])
+    args = parser.parse_args()
+
+    outbox = Outbox(base_dir / "reports" / "outbox", os.environ.get('TELEGRAM_BOT_TOKEN', ''),
+                    os.environ.get('TELEGRAM_CHAT_ID', ''),
+                    os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org'),
+                    os.environ.get('TELEGRAM_PROXY', ''))
+    if args.command == 'status':
+        for item in outbox.pending():
+            print(f"{item['id']:45} attempts={item['attempts']} last_error={item['last_error']}")
+        print(f"Dead: {sum(1 for _ in outbox.dead_dir.glob('*.json')) if outbox.dead_dir.exists() else 0}")
+    elif args.command == 'retry-dead':
+        for path in outbox.dead_dir.glob("*.json") if outbox.dead_dir.exists() else []:
+            with open(path, 'r') as f:
+                item = json.load(f)
+            item.update(attempts=0, next_attempt_at=0)
+            outbox._write(item)
+            path.unlink()
+        print(f"Requeued, pending: {outbox.pending_count()}")
+    else:
+        outbox.start()
+        print('Flushed' if outbox.flush(300) else f"Still pending: {outbox.pending_count()}")
+        outbox.stop()
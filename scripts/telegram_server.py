@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Telegram Server - локальная заглушка Bot API для проверки доставки без сети
+
+POST /bot<token>/sendMessage     - JSON {chat_id, text, parse_mode}
+POST /bot<token>/sendDocument    - multipart: chat_id, document
+POST /bot<token>/sendMediaGroup  - multipart: chat_id, media (JSON), файлы attach://<name>
+
+Имитация сбоев (для проверки повторов в telegram_outbox):
+    fail=<N>         - первые N запросов отвечают 500
+    rate_limit=<N>   - первые N запросов отвечают 429 с retry_after
+    retry_after=<s>  - значение retry_after для 429 (по умолчанию 1)
+
+Все принятые запросы складываются в server.received.
+"""
+
+import json
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    """Отвечает как Bot API и запоминает, что пришло"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Без логов в stdout на каждый запрос
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fields(self, body: bytes) -> dict:
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                data = part.get_payload(decode=True) or b''
+                if part.get_filename():
+                    fields[name] = {'filename': part.get_filename(), 'size': len(data)}
+                else:
+                    fields[name] = data.decode(errors='replace')
+            return fields
+        return {}
+
+    def do_POST(self):
+        server = self.server
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with server.lock:
+            server.requests += 1
+            count = server.requests
+        if count <= server.rate_limit:
+            self._reply(429, {'ok': False, 'error_code': 429,
+                              'description': f'Too Many Requests: retry after {server.retry_after}',
+                              'parameters': {'retry_after': server.retry_after}})
+            return
+        if count <= server.rate_limit + server.fail:
+            self._reply(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+            return
+
+        method = parts[1]
+        if method not in ('sendMessage', 'sendDocument', 'sendMediaGroup'):
+            self._reply(400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: method {method}'})
+            return
+        fields = self._fields(body)
+        with server.lock:
+            server.received.append({'method': method, 'fields': fields, 'bytes': len(body)})
+            message_id = len(server.received)
+        self._reply(200, {'ok': True, 'result': {'message_id': message_id}})
+
+
+class TelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fail: int = 0, rate_limit: int = 0, retry_after: int = 1):
+        super().__init__(address, TelegramHandler)
+        self.fail = fail
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = 0
+        self.received = []
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        pass  # Обрывы соединений клиентом - норма
+
+
+def start_server(port: int = 0, fail: int = 0, rate_limit: int = 0, retry_after: int = 1) -> tuple:
+    """Запустить сервер в фоне. Возвращает (server, base_url) - base_url подставляется в TELEGRAM_API_URL"""
+    server = TelegramServer(('127.0.0.1', port), fail, rate_limit, retry_after)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Telegram Bot API stand-in server')
+    parser.add_argument('port', nargs='?', type=int, default=18081)
+    parser.add_argument('--fail', type=int, default=0, help='Первые N запросов - 500')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Первые N запросов - 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.fail, args.rate_limit, args.retry_after)
+    print(f"Telegram Bot API stand-in: TELEGRAM_API_URL={base_url} TELEGRAM_PROXY=direct")
+    try:
+        while True:
+            time.sleep(5)
+            with server.lock:
+                for item in server.received:
+                    print(item['method'], json.dumps(item['fields'], ensure_ascii=False)[:200])
+                server.received.clear()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -10,11 +10,23 @@ import subprocess
 import time
 import re
 import socket
+import secrets
 import threading
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs, unquote
+import atexit
 import base64
+import fcntl
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import instrumentation
+import retention
+import run_diff
+from stats import median_ping
+from speedtest import multi_stream_download, dpi_probe
 
 # Пути
 # При запуске из Docker: BASE_DIR = /app
@@ -27,6 +39,8 @@ CONFIGS_DIR = BASE_DIR / "configs"
 REPORTS_DIR = BASE_DIR / "reports"
 LOGS_DIR = BASE_DIR / "logs"
 XRAY_BIN = BASE_DIR / "xray" / "xray"
+HISTORY_FILE = REPORTS_DIR / "history.json"
+RUNS_DIR = REPORTS_DIR / "runs"  # журналы прогонов (checkpoint)
 
 # Тестовые сервера для проверки
 TEST_SERVERS = [
@@ -50,6 +64,277 @@ SPEEDTEST_URLS = [
     "https://download.oracle.com/otn-pub/java/jdk/10.0.2+13/19aef61b38124481863b1413dce18555/0",  # Oracle
 ]
 
+# Сколько запросов к каждой цели в test_ping (по одному keep-alive соединению)
+PING_SAMPLES = 5
+PING_CONNECT_TIMEOUT = 8  # секунд на соединение curl
+PING_MAX_TIME = 15  # секунд на один запрос (--max-time действует на каждый запрос отдельно)
+PING_TIMEOUT_SLACK = 5  # секунд сверх samples * PING_MAX_TIME на процесс curl
+PING_WRITE_OUT = '%{http_code},%{time_total},%{time_namelookup},%{time_connect},%{time_appconnect},%{time_starttransfer}\n'
+# Фазы соединения для разбивки задержки (ключи в result['ping'][...]['phases'])
+LATENCY_PHASES = [
+    ('local_ms', 'Local → Inbound'),
+    ('tunnel_ms', 'Tunnel'),
+    ('tls_ms', 'Target TLS'),
+    ('ttfb_ms', 'TTFB'),
+]
+
+# Источник для speed test: SPEEDTEST_URL из окружения или первый из списка.
+# Для проверки без сети - локальная заглушка speedtest_server.py
+SPEEDTEST_URL = os.environ.get('SPEEDTEST_URL') or SPEEDTEST_URLS[0]
+SPEEDTEST_STREAMS = 4  # параллельных потоков скачивания
+SPEEDTEST_WINDOW = 10  # секунд максимум на замер
+SPEEDTEST_MIN_TIME = 3  # секунд минимум до досрочной остановки
+SPEEDTEST_TOLERANCE = 0.1  # остановка, когда оценка сошлась в пределах ±10%
+
+# DPI детектор: короткие соединения к тому же источнику, что и speed test
+DPI_CONNECTIONS = 8
+DPI_DURATION = 3  # секунд на одно соединение
+
+# Большие прогоны: лёгкая сводная страница + данные в report_<ts>.data/
+REPORT_PARTITION_THRESHOLD = 200  # конфигов, начиная с которых отчёт разбивается
+REPORT_CHUNK_SIZE = 100  # конфигов в одном файле деталей chunk_NNNN.json
+REPORT_SUMMARY_TOP = 25  # лучших конфигов прямо на сводной странице
+
+# Быстрая проверка "работает ли конфиг вообще" (gate check)
+GATE_URL = "https://api.ipify.org?format=json"
+GATE_TIMEOUT = 8  # секунд на один запрос через туннель
+FIRST_WORKING_PARALLEL = 4  # сколько конфигов проверяем одновременно
+
+# Профили проверки: фазы test_config и общий бюджет времени на конфиг (секунд).
+# Каждой фазе гарантировано её время, сэкономленное предыдущими фазами
+# достаётся следующим; таймауты внутри фазы ужимаются под выделенное время.
+# Фаза 'ip' - gate запрос к GATE_URL: не прошёл - остальные фазы не запускаются
+PROBE_PROFILES = {
+    'quick': {  # gate + 3 цели пинга
+        'budget': 5,
+        'phases': [('ip', 1.5), ('ping', 2)],
+        'ping_targets': ['Yandex RU', 'GitHub', 'Microsoft'],
+        'ping_samples': 2,
+    },
+    'standard': {
+        'budget': 60,
+        'phases': [('ip', 8), ('dns', 2), ('ping', 25), ('dpi', 8), ('speed', 12)],
+        'ping_samples': 3,
+        'speed_streams': 1,
+    },
+    'deep': {  # всё, плюс трассировка и многопоточный speed test
+        'budget': 180,
+        'phases': [('ip', 8), ('dns', 2), ('ping', 45), ('dpi', 12), ('speed', 30), ('traceroute', 75)],
+        'ping_samples': PING_SAMPLES,
+        'speed_streams': SPEEDTEST_STREAMS,
+    },
+}
+DEFAULT_PROBE_PROFILE = os.environ.get('PROBE_PROFILE', 'standard')
+if DEFAULT_PROBE_PROFILE not in PROBE_PROFILES:
+    # Опечатка в окружении не должна ронять каждый test_config
+    print(f"⚠️ Unknown PROBE_PROFILE={DEFAULT_PROBE_PROFILE!r} (expected {', '.join(PROBE_PROFILES)}), using 'standard'")
+    DEFAULT_PROBE_PROFILE = 'standard'
+PHASE_MIN_TIME = {'ip': 1, 'dns': 0.5, 'ping': 1, 'dpi': 3, 'speed': 4, 'traceroute': 5}  # меньше - фаза пропускается
+PHASE_RESULT_KEYS = {'ip': 'ip_check', 'dns': 'dns_check'}  # ключ в result, если не совпадает с фазой
+PROBE_BUDGET_RESERVE = 0.5  # секунд бюджета на остановку Xray
+XRAY_START_TIMEOUT = 5  # секунд на подъём HTTP inbound
+
+
+# Прокси для доставки отчётов (Telegram): Xray на проверенном конфиге, живёт между отправками
+PROXY_LEASE_TTL = 600  # секунд простоя, после которых прокси останавливается
+PROXY_LEASE_FRESH = 120  # секунд после проверки, когда прокси используется без повторной
+PROXY_LEASE_CANDIDATES = 3  # сколько конфигов пробуем поднять, прежде чем искать параллельно
+
+# Вывод Xray: сколько последних строк держим в памяти на процесс
+XRAY_OUTPUT_LINES = 200
+
+# Известные ошибки Xray -> машиночитаемый класс отказа (проверяются по порядку)
+XRAY_ERROR_PATTERNS = [
+    ('port_in_use', re.compile(r'address already in use|bind: ', re.I)),
+    ('bad_reality_key', re.compile(r'REALITY.*(public ?key|password)|invalid (public ?key|password)', re.I)),
+    ('config_error', re.compile(r'failed to (load|parse|build) config|infra/conf|failed to start', re.I)),
+    ('dns_failure', re.compile(r'no such host|failed to (resolve|lookup)|server misbehaving|dns.*(fail|timeout)', re.I)),
+    ('handshake_failure', re.compile(r'handshake|REALITY: processed invalid|tls: |EOF', re.I)),
+    ('connect_failure', re.compile(r'connection refused|i/o timeout|network is unreachable|no route to host', re.I)),
+]
+
+
+class XrayOutput:
+    """Фоновое чтение stdout/stderr Xray в кольцевой буфер + классификация ошибок"""
+
+    def __init__(self, proc: subprocess.Popen, max_lines: int = XRAY_OUTPUT_LINES):
+        self.lines = deque(maxlen=max_lines)
+        self.failure_class = None
+        self.failure_line = None
+        self._lock = threading.Lock()
+        self._threads = []
+        for stream in (proc.stdout, proc.stderr):
+            if stream is not None:
+                thread = threading.Thread(target=self._drain, args=(stream,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _drain(self, stream):
+        # Читаем всегда, иначе переполненный pipe остановит Xray
+        for raw in iter(stream.readline, b''):
+            line = raw.decode(errors='replace').rstrip()
+            failure = self.classify(line)
+            with self._lock:
+                self.lines.append(line)
+                if failure and self.failure_class is None:
+                    self.failure_class = failure
+                    self.failure_line = line
+        stream.close()
+
+    @staticmethod
+    def classify(line: str) -> str:
+        for failure_class, pattern in XRAY_ERROR_PATTERNS:
+            if pattern.search(line):
+                return failure_class
+        return None
+
+    def wait(self, timeout: float = 1):
+        """Дождаться, пока дочитается вывод завершившегося процесса"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def tail(self, count: int = 10) -> list:
+        with self._lock:
+            return list(self.lines)[-count:]
+
+
+# Запущенные тестером процессы Xray (для метрик)
+_live_xray = set()
+_live_xray_lock = threading.Lock()
+
+
+def live_xray_count() -> int:
+    """Сколько процессов Xray сейчас живо"""
+    with _live_xray_lock:
+        for proc in [p for p in _live_xray if p.poll() is not None]:
+            _live_xray.discard(proc)
+        return len(_live_xray)
+
+
+# Полная таблица и детали для разбитого отчёта - рендерятся в браузере по требованию
+REPORT_LAZY_SECTION = """
+        <h2>📋 ALL CONFIGS</h2>
+        <p style="margin-bottom: 10px;">
+            <input id="filter" placeholder="filter by name / host / status..." style="background: #000; color: #0f0; border: 1px solid #0f0; padding: 6px; width: 300px;">
+            <span id="pager"></span>
+        </p>
+        <table>
+            <thead>
+                <tr><th>Name</th><th>Host:Port</th><th>Status</th><th>Ping (p50)</th><th>Speed</th><th>DPI</th><th>Details</th></tr>
+            </thead>
+            <tbody id="rows"><tr><td colspan="7">Loading...</td></tr></tbody>
+        </table>
+        <pre id="detail" class="traceroute" style="display: none; white-space: pre-wrap;"></pre>
+        <script>
+        (function () {
+            const DATA = '__DATA_DIR__';
+            const PAGE = 100;
+            let rows = [], view = [], page = 0;
+            const chunks = {};
+
+            function cell(tr, text, cls) {
+                const td = document.createElement('td');
+                td.textContent = text === null || text === undefined ? '-' : text;
+                if (cls) td.className = cls;
+                tr.appendChild(td);
+            }
+
+            function render() {
+                const tbody = document.getElementById('rows');
+                tbody.innerHTML = '';
+                view.slice(page * PAGE, (page + 1) * PAGE).forEach(r => {
+                    const tr = document.createElement('tr');
+                    cell(tr, r[0], 'config-name');
+                    cell(tr, r[1]);
+                    cell(tr, r[2]);
+                    cell(tr, r[3] === null ? null : r[3] + ' ms');
+                    cell(tr, r[4] === null ? null : r[4].toFixed(2) + ' Mbps', 'speed');
+                    cell(tr, r[5]);
+                    cell(tr, r[6]);
+                    tr.style.cursor = 'pointer';
+                    tr.onclick = () => showDetail(r);
+                    tbody.appendChild(tr);
+                });
+                const pages = Math.max(1, Math.ceil(view.length / PAGE));
+                const pager = document.getElementById('pager');
+                pager.innerHTML = '';
+                const prev = document.createElement('button');
+                prev.textContent = '<';
+                prev.onclick = () => { if (page > 0) { page--; render(); } };
+                const next = document.createElement('button');
+                next.textContent = '>';
+                next.onclick = () => { if (page < pages - 1) { page++; render(); } };
+                const label = document.createElement('span');
+                label.textContent = ` page ${page + 1}/${pages} (${view.length} configs) `;
+                pager.append(prev, label, next);
+            }
+
+            async function showDetail(r) {
+                const key = String(r[7]).padStart(4, '0');
+                if (!chunks[key]) {
+                    const resp = await fetch(`${DATA}/chunk_${key}.json`);
+                    chunks[key] = await resp.json();
+                }
+                const result = chunks[key].find(x => x.name === r[0]);
+                const detail = document.getElementById('detail');
+                detail.style.display = 'block';
+                detail.textContent = JSON.stringify(result, null, 2);
+                detail.scrollIntoView();
+            }
+
+            document.getElementById('filter').oninput = (e) => {
+                const q = e.target.value.toLowerCase();
+                view = rows.filter(r => r.slice(0, 3).join(' ').toLowerCase().includes(q));
+                page = 0;
+                render();
+            };
+
+            fetch(`${DATA}/index.json`).then(r => r.json()).then(data => {
+                rows = data.rows;
+                view = rows;
+                render();
+            }).catch(() => {
+                document.getElementById('rows').innerHTML = '<tr><td colspan="7">Data files not available</td></tr>';
+            });
+        })();
+        </script>
+"""
+
+
+def write_report_file(path: Path, content: str):
+    """Записать файл отчёта и рядом сжатую копию <file>.gz (отдаётся web_api без пережатия)"""
+    data = content.encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(data)
+    tmp_file = path.with_name(path.name + '.gz.tmp')
+    with open(tmp_file, 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=6))
+    os.replace(tmp_file, path.with_name(path.name + '.gz'))
+
+
+def _free_port() -> int:
+    """Свободный локальный TCP порт (для параллельных Xray)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float, proc: subprocess.Popen = None,
+                   cancel: threading.Event = None) -> bool:
+    """Ждём, пока порт начнёт принимать соединения"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            return False
+        if cancel is not None and cancel.is_set():
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
 
 class VlessConfig:
     """Класс для работы с VLESS конфигурацией"""
@@ -139,10 +424,10 @@ class VlessConfig:
         params = p.get('params', {})
         
         config = {
+            # Логи идут в stdout и читаются XrayOutput (без растущих файлов в LOGS_DIR)
             "log": {
-                "loglevel": "error",
-                "access": str(LOGS_DIR / f"access_{self.name}.log"),
-                "error": str(LOGS_DIR / f"error_{self.name}.log")
+                "loglevel": "warning",
+                "access": "none"
             },
             "inbounds": [
                 {
@@ -256,6 +541,221 @@ class VlessConfig:
         return '??'
 
 
+class ConfigHistory:
+    """История результатов по конфигам - для сортировки кандидатов"""
+
+    EMA_ALPHA = 0.3  # вес нового замера в сглаженной задержке
+
+    def __init__(self, path: Path = HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp_file = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            print(f"History save error: {e}")
+
+    def record(self, name: str, ok: bool, latency_ms: float = None):
+        """Записать результат проверки конфига"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path.with_suffix('.lock'), 'w') as lock_file:
+            # Историю пишут несколько процессов - перечитываем под блокировкой
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.data = self._load()
+            entry = self.data.setdefault(name, {'attempts': 0, 'successes': 0, 'latency_ms': None})
+            entry['attempts'] += 1
+            entry['last_seen'] = datetime.now().isoformat()
+            if ok:
+                entry['successes'] += 1
+                entry['last_ok'] = entry['last_seen']
+                if latency_ms is not None and latency_ms != float('inf'):
+                    prev = entry.get('latency_ms')
+                    entry['latency_ms'] = round(latency_ms if prev is None else
+                                                prev + self.EMA_ALPHA * (latency_ms - prev), 2)
+            self._save()
+
+    def score(self, name: str) -> tuple:
+        """Ключ сортировки: сначала доля успехов, потом задержка"""
+        entry = self.data.get(name)
+        if not entry:
+            # Неизвестный конфиг - нейтральная оценка
+            return (-0.5, float('inf'))
+        # Сглаживание Лапласа: 1 удача из 1 попытки не лучше 9 из 10
+        rate = (entry['successes'] + 1) / (entry['attempts'] + 2)
+        latency = entry.get('latency_ms')
+        return (-rate, latency if latency is not None else float('inf'))
+
+    def order(self, configs: list) -> list:
+        """Конфиги в порядке убывания шансов на успех"""
+        return sorted(configs, key=lambda c: self.score(c.name))
+
+
+def merge_vantages(results, order: list = None) -> list:
+    """
+    Результаты с нескольких точек замера (result['vantage']) -> одна строка на конфиг.
+
+    Основной результат - с первой точки из order, у которой он есть, остальные
+    сводятся в result['vantages'] = {точка: {status, ping_ms, speed_mbps, ip}}.
+    Результаты одной точки возвращаются как есть.
+
+    results читается один раз (можно передать сам RunJournal): в памяти только
+    строка на конфиг и сводка его точек. Повтор той же точки заменяет прежний.
+    """
+    rank = {vantage: i for i, vantage in enumerate(order or [])}
+
+    def position(vantage):
+        return rank.get(vantage, len(rank)), vantage or ''
+
+    by_name = {}
+    seen_vantages = set()
+    for r in results:
+        vantage = r.get('vantage')
+        seen_vantages.add(vantage)
+        entry = by_name.get(r.get('name', 'Unknown'))
+        if entry is None:
+            entry = by_name[r.get('name', 'Unknown')] = {'primary': r, 'vantages': {}}
+        elif position(vantage) <= position(entry['primary'].get('vantage')):
+            entry['primary'] = r
+        ping = median_ping(r)
+        speeds = [d.get('speed_mbps', 0) for d in r.get('speed', {}).values() if d.get('status') == 'ok']
+        entry['vantages'][vantage] = {
+            'status': r.get('status'),
+            'ping_ms': round(ping) if ping else None,
+            'speed_mbps': max(speeds) if speeds else None,
+            'ip': r.get('ip_check', {}).get('ip'),
+            'worker': r.get('worker'),
+        }
+
+    if len(seen_vantages) <= 1:
+        return [entry['primary'] for entry in by_name.values()]
+    return [dict(entry['primary'], vantages=dict(sorted(entry['vantages'].items(), key=lambda kv: position(kv[0]))))
+            for entry in by_name.values()]
+
+
+class RunJournal:
+    """
+    Журнал прогона: каждый готовый результат дописывается строкой JSON (jsonl).
+
+    После падения/перезапуска прогон продолжается по run_id - уже
+    протестированные конфиги пропускаются, отчёт строится из журнала.
+    """
+
+    def __init__(self, run_id: str, runs_dir: Path = RUNS_DIR):
+        self.run_id = run_id
+        self.path = runs_dir / f"run_{run_id}.jsonl"
+        self.meta_path = runs_dir / f"run_{run_id}.meta.json"
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, total: int = 0, runs_dir: Path = RUNS_DIR, vantages: list = None,
+               probe_profile: str = None) -> 'RunJournal':
+        runs_dir.mkdir(parents=True, exist_ok=True)
+        # Суффикс - два прогона, начатые в одну секунду, не делят один файл
+        journal = cls(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}", runs_dir)
+        journal.path.touch()
+        meta = {'run_id': journal.run_id, 'created': time.time(), 'total': total, 'completed': False}
+        if vantages:
+            meta['vantages'] = vantages
+        if probe_profile:
+            meta['probe_profile'] = probe_profile
+        journal._write_meta(meta)
+        return journal
+
+    @classmethod
+    def open(cls, run_id: str, runs_dir: Path = RUNS_DIR) -> 'RunJournal':
+        journal = cls(run_id, runs_dir)
+        if not journal.path.exists():
+            raise FileNotFoundError(f"Run {run_id} not found")
+        journal._repair()
+        return journal
+
+    def _repair(self):
+        """Отрезать недописанную последнюю строку (процесс убили посреди записи)"""
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    @property
+    def meta(self) -> dict:
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'run_id': self.run_id}
+
+    def _write_meta(self, meta: dict):
+        tmp_file = self.meta_path.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, self.meta_path)
+
+    def append(self, result: dict):
+        line = json.dumps(result, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                # В журнал одного прогона пишут несколько процессов worker_daemon.py
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __iter__(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def done_names(self) -> set:
+        return {r.get('name') for r in self}
+
+    def results(self) -> list:
+        """Результаты для отчёта: по одной строке на конфиг (точки замера сведены)"""
+        return merge_vantages(self, self.meta.get('vantages'))
+
+    def finish(self, **extra):
+        meta = self.meta
+        meta.update(extra, completed=True, finished=time.time())
+        self._write_meta(meta)
+
+    def previous(self) -> 'RunJournal':
+        """Последний завершённый прогон до этого (None - сравнивать не с чем)"""
+        for meta_file in sorted(self.meta_path.parent.glob("run_*.meta.json"), reverse=True):
+            run_id = meta_file.name[len('run_'):-len('.meta.json')]
+            if run_id >= self.run_id:
+                continue
+            journal = RunJournal(run_id, self.meta_path.parent)
+            if journal.meta.get('completed') and journal.path.exists():
+                return journal
+        return None
+
+    @staticmethod
+    def list_runs(runs_dir: Path = RUNS_DIR) -> list:
+        runs = []
+        for meta_file in sorted(runs_dir.glob("run_*.meta.json"), reverse=True):
+            run_id = meta_file.name[len('run_'):-len('.meta.json')]
+            journal = RunJournal(run_id, runs_dir)
+            meta = journal.meta
+            with open(journal.path, 'rb') as f:
+                meta['done'] = sum(1 for _ in f)
+            runs.append(meta)
+        return runs
+
+
 class VpnTester:
     """Основной класс тестировщика"""
     
@@ -263,6 +763,11 @@ class VpnTester:
         self.configs = []
         self.results = []
         self.xray_processes = {}
+        self.history = ConfigHistory()
+        # cProfile на каждый test_config (файлы profile_*.prof в LOGS_DIR)
+        self.profile = os.environ.get('VPN_TESTER_PROFILE') == '1'
+        # Профиль проверки (PROBE_PROFILES) для test_config по умолчанию
+        self.probe_profile = DEFAULT_PROBE_PROFILE
         
     def load_configs(self):
         """Загрузка конфигураций из файлов"""
@@ -291,20 +796,32 @@ class VpnTester:
             config_file.unlink()
         self.configs = [c for c in self.configs if c.name != name]
     
-    def start_xray(self, config: VlessConfig, socks_port: int, http_port: int) -> subprocess.Popen:
+    def start_xray(self, config: VlessConfig, socks_port: int, http_port: int,
+                   cancel: threading.Event = None, wait: float = XRAY_START_TIMEOUT) -> subprocess.Popen:
         """Запуск Xray с конфигурацией"""
         xray_config = config.to_xray_config(socks_port, http_port)
-        config_file = LOGS_DIR / f"xray_config_{config.name}.json"
+        # Свой файл на каждый запуск: тот же конфиг одновременно может стоять в задаче
+        # воркера, ProxyLease, soak или matrix - stop_xray удаляет только свой
+        config_file = LOGS_DIR / f"xray_config_{config.name}_{os.getpid()}_{http_port}.json"
         
         with open(config_file, 'w') as f:
             json.dump(xray_config, f, indent=2)
         
-        proc = subprocess.Popen(
-            [str(XRAY_BIN), 'run', '-c', str(config_file)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        time.sleep(2)  # Ждём запуска
+        try:
+            proc = subprocess.Popen(
+                [str(XRAY_BIN), 'run', '-c', str(config_file)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError:
+            config_file.unlink(missing_ok=True)  # нет бинарника Xray - конфиг не нужен
+            raise
+        proc.output = XrayOutput(proc)
+        proc.config_file = config_file
+        with _live_xray_lock:
+            _live_xray.add(proc)
+        # Ждём, пока поднимется HTTP inbound (не дольше wait секунд)
+        _wait_for_port(http_port, wait, proc, cancel)
         return proc
     
     def stop_xray(self, proc: subprocess.Popen):
@@ -314,33 +831,67 @@ class VpnTester:
             proc.wait(timeout=5)
         except:
             proc.kill()
+        with _live_xray_lock:
+            _live_xray.discard(proc)
+        # Конфиг нужен Xray только на старте - не копим xray_config_*.json в logs/
+        config_file = getattr(proc, 'config_file', None)
+        if config_file:
+            config_file.unlink(missing_ok=True)
     
-    def test_ping(self, http_port: int) -> dict:
-        """Тест пинга до тестовых серверов"""
+    def test_ping(self, http_port: int, samples: int = PING_SAMPLES, servers: list = None,
+                  timeout: float = None) -> dict:
+        """
+        Тест пинга до тестовых серверов.
+
+        Каждая цель опрашивается несколько раз одним вызовом curl по
+        keep-alive соединению: первый запрос включает connect + handshake,
+        остальные - "тёплый" RTT. По тёплым замерам считаем p50/p95/min/jitter.
+        timeout - на всю фазу: делится поровну между оставшимися целями.
+        Если curl сам упёрся в --max-time, уже сделанные замеры цели сохраняются.
+        """
         results = {}
         proxy = f"http://127.0.0.1:{http_port}"
+        servers = servers or TEST_SERVERS
+        deadline = time.time() + timeout if timeout else None
 
-        for name, host, port, region in TEST_SERVERS:
+        for i, (name, host, port, region) in enumerate(servers):
+            target = f'https://{host}:{port}' if port == 443 else f'http://{host}:{port}'
+            # Худший случай - каждый из samples запросов упирается в --max-time
+            limit = samples * PING_MAX_TIME + PING_TIMEOUT_SLACK
+            if deadline:
+                limit = min(limit, max(deadline - time.time(), 0) / (len(servers) - i))
+            max_time = min(PING_MAX_TIME, limit)
+            cmd = ['curl', '-s', '--fail-early', '-w', PING_WRITE_OUT, '--proxy', proxy,
+                   '--connect-timeout', f"{min(PING_CONNECT_TIMEOUT, limit):.2f}", '--max-time', f"{max_time:.2f}"]
+            for _ in range(samples):
+                cmd += ['-o', '/dev/null', target]
             try:
                 start = time.time()
-                result = subprocess.run(
-                    ['curl', '-s', '-o', '/dev/null', '-w', '%{http_code},%{time_total}',
-                     '--proxy', proxy, '--connect-timeout', '8', '--max-time', '15',
-                     f'https://{host}:{port}' if port == 443 else f'http://{host}:{port}'],
-                    capture_output=True, timeout=20
-                )
+                result = subprocess.run(cmd, capture_output=True, timeout=limit)
                 elapsed = time.time() - start
-                
-                if result.returncode == 0:
-                    resp = result.stdout.decode().strip().split(',')
-                    http_code = resp[0] if len(resp) > 0 else '000'
-                    curl_time = float(resp[1]) if len(resp) > 1 else elapsed
-                    results[name] = {
+
+                lines = [l.split(',') for l in result.stdout.decode().split('\n') if l.count(',') == 5]
+                ok = [l for l in lines if l[0] != '000']
+                # 28 - curl сам упёрся в --max-time: первые замеры всё равно годятся
+                if ok and result.returncode in (0, 28):
+                    first = [float(v) * 1000 for v in ok[0][1:]]
+                    first_ms = round(first[0], 2)
+                    entry = {
                         'status': 'ok',
-                        'time_ms': round(curl_time * 1000, 2),
-                        'http_code': http_code,
-                        'region': region
+                        'http_code': ok[0][0],
+                        'region': region,
+                        'first_ms': first_ms,
+                        'connect_ms': round(first[3] or first[2], 2),
                     }
+                    warm = [round(float(l[1]) * 1000, 2) for l in ok[1:]]
+                    entry.update(self._latency_stats(warm or [first_ms]))
+                    entry['samples_ms'] = warm
+                    entry['phases'] = self._phase_breakdown(*first[1:], warm_ms=entry['p50_ms'] if warm else None)
+                    # time_ms - устойчивая оценка (медиана тёплых замеров)
+                    entry['time_ms'] = entry['p50_ms']
+                    results[name] = entry
+                elif result.returncode == 28:
+                    results[name] = self._ping_timeout(region, max_time)
                 else:
                     results[name] = {
                         'status': 'fail',
@@ -350,13 +901,7 @@ class VpnTester:
                         'error': 'Connection failed'
                     }
             except subprocess.TimeoutExpired:
-                results[name] = {
-                    'status': 'timeout',
-                    'time_ms': 15000,
-                    'http_code': '000',
-                    'region': region,
-                    'error': 'Timeout'
-                }
+                results[name] = self._ping_timeout(region, max_time)
             except Exception as e:
                 results[name] = {
                     'status': 'error',
@@ -368,9 +913,74 @@ class VpnTester:
 
         return results
 
-    def test_traceroute(self, http_port: int) -> dict:
+    @staticmethod
+    def _ping_timeout(region: str, max_time: float) -> dict:
+        return {
+            'status': 'timeout',
+            'time_ms': round(max_time * 1000),
+            'http_code': '000',
+            'region': region,
+            'error': 'Timeout'
+        }
+
+    @staticmethod
+    def _phase_breakdown(namelookup: float, connect: float, appconnect: float, starttransfer: float,
+                         warm_ms: float = None) -> dict:
+        """
+        Разбивка первого запроса на фазы (всё в мс, от начала запроса):
+          local  - DNS + TCP до локального inbound Xray
+          tunnel - установка туннеля до VLESS сервера и connect сервера к цели
+          tls    - TLS handshake с целью
+          ttfb   - от отправки запроса до первого байта ответа
+
+        Xray отвечает на CONNECT сразу, а туннель поднимает при первых данных,
+        поэтому curl видит tunnel + tls одним интервалом до time_appconnect.
+        TLS 1.3 стоит примерно один RTT через готовый туннель - его оцениваем
+        тёплым RTT (warm_ms), остаток относим к туннелю.
+        """
+        local = connect
+        if appconnect:
+            handshake = max(appconnect - connect, 0.0)
+            tls = min(warm_ms, handshake) if warm_ms is not None else 0.0
+            tunnel = handshake - tls
+            ttfb = max(starttransfer - appconnect, 0.0)
+        else:
+            # Обычный HTTP: туннель поднимается вместе с первым запросом
+            request = max(starttransfer - connect, 0.0)
+            tls = 0.0
+            ttfb = min(warm_ms, request) if warm_ms is not None else request
+            tunnel = request - ttfb
+        return {
+            'local_ms': round(local, 2),
+            'tunnel_ms': round(tunnel, 2),
+            'tls_ms': round(tls, 2),
+            'ttfb_ms': round(ttfb, 2),
+            'dns_ms': round(namelookup, 2),
+        }
+
+    @staticmethod
+    def _latency_stats(samples: list) -> dict:
+        """p50 / p95 / min / jitter (среднее расхождение соседних замеров)"""
+        ordered = sorted(samples)
+
+        def percentile(q):
+            pos = (len(ordered) - 1) * q
+            lo = int(pos)
+            hi = min(lo + 1, len(ordered) - 1)
+            return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+        diffs = [abs(b - a) for a, b in zip(samples, samples[1:])]
+        return {
+            'p50_ms': round(percentile(0.5), 2),
+            'p95_ms': round(percentile(0.95), 2),
+            'min_ms': round(ordered[0], 2),
+            'jitter_ms': round(sum(diffs) / len(diffs), 2) if diffs else 0.0,
+        }
+
+    def test_traceroute(self, http_port: int, timeout: float = None) -> dict:
         """Тест трассировки до ключевых серверов (выборочно) - БЕЗ прокси"""
         results = {}
+        deadline = time.time() + timeout if timeout else None
         
         # Выбираем 4 сервера для трассировки
         targets = [
@@ -380,14 +990,17 @@ class VpnTester:
             ("GitHub", "github.com"),
         ]
         
-        for name, host in targets:
+        for i, (name, host) in enumerate(targets):
+            limit = 45
+            if deadline:
+                limit = min(limit, max(deadline - time.time(), 0) / (len(targets) - i))
             try:
                 # Запускаем traceroute с таймаутом
                 result = subprocess.run(
                     ['traceroute', '-m', '20', '-w', '2', '-q', '1', host],
                     capture_output=True,
                     text=True,
-                    timeout=45
+                    timeout=limit
                 )
                 
                 # Парсим вывод traceroute
@@ -440,77 +1053,89 @@ class VpnTester:
 
         return results
 
-    def test_speed(self, http_port: int) -> dict:
-        """Тест скорости скачивания (10MB файл)"""
+    def test_speed(self, http_port: int, url: str = None, streams: int = SPEEDTEST_STREAMS,
+                   window: float = SPEEDTEST_WINDOW, min_time: float = SPEEDTEST_MIN_TIME,
+                   tolerance: float = SPEEDTEST_TOLERANCE, timeout: float = None) -> dict:
+        """
+        Тест скорости: N параллельных потоков, суммарная скорость за окно замера.
+        Замер останавливается досрочно, когда скорость стабилизировалась.
+        timeout - на всю фазу (ожидание первых байт + окно замера).
+        """
         proxy = f"http://127.0.0.1:{http_port}"
+        url = url or SPEEDTEST_URL
         results = {}
+        connect_timeout = 15
+        if timeout:
+            connect_timeout = min(connect_timeout, timeout / 3)
+            window = min(window, timeout - connect_timeout)
+            min_time = min(min_time, window)
 
-        # Используем первый доступный URL для скорости
-        for url in SPEEDTEST_URLS[:1]:
-            try:
-                start = time.time()
-                # Скачиваем с прогрессом
-                result = subprocess.run(
-                    ['curl', '-s', '-L', '-o', '/dev/null', 
-                     '-w', '%{size_download},%{speed_download},%{time_total},%{http_code}',
-                     '--proxy', proxy, 
-                     '--connect-timeout', '15', 
-                     '--speed-time', '20',  # Если скорость 0 более 20 сек - прервать
-                     '--speed-limit', '1000',  # Минимум 1KB/s
-                     '--max-time', '60',  # Максимум 1 минута для 10MB
-                     url],
-                    capture_output=True, 
-                    timeout=90
-                )
-                elapsed = time.time() - start
+        try:
+            stats = multi_stream_download(url, streams, window, proxy, connect_timeout,
+                                          min_time=min_time, tolerance=tolerance)
+            size = stats['total_bytes']
+            cost = {
+                'bytes_consumed': stats['bytes_consumed'],
+                'time_saved_sec': stats['time_saved_sec'],
+                'converged': stats['converged'],
+                'sample_interval_ms': stats['sample_interval_ms'],
+                'samples_kbps': stats['samples_kbps']
+            }
 
-                if result.returncode == 0:
-                    resp = result.stdout.decode().strip().split(',')
-                    size = float(resp[0]) if len(resp) > 0 else 0
-                    speed_bps = float(resp[1]) if len(resp) > 1 else 0
-                    total_time = float(resp[2]) if len(resp) > 2 else elapsed
-                    http_code = resp[3] if len(resp) > 3 else '000'
-                    
-                    # Только если скачали больше 1MB считаем успешным
-                    if size > 1_000_000:
-                        results[url] = {
-                            'status': 'ok',
-                            'size_bytes': int(size),
-                            'size_mb': round(size / 1_000_000, 2),
-                            'speed_bps': speed_bps,
-                            'speed_mbps': round(speed_bps * 8 / 1_000_000, 2),
-                            'time_sec': round(total_time, 2),
-                            'http_code': http_code
-                        }
-                    else:
-                        results[url] = {
-                            'status': 'fail',
-                            'error': f'Download incomplete ({int(size/1000)}KB)',
-                            'blocked': True,  # Возможно блокировка РКН
-                            'size_bytes': int(size),
-                            'http_code': http_code
-                        }
-                else:
-                    results[url] = {
-                        'status': 'fail', 
-                        'error': f'Download failed (curl={result.returncode})',
-                        'http_code': '000'
-                    }
-            except subprocess.TimeoutExpired:
-                results[url] = {'status': 'timeout', 'error': 'Timeout after 60s'}
-            except Exception as e:
-                results[url] = {'status': 'error', 'error': str(e)}
+            # Только если скачали больше 1MB считаем успешным
+            if size > 1_000_000:
+                results[url] = {
+                    'status': 'ok',
+                    'size_bytes': int(size),
+                    'size_mb': round(size / 1_000_000, 2),
+                    'speed_bps': stats['speed_bps'],
+                    'speed_mbps': stats['speed_mbps'],
+                    'time_sec': stats['window_sec'],
+                    'streams': stats['streams'],
+                    **cost
+                }
+            elif size == 0 and all(st['curl_code'] not in (0, -9) for st in stats['streams']):
+                # Ни один поток не получил ни байта и все завершились ошибкой curl
+                results[url] = {
+                    'status': 'fail',
+                    'error': f"Download failed (curl={stats['streams'][0]['curl_code']})",
+                    'http_code': '000'
+                }
+            else:
+                results[url] = {
+                    'status': 'fail',
+                    'error': f'Download incomplete ({int(size/1000)}KB)',
+                    'blocked': True,  # Возможно блокировка РКН
+                    'size_bytes': int(size),
+                    'streams': stats['streams'],
+                    **cost
+                }
+        except Exception as e:
+            results[url] = {'status': 'error', 'error': str(e)}
 
         return results
     
-    def test_ip(self, http_port: int) -> dict:
-        """Проверка IP и страны"""
+    def test_dpi(self, http_port: int, url: str = None, timeout: float = None) -> dict:
+        """Детектор DPI: заморозка после N байт / троттлинг / чисто"""
+        proxy = f"http://127.0.0.1:{http_port}"
+        duration, connect_timeout = DPI_DURATION, 8
+        if timeout:
+            connect_timeout = min(connect_timeout, timeout / 2)
+            duration = min(duration, timeout - connect_timeout)
+        try:
+            return dpi_probe(url or SPEEDTEST_URL, DPI_CONNECTIONS, duration, proxy,
+                             connect_timeout=connect_timeout)
+        except Exception as e:
+            return {'verdict': 'error', 'error': str(e)}
+
+    def test_ip(self, http_port: int, timeout: float = 10) -> dict:
+        """Проверка IP и страны (она же gate запрос к GATE_URL)"""
         proxy = f"http://127.0.0.1:{http_port}"
         try:
             result = subprocess.run(
-                ['curl', '-s', '--proxy', proxy, '--connect-timeout', '5',
-                 'https://api.ipify.org?format=json'],
-                capture_output=True, timeout=10
+                ['curl', '-s', '--proxy', proxy, '--connect-timeout', f"{min(5, timeout):.2f}",
+                 '--max-time', f"{timeout:.2f}", GATE_URL],
+                capture_output=True, timeout=timeout + 0.5
             )
             if result.returncode == 0:
                 ip_data = json.loads(result.stdout)
@@ -519,8 +1144,9 @@ class VpnTester:
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
 
-    def test_dns(self) -> dict:
+    def test_dns(self, timeout: float = 10) -> dict:
         """Проверка DNS серверов - определяет использует ли провайдер свои DNS"""
+        deadline = time.time() + timeout
         results = {
             'local_dns': [],
             'uses_provider_dns': False,
@@ -532,7 +1158,7 @@ class VpnTester:
             try:
                 result = subprocess.run(
                     ['nmcli', 'dev', 'show'],
-                    capture_output=True, text=True, timeout=10
+                    capture_output=True, text=True, timeout=max(deadline - time.time(), 0.1)
                 )
                 if result.returncode == 0:
                     for line in result.stdout.split('\n'):
@@ -548,7 +1174,7 @@ class VpnTester:
                 try:
                     result = subprocess.run(
                         ['resolvectl', 'status'],
-                        capture_output=True, text=True, timeout=10
+                        capture_output=True, text=True, timeout=max(deadline - time.time(), 0.1)
                     )
                     if result.returncode == 0:
                         for line in result.stdout.split('\n'):
@@ -601,22 +1227,55 @@ class VpnTester:
         
         return results
     
-    def test_config(self, config: VlessConfig) -> dict:
-        """Полное тестирование конфигурации"""
-        print(f"Testing {config.name}...")
+    def test_config(self, config: VlessConfig, probe_profile: str = None) -> dict:
+        """Тестирование конфигурации по профилю проверки (PROBE_PROFILES)"""
+        probe_profile = probe_profile or self.probe_profile
+        budget = PROBE_PROFILES[probe_profile]['budget']
+        print(f"Testing {config.name} ({probe_profile}, {budget}s)...")
+
+        # Свои порты на каждый запуск - параллельные процессы worker_daemon.py не мешают друг другу
+        socks_port, http_port = _free_port(), _free_port()
+        timings = {}
+        started = time.time()
+
+        with instrumentation.profiled(config.name, self.profile, LOGS_DIR) as profile:
+            result = self._run_phases(config, socks_port, http_port, timings, probe_profile)
+
+        result['timings'] = timings
+        result['probe_profile'] = probe_profile
+        result['budget_sec'] = budget
+        result['elapsed_sec'] = round(time.time() - started, 2)
+        if result['elapsed_sec'] > budget:
+            print(f"⚠️ {config.name}: {result['elapsed_sec']}s, over {probe_profile} budget ({budget}s)")
+        if profile.get('path'):
+            result['profile'] = profile['path']
+        instrumentation.emit('total', sum(timings.values()), {'config': config.name, 'result': result})
+
+        self.history.record(config.name, result['status'] == 'working', self._get_median_ping(result))
+        return result
 
-        socks_port = 10808
-        http_port = 10809
+    def _run_phases(self, config: VlessConfig, socks_port: int, http_port: int, timings: dict,
+                    probe_profile: str) -> dict:
+        """Фазы профиля probe_profile, каждая под своим замером времени и в пределах бюджета"""
+        ctx = {'config': config.name}
+        profile = PROBE_PROFILES[probe_profile]
+        phases = profile['phases']
+        deadline = time.time() + profile['budget'] - PROBE_BUDGET_RESERVE
 
-        # Запускаем Xray
-        proc = self.start_xray(config, socks_port, http_port)
+        # Запускаем Xray (время, не отданное фазам)
+        with instrumentation.span('xray_start', timings, **ctx):
+            wait = deadline - time.time() - sum(seconds for _, seconds in phases)
+            proc = self.start_xray(config, socks_port, http_port, wait=min(XRAY_START_TIMEOUT, max(wait, 0.5)))
 
         if proc.poll() is not None:
             # Не запустился
+            proc.output.wait()
             return {
                 'name': config.name,
                 'info': config.info,
                 'status': 'failed_to_start',
+                'failure_class': proc.output.failure_class or 'exited',
+                'xray_log': proc.output.tail(),
                 'timestamp': datetime.now().isoformat()
             }
 
@@ -625,78 +1284,213 @@ class VpnTester:
             'info': config.info,
             'timestamp': datetime.now().isoformat()
         }
+        targets = profile.get('ping_targets')
+        servers = [s for s in TEST_SERVERS if s[0] in targets] if targets else TEST_SERVERS
+        runners = {
+            'ip': lambda timeout: self.test_ip(http_port, timeout),
+            # Локальные DNS, без прокси
+            'dns': lambda timeout: self.test_dns(timeout),
+            'ping': lambda timeout: self.test_ping(http_port, profile.get('ping_samples', PING_SAMPLES),
+                                                   servers, timeout),
+            # Заморозка / троттлинг
+            'dpi': lambda timeout: self.test_dpi(http_port, timeout=timeout),
+            'speed': lambda timeout: self.test_speed(http_port, streams=profile.get('speed_streams', SPEEDTEST_STREAMS),
+                                                     timeout=timeout),
+            # Выборочно, 4 цели
+            'traceroute': lambda timeout: self.test_traceroute(http_port, timeout),
+        }
 
         try:
-            # Тест IP
-            result['ip_check'] = self.test_ip(http_port)
-
-            # Проверка DNS (без прокси - локальные DNS)
-            result['dns_check'] = self.test_dns()
-
-            # Тест пингов (10 серверов)
-            result['ping'] = self.test_ping(http_port)
-
-            # Тест скорости (100MB)
-            result['speed'] = self.test_speed(http_port)
-
-            # Трассировка (выборочно, 4 цели)
-            result['traceroute'] = self.test_traceroute(http_port)
+            skipped = []
+            for i, (phase, _) in enumerate(phases):
+                # Фазе - всё оставшееся время, кроме гарантированного следующим
+                timeout = deadline - time.time() - sum(seconds for _, seconds in phases[i + 1:])
+                if timeout < PHASE_MIN_TIME[phase]:
+                    skipped.append(phase)
+                    continue
+                with instrumentation.span(phase, timings, **ctx):
+                    result[PHASE_RESULT_KEYS.get(phase, phase)] = runners[phase](timeout)
+                if phase == 'ip' and result['ip_check'].get('status') != 'ok':
+                    # Туннель не работает - остальные фазы только съели бы бюджет на таймаутах
+                    skipped += [name for name, _ in phases[i + 1:]]
+                    break
+            if skipped:
+                result['skipped_phases'] = skipped
 
             # Определяем общий статус
-            if result['ip_check'].get('status') == 'ok':
+            if result.get('ip_check', {}).get('status') == 'ok':
                 result['status'] = 'working'
             else:
                 result['status'] = 'not_working'
+                result['failure_class'] = proc.output.failure_class or 'no_connectivity'
+                result['xray_log'] = proc.output.tail()
+
+        finally:
+            with instrumentation.span('xray_stop', timings, **ctx):
+                self.stop_xray(proc)
+
+        return result
 
+    def gate_check(self, config: VlessConfig, cancel: threading.Event = None) -> dict:
+        """Быстрая проверка: поднимается ли туннель и отвечает ли GATE_URL"""
+        cancel = cancel or threading.Event()
+        socks_port, http_port = _free_port(), _free_port()
+        result = {'name': config.name, 'status': 'fail', 'time_ms': None}
+        if cancel.is_set():
+            result['status'] = 'cancelled'
+            return result
+
+        proc = self.start_xray(config, socks_port, http_port, cancel)
+        try:
+            if cancel.is_set():
+                result['status'] = 'cancelled'
+                return result
+            if proc.poll() is not None:
+                proc.output.wait()
+                result['status'] = 'failed_to_start'
+                result['failure_class'] = proc.output.failure_class or 'exited'
+                return result
+
+            status, time_ms = self.gate_request(http_port, cancel)
+            result['status'] = status
+            result['time_ms'] = time_ms
+            if status == 'fail':
+                result['failure_class'] = proc.output.failure_class or 'no_connectivity'
         finally:
             self.stop_xray(proc)
 
+        if result['status'] != 'cancelled':
+            self.history.record(config.name, result['status'] == 'ok', result['time_ms'])
         return result
+
+    def gate_request(self, http_port: int, cancel: threading.Event = None) -> tuple:
+        """Один запрос к GATE_URL через HTTP inbound: (ok | fail | cancelled, time_ms)"""
+        cancel = cancel or threading.Event()
+        curl = subprocess.Popen(
+            ['curl', '-s', '-o', '/dev/null', '-w', '%{http_code},%{time_total}',
+             '--proxy', f"http://127.0.0.1:{http_port}",
+             '--connect-timeout', str(GATE_TIMEOUT), '--max-time', str(GATE_TIMEOUT),
+             GATE_URL],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        # Ждём curl, но прерываемся сразу, как только гонка выиграна другими
+        while curl.poll() is None:
+            if cancel.wait(0.05):
+                curl.kill()
+                curl.wait()
+                return 'cancelled', None
+
+        resp = curl.stdout.read().decode().strip().split(',')
+        if curl.returncode == 0 and resp[0] == '200':
+            return 'ok', round(float(resp[1]) * 1000, 2)
+        return 'fail', None
+
+    def find_working(self, count: int = 1, parallel: int = FIRST_WORKING_PARALLEL,
+                     configs: list = None) -> list:
+        """
+        Найти первые N рабочих конфигов как можно быстрее.
+
+        Кандидаты сортируются по истории (доля успехов, затем задержка),
+        проверяются параллельно; как только N прошли gate check,
+        остальные проверки отменяются.
+        """
+        if configs is None:
+            if not self.configs:
+                self.load_configs()
+            configs = self.configs
+        candidates = self.history.order([c for c in configs if c.parsed])
+
+        winners = []
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=max(1, parallel))
+        try:
+            futures = {pool.submit(self.gate_check, c, cancel): c for c in candidates}
+            for future in as_completed(futures):
+                try:
+                    check = future.result()
+                except Exception as e:
+                    print(f"Gate check error ({futures[future].name}): {e}")
+                    continue
+                if check['status'] == 'ok':
+                    winners.append({'config': futures[future], 'time_ms': check['time_ms']})
+                    print(f"✅ Working config found: {check['name']} ({check['time_ms']:.0f} ms)")
+                    if len(winners) >= count:
+                        break
+        finally:
+            cancel.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        return winners
     
-    def run_all_tests(self):
-        """Запуск тестов для всех конфигураций"""
+    def run_all_tests(self, resume_run_id: str = None):
+        """
+        Запуск тестов для всех конфигураций.
+        Результаты пишутся в журнал прогона; resume_run_id - продолжить прерванный.
+        """
         self.load_configs()
-        self.results = []
+        if resume_run_id:
+            self.journal = RunJournal.open(resume_run_id)
+            self.probe_profile = self.journal.meta.get('probe_profile', self.probe_profile)
+            done = self.journal.done_names()
+            print(f"Resuming run {resume_run_id}: {len(done)} configs already tested")
+        else:
+            self.journal = RunJournal.create(len(self.configs), probe_profile=self.probe_profile)
+            done = set()
         
         for config in self.configs:
+            if config.name in done:
+                continue
             result = self.test_config(config)
-            self.results.append(result)
+            self.journal.append(result)
             
             # Пауза между тестами
             time.sleep(1)
         
+        self.results = self.journal.results()
+        self.journal.finish()
         return self.results
     
     def generate_report(self) -> tuple:
         """Генерация отчётов (HTML и MD)"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        # HTML отчёт
-        html_content = self._generate_html()
+        # HTML отчёт (для больших прогонов - сводка + данные, подгружаемые по требованию)
+        if len(self.results) > REPORT_PARTITION_THRESHOLD:
+            html_content = self._generate_partitioned(f"report_{timestamp}.data")
+        else:
+            html_content = self._generate_html()
         html_file = REPORTS_DIR / f"report_{timestamp}.html"
-        with open(html_file, 'w') as f:
-            f.write(html_content)
+        write_report_file(html_file, html_content)
         
         # MD отчёт
         md_content = self._generate_md()
         md_file = REPORTS_DIR / f"report_{timestamp}.md"
-        with open(md_file, 'w') as f:
-            f.write(md_content)
+        write_report_file(md_file, md_content)
         
         # Копия последнего отчёта
-        with open(REPORTS_DIR / "latest.html", 'w') as f:
-            f.write(html_content)
-        with open(REPORTS_DIR / "latest.md", 'w') as f:
-            f.write(md_content)
+        write_report_file(REPORTS_DIR / "latest.html", html_content)
+        write_report_file(REPORTS_DIR / "latest.md", md_content)
         
         return html_file, md_file
     
-    def _generate_html(self) -> str:
-        """Генерация HTML отчёта в стиле Матрицы"""
-        working = [r for r in self.results if r.get('status') == 'working']
-        not_working = [r for r in self.results if r.get('status') != 'working']
+    def generate_diff(self, journal: RunJournal, html_file: Path) -> dict:
+        """
+        Отчёт об изменениях относительно предыдущего завершённого прогона:
+        report_<ts>.diff.md рядом с HTML. None - предыдущего прогона нет.
+        """
+        previous = journal.previous()
+        if previous is None:
+            return None
+        delta = run_diff.diff_runs(previous.results(), self.results)
+        delta['previous_run_id'] = previous.run_id
+        diff_file = html_file.with_suffix('.diff.md')
+        write_report_file(diff_file, run_diff.render_md(delta, f"Delta {previous.run_id} → {journal.run_id}"))
+        delta['file'] = diff_file.name
+        return delta
 
-        html = f"""<!DOCTYPE html>
+    def _html_header(self, total: int, working: int, not_working: int) -> str:
+        """Шапка HTML отчёта: стили, заголовок и карточки со сводкой"""
+        return f"""<!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
@@ -756,20 +1550,39 @@ class VpnTester:
 
         <div class="summary">
             <div class="card total">
-                <h3>{len(self.results)}</h3>
+                <h3>{total}</h3>
                 <p>Total Configs</p>
             </div>
             <div class="card working">
-                <h3>{len(working)}</h3>
+                <h3>{working}</h3>
                 <p>Working ✅</p>
             </div>
             <div class="card not-working">
-                <h3>{len(not_working)}</h3>
+                <h3>{not_working}</h3>
                 <p>Not Working ❌</p>
             </div>
         </div>
 """
 
+    def _html_footer(self) -> str:
+        """Подпись и закрывающие теги HTML отчёта"""
+        return """
+        <div class="signature">
+            <p>━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━</p>
+            <p>VPN TESTER CS-CART | by MatrixHasYou</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+    def _generate_html(self) -> str:
+        """Генерация HTML отчёта в стиле Матрицы"""
+        working = [r for r in self.results if r.get('status') == 'working']
+        not_working = [r for r in self.results if r.get('status') != 'working']
+
+        html = self._html_header(len(self.results), len(working), len(not_working))
+
         # Working configs table
         if working:
             html += """
@@ -783,16 +1596,16 @@ class VpnTester:
                     <th>SNI</th>
                     <th>Security</th>
                     <th>IP</th>
-                    <th>Avg Ping</th>
-                    <th>Speed (100MB)</th>
+                    <th>Ping (p50)</th>
+                    <th>Speed</th>
                 </tr>
             </thead>
             <tbody>
 """
-            for r in sorted(working, key=lambda x: self._get_avg_ping(x)):
+            for r in sorted(working, key=lambda x: self._get_median_ping(x)):
                 info = r.get('info', {})
-                avg_ping = self._get_avg_ping(r)
-                ping_class = 'ping-good' if avg_ping < 150 else ('ping-avg' if avg_ping < 400 else 'ping-bad')
+                median_ping_ms = self._get_median_ping(r)
+                ping_class = 'ping-good' if median_ping_ms < 150 else ('ping-avg' if median_ping_ms < 400 else 'ping-bad')
                 speed = r.get('speed', {})
                 speed_str = 'N/A'
                 speed_class = ''
@@ -812,7 +1625,7 @@ class VpnTester:
                     <td>{info.get('sni', 'N/A')}</td>
                     <td>{info.get('security', 'none')}</td>
                     <td>{r.get('ip_check', {}).get('ip', 'N/A')}</td>
-                    <td class="{ping_class}">{avg_ping:.0f} ms</td>
+                    <td class="{ping_class}">{median_ping_ms:.0f} ms</td>
                     <td class="{speed_class}">{speed_str}</td>
                 </tr>
 """
@@ -821,6 +1634,35 @@ class VpnTester:
         </div>
 """
 
+        # Vantage points (прогон с нескольких серверов - колонка на каждую точку)
+        vantages = self._vantage_names()
+        if vantages:
+            html += """
+        <h2>🌍 VANTAGE POINTS</h2>
+        <div class="scroll-table">
+        <table>
+            <thead>
+                <tr>
+                    <th>Name</th>
+""" + ''.join(f"                    <th>{v}</th>\n" for v in vantages) + """                </tr>
+            </thead>
+            <tbody>
+"""
+            for r in self.results:
+                cells = ''
+                for v in vantages:
+                    data = r['vantages'].get(v)
+                    css = 'ping-good' if data and data['status'] == 'working' else 'ping-bad'
+                    cells += f"                    <td class=\"{css}\">{self._vantage_cell(data)}</td>\n"
+                html += f"""                <tr>
+                    <td class="config-name">{r.get('name', 'Unknown')}</td>
+{cells}                </tr>
+"""
+            html += """            </tbody>
+        </table>
+        </div>
+"""
+
         # Ping details by region
         if working:
             html += """
@@ -854,6 +1696,10 @@ class VpnTester:
                 <div class="ping-item">
                     <div class="name">{status_icon} {server}</div>
                     <div class="value {ping_class}">{time_ms:.0f} ms</div>
+"""
+                        if data.get('p95_ms') is not None:
+                            html += f"""                    <div style="font-size: 0.75em; opacity: 0.7;">p95 {data['p95_ms']:.0f} · min {data.get('min_ms', 0):.0f} · jitter {data.get('jitter_ms', 0):.0f}</div>
+                    <div style="font-size: 0.75em; opacity: 0.7;">cold {data.get('first_ms', 0):.0f} ms (handshake {data.get('connect_ms', 0):.0f})</div>
 """
                         if data.get('http_code') and data['http_code'] != '000':
                             html += f"""                    <div style="font-size: 0.75em; opacity: 0.7;">HTTP: {data['http_code']}</div>
@@ -867,6 +1713,52 @@ class VpnTester:
         </div>
 """
 
+        # Latency breakdown by phase
+        if working:
+            html += """
+        <h2>⏳ LATENCY BREAKDOWN (MEDIAN BY PHASE)</h2>
+        <div class="scroll-table">
+        <table>
+            <thead>
+                <tr>
+                    <th>Config</th>
+"""
+            for _, title in LATENCY_PHASES:
+                html += f"""                    <th>{title}</th>
+"""
+            html += """                    <th>Breakdown</th>
+                    <th>Dominant</th>
+                </tr>
+            </thead>
+            <tbody>
+"""
+            phase_colors = ['#0f0', '#0ff', '#ff0', '#f0f']
+            for r in working:
+                phases = self._get_phase_medians(r)
+                if not phases:
+                    continue
+                total = sum(phases.values()) or 1
+                bar = ''.join(
+                    f'<div title="{title}" style="display: inline-block; height: 10px; width: {phases[key] / total * 150:.0f}px; background: {color};"></div>'
+                    for (key, title), color in zip(LATENCY_PHASES, phase_colors)
+                )
+                dominant_key = max(phases, key=phases.get)
+                dominant = dict(LATENCY_PHASES)[dominant_key]
+                html += f"""                <tr>
+                    <td class="config-name">{r.get('name', 'Unknown')}</td>
+"""
+                for key, _ in LATENCY_PHASES:
+                    html += f"""                    <td>{phases[key]:.0f} ms</td>
+"""
+                html += f"""                    <td>{bar}</td>
+                    <td class="speed-slow">{dominant}</td>
+                </tr>
+"""
+            html += """            </tbody>
+        </table>
+        </div>
+"""
+
         # Traceroute details - упрощённо
         if working:
             html += """
@@ -942,8 +1834,14 @@ class VpnTester:
 
         # Speed test details
         if working:
-            html += """
-        <h2>🚀 SPEED TEST (100MB DOWNLOAD)</h2>
+            # Потоков столько, сколько было в замере (профили проб: standard - 1, deep - SPEEDTEST_STREAMS)
+            stream_counts = sorted({len(data['streams']) if data.get('streams') else
+                                    PROBE_PROFILES.get(r.get('probe_profile'), {}).get('speed_streams', SPEEDTEST_STREAMS)
+                                    for r in working for data in r.get('speed', {}).values()})
+            low, high = (stream_counts[0], stream_counts[-1]) if stream_counts else (0, 0)
+            streams = str(low) if low == high else f"{low}-{high}"
+            html += f"""
+        <h2>🚀 SPEED TEST ({streams} STREAMS, {SPEEDTEST_MIN_TIME}-{SPEEDTEST_WINDOW}s)</h2>
         <div class="scroll-table">
         <table>
             <thead>
@@ -951,7 +1849,11 @@ class VpnTester:
                     <th>Config</th>
                     <th>Size</th>
                     <th>Speed</th>
+                    <th>Per Stream</th>
+                    <th>Throughput</th>
                     <th>Time</th>
+                    <th>Data Used</th>
+                    <th>Time Saved</th>
                     <th>Status</th>
                 </tr>
             </thead>
@@ -960,12 +1862,20 @@ class VpnTester:
             for r in working:
                 speed = r.get('speed', {})
                 for url, data in speed.items():
+                    per_stream = ' / '.join(f"{st.get('speed_mbps', 0):.1f}" for st in data.get('streams', [])) or '-'
+                    data_used = f"{data.get('bytes_consumed', data.get('size_bytes', 0)) / 1_000_000:.1f} MB"
+                    time_saved = f"{data.get('time_saved_sec', 0):.1f}s" + (' ✓' if data.get('converged') else '')
+                    sparkline = self._sparkline_svg(data.get('samples_kbps', []), data.get('sample_interval_ms', 250))
                     if data.get('status') == 'ok':
                         html += f"""                <tr>
                     <td class="config-name">{r.get('name', 'Unknown')}</td>
                     <td>{data.get('size_mb', 0):.1f} MB</td>
                     <td class="speed">{data.get('speed_mbps', 0):.2f} Mbps</td>
+                    <td style="font-size: 0.85em; opacity: 0.8;">{per_stream}</td>
+                    <td>{sparkline}</td>
                     <td>{data.get('time_sec', 0):.1f}s</td>
+                    <td>{data_used}</td>
+                    <td>{time_saved}</td>
                     <td><span class="status working">OK</span></td>
                 </tr>
 """
@@ -974,7 +1884,11 @@ class VpnTester:
                     <td class="config-name">{r.get('name', 'Unknown')}</td>
                     <td>{data.get('size_bytes', 0) / 1000:.0f} KB</td>
                     <td class="speed-slow">N/A</td>
+                    <td style="font-size: 0.85em; opacity: 0.8;">{per_stream}</td>
+                    <td>{sparkline}</td>
                     <td>-</td>
+                    <td>{data_used}</td>
+                    <td>{time_saved}</td>
                     <td><div class="blocked-warning">⚠️ BLOCKED?</div></td>
                 </tr>
 """
@@ -983,6 +1897,53 @@ class VpnTester:
         </div>
 """
 
+        # DPI check
+        if working:
+            html += """
+        <h2>🧱 DPI CHECK</h2>
+        <div class="scroll-table">
+        <table>
+            <thead>
+                <tr>
+                    <th>Config</th>
+                    <th>Verdict</th>
+                    <th>Freeze Point</th>
+                    <th>Stalled</th>
+                    <th>Throttled</th>
+                    <th>Time</th>
+                </tr>
+            </thead>
+            <tbody>
+"""
+            for r in working:
+                dpi = r.get('dpi')
+                if not dpi:
+                    continue
+                verdict = dpi.get('verdict', 'unknown')
+                verdict_text = {
+                    'clean': '✅ CLEAN',
+                    'freeze': '🧊 FREEZE',
+                    'throttled': '🐢 THROTTLED',
+                    'no_data': '❌ NO DATA',
+                }.get(verdict, f'❓ {verdict.upper()}')
+                verdict_class = 'speed' if verdict == 'clean' else 'speed-slow'
+                freeze_at = dpi.get('freeze_after_bytes')
+                freeze_str = f"{freeze_at / 1000:.1f} KB" if freeze_at else '-'
+
+                html += f"""                <tr>
+                    <td class="config-name">{r.get('name', 'Unknown')}</td>
+                    <td class="{verdict_class}">{verdict_text}</td>
+                    <td>{freeze_str}</td>
+                    <td>{dpi.get('stalled', 0)}/{dpi.get('connections', 0)}</td>
+                    <td>{dpi.get('throttled', 0)}/{dpi.get('connections', 0)}</td>
+                    <td>{dpi.get('time_sec', 0):.1f}s</td>
+                </tr>
+"""
+            html += """            </tbody>
+        </table>
+        </div>
+"""
+
         # Not working configs
         if not_working:
             html += """
@@ -1000,7 +1961,7 @@ class VpnTester:
 """
             for r in not_working:
                 info = r.get('info', {})
-                details = r.get('ip_check', {}).get('error', r.get('status', 'unknown'))
+                details = r.get('failure_class') or r.get('ip_check', {}).get('error', r.get('status', 'unknown'))
                 html += f"""                <tr>
                     <td class="config-name">{r.get('name', 'Unknown')}</td>
                     <td>{info.get('host', '?')}:{info.get('port', '?')}</td>
@@ -1012,26 +1973,185 @@ class VpnTester:
         </table>
 """
 
-        html += f"""
-        <div class="signature">
-            <p>━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━</p>
-            <p>VPN TESTER CS-CART | by MatrixHasYou</p>
-        </div>
-    </div>
-</body>
-</html>
+        # Phase timings footer
+        phase_summary = instrumentation.aggregate(self.results)
+        if phase_summary:
+            grand_total = sum(e['total'] for e in phase_summary.values()) or 1
+            html += """
+        <h3>⏱️ PHASE TIMINGS</h3>
+"""
+            budgeted = [r for r in self.results if r.get('budget_sec')]
+            if budgeted:
+                profiles = ', '.join(f"{name} ({budget}s)" for name, budget in
+                                     sorted({(r['probe_profile'], r['budget_sec']) for r in budgeted}))
+                over = sum(1 for r in budgeted if r.get('elapsed_sec', 0) > r['budget_sec'])
+                html += f"""        <p style="font-size: 0.75em; opacity: 0.85;">Probe profile: {profiles} · over budget: {over}/{len(budgeted)}</p>
+"""
+            html += """        <table style="font-size: 0.75em; opacity: 0.85;">
+            <thead>
+                <tr>
+                    <th>Phase</th>
+                    <th>Total</th>
+                    <th>Mean</th>
+                    <th>Max</th>
+                    <th>Share</th>
+                </tr>
+            </thead>
+            <tbody>
+"""
+            for phase, e in sorted(phase_summary.items(), key=lambda kv: -kv[1]['total']):
+                html += f"""                <tr>
+                    <td>{phase}</td>
+                    <td>{e['total']:.1f}s</td>
+                    <td>{e['mean']:.1f}s</td>
+                    <td>{e['max']:.1f}s</td>
+                    <td>{e['total'] / grand_total * 100:.0f}%</td>
+                </tr>
 """
+            html += """            </tbody>
+        </table>
+"""
+
+        html += self._html_footer()
         return html
     
-    def _get_avg_ping(self, result: dict) -> float:
-        """Средний пинг"""
-        ping = result.get('ping', {})
-        times = []
-        for server, data in ping.items():
-            if data.get('status') == 'ok':
-                times.append(data.get('time_ms', 0))
-        return sum(times) / len(times) if times else float('inf')
-    
+    def _vantage_names(self) -> list:
+        """Точки замера в порядке появления (пусто - прогон с одной точки)"""
+        names = []
+        for r in self.results:
+            for vantage in r.get('vantages', {}):
+                if vantage not in names:
+                    names.append(vantage)
+        return names
+
+    @staticmethod
+    def _vantage_cell(data: dict) -> str:
+        """Ячейка колонки точки замера: статус, пинг, скорость"""
+        if data is None:
+            return '—'
+        if data['status'] != 'working':
+            return f"❌ {data['status']}"
+        cell = f"✅ {data['ping_ms']} ms" if data['ping_ms'] is not None else '✅'
+        if data['speed_mbps'] is not None:
+            cell += f" / {data['speed_mbps']:.1f} Mbps"
+        return cell
+
+    def _compact_row(self, r: dict, chunk: int) -> list:
+        """Строка таблицы для index.json: [name, host:port, status, ping, speed, dpi, details, chunk]"""
+        info = r.get('info', {})
+        ping = self._get_median_ping(r)
+        speed = next((d.get('speed_mbps') for d in r.get('speed', {}).values() if d.get('status') == 'ok'), None)
+        return [
+            r.get('name', 'Unknown'),
+            f"{info.get('host', '?')}:{info.get('port', '?')}",
+            r.get('status', 'unknown'),
+            None if ping == float('inf') else round(ping),
+            speed,
+            r.get('dpi', {}).get('verdict'),
+            r.get('failure_class') or r.get('ip_check', {}).get('error'),
+            chunk,
+        ]
+
+    def _generate_partitioned(self, data_dir_name: str) -> str:
+        """
+        Отчёт для больших прогонов: страница-сводка фиксированного размера
+        (карточки + топ лучших конфигов), полная таблица строится в браузере
+        из index.json, детали конфига подгружаются из chunk_NNNN.json по клику.
+        """
+        data_dir = REPORTS_DIR / data_dir_name
+        data_dir.mkdir(parents=True, exist_ok=True)
+
+        rows = []
+        working_count = 0
+        for chunk_index, offset in enumerate(range(0, len(self.results), REPORT_CHUNK_SIZE)):
+            chunk = self.results[offset:offset + REPORT_CHUNK_SIZE]
+            write_report_file(data_dir / f"chunk_{chunk_index:04d}.json",
+                              json.dumps(chunk, ensure_ascii=False, separators=(',', ':')))
+            for r in chunk:
+                rows.append(self._compact_row(r, chunk_index))
+                working_count += r.get('status') == 'working'
+
+        write_report_file(data_dir / "index.json", json.dumps({
+            'generated': datetime.now().isoformat(),
+            'columns': ['name', 'host', 'status', 'ping_ms', 'speed_mbps', 'dpi', 'details', 'chunk'],
+            'rows': rows,
+        }, ensure_ascii=False, separators=(',', ':')))
+
+        html = self._html_header(len(self.results), working_count, len(self.results) - working_count)
+
+        top = sorted((row for row in rows if row[2] == 'working'),
+                     key=lambda row: row[3] if row[3] is not None else float('inf'))[:REPORT_SUMMARY_TOP]
+        if top:
+            html += f"""
+        <h2>🏆 TOP {len(top)} WORKING CONFIGS</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>Name</th>
+                    <th>Host:Port</th>
+                    <th>Ping (p50)</th>
+                    <th>Speed</th>
+                    <th>DPI</th>
+                </tr>
+            </thead>
+            <tbody>
+"""
+            for row in top:
+                ping_str = f"{row[3]} ms" if row[3] is not None else 'N/A'
+                speed_str = f"{row[4]:.2f} Mbps" if row[4] is not None else 'N/A'
+                html += f"""                <tr>
+                    <td class="config-name">{row[0]}</td>
+                    <td>{row[1]}</td>
+                    <td>{ping_str}</td>
+                    <td class="speed">{speed_str}</td>
+                    <td>{row[5] or '-'}</td>
+                </tr>
+"""
+            html += """            </tbody>
+        </table>
+"""
+
+        html += REPORT_LAZY_SECTION.replace('__DATA_DIR__', data_dir_name)
+        html += self._html_footer()
+        return html
+
+    def _sparkline_svg(self, samples: list, interval_ms: int = 250, width: int = 160, height: int = 30) -> str:
+        """Мини-график скорости (inline SVG) по временному ряду samples_kbps"""
+        if len(samples) < 2:
+            return '-'
+        peak = max(samples) or 1
+        step = width / (len(samples) - 1)
+        points = ' '.join(
+            f"{i * step:.1f},{height - 2 - (v / peak) * (height - 4):.1f}"
+            for i, v in enumerate(samples)
+        )
+        title = f"{len(samples)} samples × {interval_ms}ms, peak {peak / 1000:.1f} Mbps"
+        return (f'<svg width="{width}" height="{height}" style="background: #001100;">'
+                f'<title>{title}</title>'
+                f'<polyline points="{points}" fill="none" stroke="#0ff" stroke-width="1.5"/></svg>')
+
+    def _get_phase_medians(self, result: dict) -> dict:
+        """Медиана каждой фазы соединения по всем успешным целям конфига"""
+        per_phase = {key: [] for key, _ in LATENCY_PHASES}
+        for data in result.get('ping', {}).values():
+            phases = data.get('phases')
+            if data.get('status') == 'ok' and phases:
+                for key in per_phase:
+                    per_phase[key].append(phases.get(key, 0))
+        if not per_phase['local_ms']:
+            return {}
+        medians = {}
+        for key, values in per_phase.items():
+            values.sort()
+            mid = len(values) // 2
+            medians[key] = values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+        return medians
+
+    def _get_median_ping(self, result: dict) -> float:
+        """Медиана пинга по целям (stats.median_ping); нет замеров - inf, в конец сортировки"""
+        ping = median_ping(result)
+        return float('inf') if ping is None else ping
+
     def _generate_md(self) -> str:
         """Генерация MD отчёта"""
         working = [r for r in self.results if r.get('status') == 'working']
@@ -1053,22 +2173,31 @@ class VpnTester:
 
 ## ✅ Working Configs ({len(working)})
 
-| Name | Host:Port | SNI | Security | IP | Avg Ping | Speed |
+| Name | Host:Port | SNI | Security | IP | Ping (p50) | Speed |
 |------|-----------|-----|----------|-----|----------|-------|
 """
         
-        for r in sorted(working, key=lambda x: self._get_avg_ping(x)):
+        for r in sorted(working, key=lambda x: self._get_median_ping(x)):
             info = r.get('info', {})
-            avg_ping = self._get_avg_ping(r)
+            median_ping_ms = self._get_median_ping(r)
             speed = r.get('speed', {})
             speed_str = 'N/A'
             for url, data in speed.items():
                 if data.get('status') == 'ok':
-                    speed_str = f"{data.get('speed_mbps', 0):.2f} Mbps"
+                    speed_str = f"{data.get('speed_mbps', 0):.2f} Mbps ({len(data.get('streams', []))}×)"
                     break
             
-            md += f"| {r.get('name', 'Unknown')} | {info.get('host', '?')}:{info.get('port', '?')} | {info.get('sni', 'N/A')} | {info.get('security', 'none')} | {r.get('ip_check', {}).get('ip', 'N/A')} | {avg_ping:.0f}ms | {speed_str} |\n"
+            md += f"| {r.get('name', 'Unknown')} | {info.get('host', '?')}:{info.get('port', '?')} | {info.get('sni', 'N/A')} | {info.get('security', 'none')} | {r.get('ip_check', {}).get('ip', 'N/A')} | {median_ping_ms:.0f}ms | {speed_str} |\n"
         
+        vantages = self._vantage_names()
+        if vantages:
+            md += "\n---\n\n## 🌍 Vantage Points\n\n"
+            md += "| Name | " + " | ".join(vantages) + " |\n"
+            md += "|------|" + "|".join('---' for _ in vantages) + "|\n"
+            for r in self.results:
+                md += f"| {r.get('name', 'Unknown')} | " + " | ".join(
+                    self._vantage_cell(r['vantages'].get(v)) for v in vantages) + " |\n"
+
         md += f"\n---\n\n## ❌ Not Working Configs ({len(not_working)})\n\n"
         
         if not_working:
@@ -1076,13 +2205,152 @@ class VpnTester:
             md += "|------|-----------|--------|---------|\n"
             for r in not_working:
                 info = r.get('info', {})
-                details = r.get('ip_check', {}).get('error', r.get('status', 'unknown'))
+                details = r.get('failure_class') or r.get('ip_check', {}).get('error', r.get('status', 'unknown'))
                 md += f"| {r.get('name', 'Unknown')} | {info.get('host', '?')}:{info.get('port', '?')} | {r.get('status', 'not_working')} | {details} |\n"
         
+        phase_summary = instrumentation.aggregate(self.results)
+        if phase_summary:
+            md += "\n---\n\n## ⏱️ Phase Timings\n\n"
+            md += "| Phase | Total | Mean | Max |\n"
+            md += "|-------|-------|------|-----|\n"
+            for phase, e in sorted(phase_summary.items(), key=lambda kv: -kv[1]['total']):
+                md += f"| {phase} | {e['total']:.1f}s | {e['mean']:.1f}s | {e['max']:.1f}s |\n"
+
         md += f"\n---\n\n*Report generated by VPN Tester*\n"
         return md
 
 
+class ProxyLease:
+    """
+    Прокси на заведомо рабочем конфиге для исходящей доставки (Telegram).
+
+    Кандидаты - самые быстрые working конфиги текущего прогона, затем лучшие
+    по истории. Поднятый Xray переиспользуется следующими отправками: если
+    с последней проверки прошло больше PROXY_LEASE_FRESH секунд, через него
+    делается gate запрос. После PROXY_LEASE_TTL секунд простоя Xray останавливается.
+    """
+
+    _current = None
+    _lock = threading.Lock()
+
+    def __init__(self, tester: 'VpnTester', config: VlessConfig, proc: subprocess.Popen,
+                 socks_port: int, http_port: int):
+        self.tester = tester
+        self.config = config
+        self.proc = proc
+        self.socks_port = socks_port
+        self.http_port = http_port
+        self.verified_at = time.time()
+        self.reused = False
+        self._timer = None
+
+    @property
+    def proxies(self) -> dict:
+        proxy = f"socks5h://127.0.0.1:{self.socks_port}"
+        return {'http': proxy, 'https': proxy}
+
+    @classmethod
+    def acquire(cls, tester: 'VpnTester' = None, results: list = None,
+                prefer: VlessConfig = None) -> 'ProxyLease':
+        """Живой прокси (уже поднятый или новый) или None, если рабочих конфигов нет"""
+        with cls._lock:
+            lease = cls._current
+            if lease is not None and lease.proc.poll() is None:
+                if time.time() - lease.verified_at < PROXY_LEASE_FRESH or lease._check():
+                    lease.reused = True
+                    lease._touch()
+                    return lease
+            if lease is not None:
+                lease._close()
+                cls._current = None
+
+            tester = tester or VpnTester()
+            for config in cls._candidates(tester, results, prefer):
+                lease = cls._start(tester, config)
+                if lease is not None:
+                    break
+            else:
+                # Ни один из лучших не поднялся - параллельный поиск по всем
+                winners = tester.find_working(1)
+                lease = cls._start(tester, winners[0]['config']) if winners else None
+            if lease is not None:
+                cls._current = lease
+                lease._touch()
+            return lease
+
+    @classmethod
+    def invalidate(cls, lease: 'ProxyLease'):
+        """Прокси подвёл при отправке - следующий acquire поднимет другой"""
+        with cls._lock:
+            if cls._current is lease:
+                cls._current = None
+        lease._close()
+
+    @classmethod
+    def _candidates(cls, tester: 'VpnTester', results: list, prefer: VlessConfig) -> list:
+        if not tester.configs:
+            tester.load_configs()
+        by_name = {c.name: c for c in tester.configs if c.parsed}
+        # Проверенные в этом прогоне - по медиане пинга, затем по истории
+        verified = sorted((r for r in results or [] if r.get('status') == 'working' and r.get('name') in by_name),
+                          key=tester._get_median_ping)
+        names = [r['name'] for r in verified]
+        names += [c.name for c in tester.history.order(list(by_name.values())) if c.name not in names]
+        candidates = [by_name[name] for name in names[:PROXY_LEASE_CANDIDATES]]
+        if prefer is not None:
+            candidates = [prefer] + [c for c in candidates if c.name != prefer.name]
+        return candidates
+
+    @classmethod
+    def _start(cls, tester: 'VpnTester', config: VlessConfig) -> 'ProxyLease':
+        socks_port, http_port = _free_port(), _free_port()
+        try:
+            proc = tester.start_xray(config, socks_port, http_port)
+        except OSError as e:
+            print(f"Proxy start error ({config.name}): {e}")
+            return None
+        lease = cls(tester, config, proc, socks_port, http_port)
+        if proc.poll() is None and lease._check():
+            return lease
+        tester.stop_xray(proc)
+        return None
+
+    def _check(self) -> bool:
+        status, _ = self.tester.gate_request(self.http_port)
+        if status == 'ok':
+            self.verified_at = time.time()
+        return status == 'ok'
+
+    def _touch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(PROXY_LEASE_TTL, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with ProxyLease._lock:
+            if ProxyLease._current is self:
+                ProxyLease._current = None
+        self._close()
+
+    def _close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.proc.poll() is None:
+            self.tester.stop_xray(self.proc)
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            lease, cls._current = cls._current, None
+        if lease is not None:
+            lease._close()
+
+
+atexit.register(ProxyLease.close_all)
+
+
 if __name__ == "__main__":
     import sys
     
@@ -1092,12 +2360,62 @@ if __name__ == "__main__":
         command = sys.argv[1]
         
         if command == "test":
-            tester.run_all_tests()
+            if "--profile" in sys.argv:
+                tester.profile = True
+            if "--probe" in sys.argv:
+                tester.probe_profile = sys.argv[sys.argv.index("--probe") + 1]
+                if tester.probe_profile not in PROBE_PROFILES:
+                    print(f"Unknown probe profile: {tester.probe_profile} ({', '.join(PROBE_PROFILES)})")
+                    sys.exit(1)
+            resume = sys.argv[sys.argv.index("--resume") + 1] if "--resume" in sys.argv else None
+            tester.run_all_tests(resume)
             html_file, md_file = tester.generate_report()
+            delta = tester.generate_diff(tester.journal, html_file)
+            tester.journal.finish(report=html_file.name, diff=delta['file'] if delta else None)
             print(f"Reports generated:")
             print(f"  HTML: {html_file}")
             print(f"  MD: {md_file}")
+            if delta:
+                print(f"  Delta: {REPORTS_DIR / delta['file']}")
+            retention.enforce(REPORTS_DIR, LOGS_DIR)
+            
+        elif command == "retention":
+            summary = retention.enforce(REPORTS_DIR, LOGS_DIR, dry_run="--dry-run" in sys.argv)
+            print(f"Rolled up runs: {len(summary['rolled_up'])}")
+            print(f"Archived files: {len(summary['archived'])}, deleted: {len(summary['deleted'])}")
+            print(f"Freed: {summary['freed_bytes'] / 1024 / 1024:.1f} MB, "
+                  f"usage: {summary['usage_bytes'] / 1024 / 1024:.1f} / {summary['budget_bytes'] / 1024 / 1024:.0f} MB")
             
+        elif command == "runs":
+            for run in RunJournal.list_runs() if RUNS_DIR.exists() else []:
+                state = 'completed' if run.get('completed') else 'incomplete'
+                print(f"{run['run_id']:20} {run['done']:>5}/{run.get('total', '?'):<5} {state}")
+
+        elif command == "diff":
+            # diff <run_id> [<previous_run_id>] - по умолчанию с предыдущим завершённым
+            if len(sys.argv) >= 3:
+                journal = RunJournal.open(sys.argv[2])
+                previous = RunJournal.open(sys.argv[3]) if len(sys.argv) >= 4 else journal.previous()
+                if previous is None:
+                    print(f"No completed run before {journal.run_id}")
+                else:
+                    delta = run_diff.diff_runs(previous.results(), journal.results())
+                    print(run_diff.render_md(delta, f"Delta {previous.run_id} → {journal.run_id}"))
+            else:
+                print("Usage: vpn_tester.py diff <run_id> [<previous_run_id>]")
+
+        elif command == "first":
+            count = int(sys.argv[2]) if len(sys.argv) >= 3 else 1
+            winners = tester.find_working(count)
+            for w in winners:
+                print(f"{w['config'].name:30} {w['time_ms']:.0f} ms")
+            if not winners:
+                print("No working configs found")
+
+        elif command == "soak":
+            import soak
+            soak.main(sys.argv[2:])
+
         elif command == "add":
             if len(sys.argv) >= 4:
                 name = sys.argv[2]
@@ -1124,6 +2442,14 @@ if __name__ == "__main__":
         print("VPN Tester - Test VLESS configurations")
         print("Usage:")
         print("  vpn_tester.py test     - Run all tests and generate reports")
+        print("  vpn_tester.py test --profile - Same, with cProfile dump per config in logs/")
+        print("  vpn_tester.py test --resume <run_id> - Continue an interrupted run")
+        print("  vpn_tester.py test --probe quick|standard|deep - Probe profile (time budget per config)")
+        print("  vpn_tester.py runs     - List run journals")
+        print("  vpn_tester.py diff <run_id> [<previous_run_id>] - What changed since the previous run")
+        print("  vpn_tester.py retention [--dry-run] - Roll up old runs, archive raw files, enforce disk budget")
+        print("  vpn_tester.py first [N] - Find first N working configs (fast)")
+        print("  vpn_tester.py soak <name>... [--duration 8h] [--interval 10] - Keep tunnels open, uptime/latency over time")
         print("  vpn_tester.py add <name> <url> - Add new config")
         print("  vpn_tester.py delete <name> - Delete config")
         print("  vpn_tester.py list     - List all configs")
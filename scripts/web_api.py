@@ -3,13 +3,17 @@
 VPN Tester Web API - Flask приложение для управления тестером
 """
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response
+import hmac
+import mimetypes
 import os
+import shutil
 import sys
 import threading
 import subprocess
 from pathlib import Path
 import time
+from datetime import datetime
 
 app = Flask(__name__, static_folder='../web', static_url_path='')
 
@@ -18,21 +22,47 @@ CONFIGS_DIR = BASE_DIR / "configs"
 REPORTS_DIR = BASE_DIR / "reports"
 SCRIPTS_DIR = BASE_DIR / "scripts"
 
-# Глобальная переменная для статуса тестирования
-test_status = {
-    'running': False,
-    'total': 0,
-    'current': 0,
-    'current_config': '',
-    'completed': False,
-    'error': None,
-    'start_time': None,
-    'end_time': None
-}
+# Состояние прогонов - в SQLite (общее для всех процессов WSGI сервера)
+STATE_DB = Path(os.environ.get('VPN_TESTER_STATE_DB', str(REPORTS_DIR / "state.db")))
+# Где идут прогоны: spawn - API запускает демон worker_daemon.py, external - демон
+# запущен отдельно (свой контейнер/unit), thread - по-старому в процессе API
+TEST_WORKER_MODE = os.environ.get('TEST_WORKER_MODE', 'spawn')
+# Общий секрет для удалённых воркеров cluster.py (заголовок X-Cluster-Token); не задан - /api/cluster/* выключены
+CLUSTER_TOKEN = os.environ.get('CLUSTER_TOKEN', '')
 
 # Импорт тестера
 sys.path.insert(0, str(SCRIPTS_DIR))
-from vpn_tester import VpnTester, VlessConfig
+from vpn_tester import (VpnTester, VlessConfig, RunJournal, RUNS_DIR, LOGS_DIR, live_xray_count,
+                        PROBE_PROFILES, DEFAULT_PROBE_PROFILE)
+import metrics
+import retention
+import run_diff
+import system_info
+import worker_daemon
+from run_state import RunState
+from telegram_notify import outbox, send_to_telegram, TELEGRAM_BOT_TOKEN
+from worker_daemon import JobWorker
+
+run_state = RunState(STATE_DB)
+
+metrics.install()
+system_info.PROVIDER.warm()
+metrics.XRAY_PROCESSES.set_function(live_xray_count)
+
+
+def _queue_depth() -> int:
+    status = run_state.status()
+    return max(status['total'] - status['current'], 0) if status['running'] else 0
+
+
+metrics.QUEUE_DEPTH.set_function(_queue_depth)
+metrics.TELEGRAM_OUTBOX.set_function(outbox.pending_count)
+
+# Очередь Telegram общая с процессами worker_daemon.py - отправляет API
+if TELEGRAM_BOT_TOKEN:
+    outbox.start()
+if TEST_WORKER_MODE == 'spawn' and not worker_daemon.is_running(STATE_DB):
+    worker_daemon.spawn(STATE_DB)  # заодно досчитает задание, оставшееся в очереди
 
 
 @app.route('/')
@@ -96,93 +126,223 @@ def delete_config(name):
 
 @app.route('/api/test', methods=['POST'])
 def run_tests():
-    """Запустить тестирование всех конфигураций"""
-    global test_status
-    
-    if test_status['running']:
+    """
+    Запустить тестирование всех конфигураций.
+    {"resume": "<run_id>"} - продолжить прерванный прогон по журналу.
+    {"vantages": ["local", "europe"]} - с нескольких точек замера (удалённые воркеры cluster.py).
+    {"profile": "quick"} - профиль проверки (PROBE_PROFILES: quick / standard / deep).
+    """
+    data = request.get_json(silent=True) or {}
+    resume_run_id = data.get('resume')
+    if resume_run_id and not (RUNS_DIR / f"run_{resume_run_id}.jsonl").exists():
+        return jsonify({'error': f'Run {resume_run_id} not found'}), 404
+    vantages = data.get('vantages')
+    if vantages is not None and (not isinstance(vantages, list) or
+                                 not all(isinstance(v, str) and v for v in vantages)):
+        return jsonify({'error': 'vantages must be a list of names'}), 400
+    probe_profile = data.get('profile')
+    if probe_profile is not None and probe_profile not in PROBE_PROFILES:
+        return jsonify({'error': f"Unknown profile (one of: {', '.join(PROBE_PROFILES)})"}), 400
+
+    # Проверка "уже идёт" и создание задания - одна транзакция (несколько процессов API)
+    params = {'resume': resume_run_id}
+    if probe_profile:
+        params['profile'] = probe_profile
+    if vantages:
+        params['vantages'] = list(dict.fromkeys(vantages))
+    job_id = run_state.create_job('test', params)
+    if job_id is None:
         return jsonify({'error': 'Tests already running'}), 400
-    
-    def run_test_thread():
-        global test_status
-        try:
-            test_status = {
-                'running': True,
-                'total': 0,
-                'current': 0,
-                'current_config': '',
-                'completed': False,
-                'error': None,
-                'start_time': time.time(),
-                'end_time': None
-            }
-            
-            tester = VpnTester()
-            tester.load_configs()
-            
-            test_status['total'] = len(tester.configs)
-            all_results = []  # Сохраняем ВСЕ результаты
-            
-            for i, config in enumerate(tester.configs):
-                test_status['current'] = i
-                test_status['current_config'] = config.name
-                print(f"[{i+1}/{len(tester.configs)}] Testing {config.name}...")
-                
-                result = tester.test_config(config)
-                all_results.append(result)
-                
-                print(f"[{i+1}/{len(tester.configs)}] {config.name}: {result.get('status', 'unknown')}")
-                
-                # Пауза между тестами
-                time.sleep(1)
-            
-            # Генерация отчёта со ВСЕМИ результатами
-            print("Generating report...")
-            test_status['current_config'] = 'Generating report...'
-            
-            # Создаём новый тестер для отчёта
-            report_tester = VpnTester()
-            report_tester.results = all_results
-            html_file, md_file = report_tester.generate_report()
-            
-            # Отправка в Telegram (в фоне)
-            try:
-                import threading
-                telegram_thread = threading.Thread(target=send_to_telegram, args=(html_file,))
-                telegram_thread.daemon = True
-                telegram_thread.start()
-                print("📤 Sending report to Telegram...")
-            except Exception as e:
-                print(f"Telegram send error: {e}")
-            
-            test_status['running'] = False
-            test_status['completed'] = True
-            test_status['end_time'] = time.time()
-            print(f"✅ Tests completed in {test_status['end_time'] - test_status['start_time']:.1f}s")
-            print(f"📊 Generated report with {len(all_results)} configs")
-            
-        except Exception as e:
-            import traceback
-            test_status['running'] = False
-            test_status['error'] = str(e) + '\n' + traceback.format_exc()
-            test_status['end_time'] = time.time()
-            print(f"❌ Test error: {e}")
 
-    thread = threading.Thread(target=run_test_thread)
-    thread.start()
+    # Прогон идёт в демоне worker_daemon.py (или в потоке при TEST_WORKER_MODE=thread)
+    if TEST_WORKER_MODE == 'thread':
+        threading.Thread(target=JobWorker(run_state).run_job, args=(job_id,)).start()
+    elif TEST_WORKER_MODE == 'spawn' and not worker_daemon.is_running(STATE_DB):
+        worker_daemon.spawn(STATE_DB)
 
     return jsonify({
         'success': True,
-        'message': 'Tests started',
+        'message': 'Tests queued',
+        'job_id': job_id,
         'total_configs': len(VpnTester().load_configs() or [])
     })
 
 
+def _cluster_auth():
+    """Ответ с ошибкой, если кластер выключен (нет CLUSTER_TOKEN) или токен неверный; None - можно"""
+    if not CLUSTER_TOKEN:
+        # Задачи несут vless:// ссылки с UUID - без секрета их не отдаём никому
+        return jsonify({'error': 'Cluster disabled (CLUSTER_TOKEN not set)'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Cluster-Token', '').encode(), CLUSTER_TOKEN.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+def _cluster_request() -> tuple:
+    """(тело запроса воркера, None) или (None, ответ с ошибкой): токен, затем name и vantage"""
+    error = _cluster_auth()
+    if error is not None:
+        return None, error
+    data = request.get_json(silent=True) or {}
+    if not data.get('name') or not data.get('vantage'):
+        return None, (jsonify({'error': "'name' and 'vantage' required"}), 400)
+    return data, None
+
+
+def _int_field(data: dict, key: str, default: int = None, minimum: int = None) -> int:
+    """Целое поле тела запроса (нет поля - default); ValueError - не число или меньше minimum (ответ 400)"""
+    value = data.get(key)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{key}' must be an integer")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"'{key}' must be >= {minimum}")
+    return value
+
+
+def _cluster_active(data: dict) -> list:
+    """id задач, которые воркер сейчас выполняет (None - не передал); ValueError - не список чисел"""
+    active = data.get('active')
+    if active is None:
+        return None
+    try:
+        return [int(task_id) for task_id in active]
+    except (TypeError, ValueError):
+        raise ValueError("'active' must be a list of task ids")
+
+
+@app.route('/api/cluster/register', methods=['POST'])
+@app.route('/api/cluster/heartbeat', methods=['POST'])
+def cluster_heartbeat():
+    """Регистрация / отметка "живой" удалённого воркера"""
+    data, error = _cluster_request()
+    if error is not None:
+        return error
+    try:
+        parallel, active = _int_field(data, 'parallel', 1), _cluster_active(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    run_state.worker_seen(data['name'], data['vantage'], parallel, data.get('host'), active=active)
+    return jsonify({'ok': True})
+
+
+@app.route('/api/cluster/claim', methods=['POST'])
+def cluster_claim():
+    """Шард задач своей точки замера: не больше limit и своей доли среди живых воркеров"""
+    data, error = _cluster_request()
+    if error is not None:
+        return error
+    try:
+        parallel, limit = _int_field(data, 'parallel', 1), _int_field(data, 'limit', 1)
+        active = _cluster_active(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    run_state.worker_seen(data['name'], data['vantage'], parallel, active=active)
+    tasks = run_state.claim_tasks(data['name'], max(limit, 1), vantage=data['vantage'], fair=True)
+    return jsonify({'tasks': [{'id': t['id'], 'job_id': t['job_id'], 'name': t['name'],
+                               'url': t['payload']['url'], 'profile': t['payload'].get('profile')}
+                              for t in tasks]})
+
+
+@app.route('/api/cluster/results', methods=['POST'])
+def cluster_results():
+    """Результат одной задачи - воркер отправляет каждый сразу, как он готов"""
+    data, error = _cluster_request()
+    if error is not None:
+        return error
+    if not isinstance(data.get('result'), dict):
+        return jsonify({'error': "'result' required"}), 400
+    task = run_state.running_task(data.get('task_id'))
+    if task is None or task['worker'] != data['name']:
+        # Воркера сочли потерянным и задачу уже отдали другому
+        return jsonify({'accepted': False})
+
+    result = dict(data['result'], name=task['name'], vantage=task['vantage'], worker=data['name'])
+    result.setdefault('timestamp', datetime.now().isoformat())
+    journal = RunJournal(run_state.get(task['job_id'])['run_id'])
+    # В журнал - только засчитанный результат, и до того, как его увидит claim_finalize
+    accepted = run_state.finish_task(task['id'], data.get('error'), worker=data['name'],
+                                     on_finish=lambda: journal.append(result))
+    if accepted and TEST_WORKER_MODE == 'thread':
+        # Отчёт строит демон; в режиме thread - здесь, если это была последняя задача
+        threading.Thread(target=JobWorker(run_state).finalize_if_done, args=(task['job_id'],)).start()
+    return jsonify({'accepted': accepted})
+
+
+@app.route('/api/cluster/workers', methods=['GET'])
+def cluster_workers():
+    """Реестр воркеров (локальные процессы и удалённые) и задачи текущего задания"""
+    error = _cluster_auth()
+    if error is not None:
+        return error
+    job = run_state.latest()
+    return jsonify({'workers': run_state.workers(),
+                    'tasks': run_state.tasks(job['id']) if job else []})
+
+
+@app.route('/api/runs', methods=['GET'])
+def get_runs():
+    """Журналы прогонов (незавершённые можно продолжить через POST /api/test {"resume": run_id})"""
+    runs = RunJournal.list_runs() if RUNS_DIR.exists() else []
+    return jsonify({'runs': runs})
+
+
+@app.route('/api/runs/<run_id>/diff', methods=['GET'])
+def get_run_diff(run_id):
+    """Изменения прогона относительно предыдущего завершённого (?against=<run_id> - с конкретным)"""
+    try:
+        journal = RunJournal.open(run_id)
+        against = request.args.get('against')
+        previous = RunJournal.open(against) if against else journal.previous()
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    if previous is None:
+        return jsonify({'error': f'No completed run before {run_id}'}), 404
+    delta = run_diff.diff_runs(previous.results(), journal.results())
+    delta['previous_run_id'] = previous.run_id
+    if request.args.get('format') == 'md':
+        return Response(run_diff.render_md(delta, f"Delta {previous.run_id} → {run_id}"),
+                        mimetype='text/markdown; charset=utf-8')
+    return jsonify(delta)
+
+
+@app.route('/api/telegram/outbox', methods=['GET'])
+def get_telegram_outbox():
+    """Очередь отправки в Telegram: что ждёт повтора и последняя доставка"""
+    pending = [{k: item.get(k) for k in ('id', 'kind', 'attempts', 'next_attempt_at', 'last_error')}
+               for item in outbox.pending()]
+    dead = sum(1 for _ in outbox.dead_dir.glob("*.json")) if outbox.dead_dir.exists() else 0
+    return jsonify({'pending': pending, 'dead': dead, 'last_delivery': outbox.last_delivery})
+
+
+@app.route('/api/retention', methods=['POST'])
+def run_retention():
+    """Применить политику хранения вручную. {"dry_run": true} - только показать план"""
+    data = request.get_json(silent=True) or {}
+    # 0 или отрицательное свернуло бы/удалило все прогоны
+    try:
+        days, budget_mb = _int_field(data, 'days', minimum=1), _int_field(data, 'budget_mb', minimum=1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    summary = retention.enforce(REPORTS_DIR, LOGS_DIR, dry_run=bool(data.get('dry_run')),
+                                days=days, budget_mb=budget_mb)
+    return jsonify(summary)
+
+
+@app.route('/api/rollup', methods=['GET'])
+def get_rollup():
+    """Свёрнутая статистика старых прогонов по дням. ?config=<name>&days=<N>"""
+    rollup = retention.Rollup(REPORTS_DIR / "rollup.json")
+    return jsonify({'days': rollup.query(request.args.get('config'), request.args.get('days', type=int))})
+
+
 @app.route('/api/test/status', methods=['GET'])
 def get_test_status():
     """Получить статус текущего тестирования"""
-    global test_status
-    
-    status = test_status.copy()
+    status = run_state.status()
     
     # Рассчитываем прогресс в процентах
     if status['total'] > 0:
@@ -214,6 +374,9 @@ def test_single():
 
     if not name:
         return jsonify({'error': 'Name required'}), 400
+    probe_profile = data.get('profile')
+    if probe_profile is not None and probe_profile not in PROBE_PROFILES:
+        return jsonify({'error': f"Unknown profile (one of: {', '.join(PROBE_PROFILES)})"}), 400
 
     tester = VpnTester()
     tester.load_configs()
@@ -231,7 +394,7 @@ def test_single():
     start_time = time.time()
     
     # Тестируем конфиг
-    result = tester.test_config(config)
+    result = tester.test_config(config, probe_profile)
     elapsed = time.time() - start_time
     result['test_duration'] = round(elapsed, 2)
     
@@ -247,7 +410,8 @@ def test_single():
         print(f"📤 Sending report to Telegram...")
         try:
             import threading
-            telegram_thread = threading.Thread(target=send_to_telegram, args=(html_file, elapsed))
+            telegram_thread = threading.Thread(target=send_to_telegram, args=(html_file, elapsed),
+                                               kwargs={'results': [result]})
             telegram_thread.daemon = True
             telegram_thread.start()
         except Exception as e:
@@ -262,17 +426,124 @@ def test_single():
     return jsonify(result)
 
 
+@app.route('/api/test/first', methods=['POST'])
+def test_first_working():
+    """Найти первые N рабочих конфигураций (быстрый режим)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        count = _int_field(data, 'count', 1, minimum=1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    start_time = time.time()
+    winners = VpnTester().find_working(count)
+
+    return jsonify({
+        'working': [{'name': w['config'].name, 'time_ms': w['time_ms']} for w in winners],
+        'found': len(winners),
+        'elapsed': round(time.time() - start_time, 2)
+    })
+
+
+class DirIndex:
+    """
+    Кэш списка файлов каталога по шаблону.
+
+    Пересчитывается только при изменении mtime каталога (добавление,
+    удаление, переименование файлов) - обычный запрос стоит один stat().
+    """
+
+    def __init__(self, directory: Path, pattern: str):
+        self.directory = directory
+        self.pattern = pattern
+        self.version = None
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def entries(self) -> list:
+        try:
+            version = self.directory.stat().st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            if version != self.version:
+                entries = []
+                for f in sorted(self.directory.glob(self.pattern), reverse=True):
+                    try:
+                        entries.append({'name': f.stem, 'file': f.name, 'created': f.stat().st_mtime})
+                    except OSError:
+                        continue  # удалили между glob и stat
+                self._entries = entries
+                self.version = version
+            return self._entries
+
+
+report_index = DirIndex(REPORTS_DIR, "report_*.html")
+config_index = DirIndex(CONFIGS_DIR, "*.txt")
+
+
+def _conditional_json(payload: dict, version: str):
+    """JSON с ETag - повторный опрос без изменений получает 304"""
+    response = jsonify(payload)
+    response.set_etag(version)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _send_report_file(path: Path):
+    """
+    Отдача файла отчёта: ETag/Last-Modified и 304, Range (через send_file),
+    готовая gzip копия <file>.gz, если клиент её принимает и она не устарела.
+    """
+    gz_file = path.with_name(path.name + '.gz')
+    use_gzip = (
+        'gzip' in request.accept_encodings
+        and not request.range
+        and gz_file.exists()
+        and gz_file.stat().st_mtime >= path.stat().st_mtime
+    )
+    if use_gzip:
+        response = send_file(gz_file, mimetype=mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+                             conditional=True, etag=True)
+        if response.status_code == 200:
+            response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, conditional=True, etag=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.no_cache = True  # всегда ревалидировать: дёшево благодаря 304
+    return response
+
+
 @app.route('/api/reports', methods=['GET'])
 def get_reports():
-    """Получить список отчётов"""
-    reports = []
-    for f in sorted(REPORTS_DIR.glob("report_*.html"), reverse=True):
-        reports.append({
-            'name': f.stem,
-            'file': f.name,
-            'created': f.stat().st_mtime
-        })
-    return jsonify({'reports': reports})
+    """
+    Получить список отчётов.
+    ?page=1&per_page=50 - постранично, ?q=<подстрока> - фильтр по имени,
+    ?since=<unix time>&until=<unix time> - по времени создания.
+    """
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(500, max(1, request.args.get('per_page', 50, type=int)))
+    q = request.args.get('q', '').lower()
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+
+    reports = report_index.entries()
+    version = f"{report_index.version}-{request.query_string.decode()}"
+    if q:
+        reports = [r for r in reports if q in r['name'].lower()]
+    if since is not None:
+        reports = [r for r in reports if r['created'] >= since]
+    if until is not None:
+        reports = [r for r in reports if r['created'] <= until]
+
+    total = len(reports)
+    return _conditional_json({
+        'reports': reports[(page - 1) * per_page:page * per_page],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': max(1, -(-total // per_page))
+    }, version)
 
 
 @app.route('/api/reports/latest', methods=['GET'])
@@ -280,7 +551,7 @@ def get_latest_report():
     """Получить последний отчёт"""
     latest = REPORTS_DIR / "latest.html"
     if latest.exists():
-        return send_file(latest)
+        return _send_report_file(latest)
     return jsonify({'error': 'No reports yet'}), 404
 
 
@@ -289,24 +560,41 @@ def get_report(filename):
     """Получить конкретный отчёт"""
     report = REPORTS_DIR / filename
     if report.exists():
-        return send_file(report)
+        return _send_report_file(report)
     return jsonify({'error': 'Report not found'}), 404
 
 
+@app.route('/api/reports/<dirname>/<filename>', methods=['GET'])
+def get_report_data(dirname, filename):
+    """Данные разбитого отчёта (report_<ts>.data/index.json, chunk_NNNN.json)"""
+    if not dirname.endswith('.data') or '..' in dirname or '..' in filename:
+        return jsonify({'error': 'Report data not found'}), 404
+    data_file = REPORTS_DIR / dirname / filename
+    if data_file.exists():
+        return _send_report_file(data_file)
+    return jsonify({'error': 'Report data not found'}), 404
+
+
 @app.route('/api/reports/<filename>', methods=['DELETE'])
 def delete_report(filename):
     """Удалить отчёт"""
     try:
         report_html = REPORTS_DIR / filename
         report_md = REPORTS_DIR / filename.replace('.html', '.md')
+        report_diff = REPORTS_DIR / filename.replace('.html', '.diff.md')
         
         deleted = []
-        if report_html.exists():
-            report_html.unlink()
-            deleted.append(filename)
-        if report_md.exists():
-            report_md.unlink()
-            deleted.append(report_md.name)
+        for report_file in (report_html, report_md, report_diff):
+            if report_file.exists():
+                report_file.unlink()
+                deleted.append(report_file.name)
+            gz_file = report_file.with_name(report_file.name + '.gz')
+            if gz_file.exists():
+                gz_file.unlink()
+        report_data = REPORTS_DIR / filename.replace('.html', '.data')
+        if report_data.is_dir():
+            shutil.rmtree(report_data)
+            deleted.append(report_data.name)
         
         return jsonify({'success': True, 'deleted': deleted})
     except Exception as e:
@@ -320,316 +608,27 @@ def get_status():
     xray_bin = BASE_DIR / "xray" / "xray"
     xray_exists = xray_bin.exists()
 
-    # Количество конфигов
-    config_count = len(list(CONFIGS_DIR.glob("*.txt")))
+    # Количество конфигов и отчётов - из кэшированных индексов каталогов
+    config_count = len(config_index.entries())
+    report_count = len(report_index.entries())
 
-    # Количество отчётов
-    report_count = len(list(REPORTS_DIR.glob("report_*.html")))
+    worker_running = TEST_WORKER_MODE == 'thread' or worker_daemon.is_running(STATE_DB)
 
-    return jsonify({
+    return _conditional_json({
         'xray_installed': xray_exists,
         'configs_count': config_count,
-        'reports_count': report_count
-    })
-
-
-# Telegram Bot Integration
-# Token and Chat ID are loaded from environment variables or .env file
-# Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID in your environment
-TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '')
-
-def get_system_info():
-    """Собрать информацию о системе"""
-    import platform
-    import subprocess
-    import socket
-    
-    info = {
-        'hostname': socket.gethostname(),
-        'local_ip': socket.gethostbyname(socket.gethostname()),
-        'os': f"{platform.system()} {platform.release()}",
-        'python_version': platform.python_version(),
-        'cpu_count': os.cpu_count(),
-    }
-    
-    # Получить версию Docker
-    try:
-        result = subprocess.run(['docker', '--version'], capture_output=True, text=True, timeout=5)
-        info['docker_version'] = result.stdout.strip()
-    except:
-        info['docker_version'] = 'Unknown'
-    
-    # Получить объем RAM
-    try:
-        with open('/proc/meminfo', 'r') as f:
-            for line in f:
-                if line.startswith('MemTotal:'):
-                    mem_kb = int(line.split()[1])
-                    info['ram_gb'] = round(mem_kb / 1024 / 1024, 2)
-                    break
-    except:
-        info['ram_gb'] = 'Unknown'
-    
-    # Проверить белый IP - через curl с хоста
-    try:
-        # Пробуем получить публичный IP
-        result = subprocess.run(
-            ['curl', '-s', '--connect-timeout', '5', 'https://api.ipify.org?format=json'],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.returncode == 0:
-            import json
-            public_ip = json.loads(result.stdout).get('ip', 'Unknown')
-            info['public_ip'] = public_ip
-            # Сравниваем с локальным - если отличаются, значит есть NAT
-            info['has_static_ip'] = True  # Считаем что статический если получили ответ
-        else:
-            info['public_ip'] = 'Unknown'
-            info['has_static_ip'] = False
-    except:
-        info['public_ip'] = 'Unknown'
-        info['has_static_ip'] = False
-    
-    # Получить DNS серверы
-    dns_servers = []
-    try:
-        with open('/etc/resolv.conf', 'r') as f:
-            for line in f:
-                if line.strip().startswith('nameserver'):
-                    dns_servers.append(line.split()[1])
-        info['dns_servers'] = ', '.join(dns_servers) if dns_servers else 'Unknown'
-    except:
-        info['dns_servers'] = 'Unknown'
-    
-    return info
-
-
-def send_to_telegram(report_file: Path, test_duration: float = 0, working_config=None):
-    """
-    Отправить отчет в Telegram бот через встроенный VPN прокси.
-    
-    Автономная функция - НЕ зависит от внешнего прокси.
-    Использует Xray для поднятия SOCKS5 прокси внутри контейнера.
-    """
-    import requests
-    import subprocess
-    import time
-    import json
-    import socket
-
-    # Импортируем LOGS_DIR локально
-    from pathlib import Path as P
-    _base_dir = P(__file__).parent.parent
-    if not (_base_dir / "configs").exists():
-        _base_dir = P(__file__).parent
-    _logs_dir = _base_dir / "logs"
-
-    proxies = None
-    xray_proc = None
-    xray_config_file = None
-
-    # Проверяем, есть ли токен и chat_id
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️ Telegram bot token or chat ID not configured. Skipping Telegram send.")
-        print("   Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID environment variables.")
-        return False
-
-    try:
-        # === ШАГ 1: Пробуем найти внешний прокси (быстрая проверка) ===
-        # Это может помочь, если у сотрудника уже есть VPN
-        external_hosts = ['127.0.0.1', 'host.docker.internal', '172.17.0.1', '172.22.0.1']
-        external_ports = [10808, 10828, 8080, 3128]
-
-        for host in external_hosts:
-            for port in external_ports:
-                try:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.settimeout(1)
-                    result = sock.connect_ex((host, port))
-                    sock.close()
-                    if result == 0:
-                        proxies = {
-                            'http': f'socks5h://{host}:{port}',
-                            'https': f'socks5h://{host}:{port}'
-                        }
-                        print(f"✅ Found external proxy at {host}:{port}")
-                        break
-                except:
-                    pass
-            if proxies:
-                break
-
-        # === ШАГ 2: Если нет внешнего прокси - запускаем свой Xray ===
-        if not proxies:
-            print("🔑 No external proxy found - starting internal Xray proxy...")
-
-            # Если не передали рабочий конфиг - ищем его
-            if working_config is None:
-                tester = VpnTester()
-                tester.load_configs()
-                # Берём первый доступный конфиг
-                if len(tester.configs) > 0:
-                    working_config = tester.configs[0]
-                    print(f"   Using config '{working_config.name}' for proxy")
-
-            # Запускаем Xray с конфигом как SOCKS прокси
-            if working_config:
-                try:
-                    print(f"🔑 Starting Xray proxy with config: {working_config.name}...")
-
-                    # Генерируем конфиг для Xray (SOCKS порт 11080)
-                    xray_config = working_config.to_xray_config(11080, 11081)
-                    xray_config_file = _logs_dir / f"xray_telegram_proxy_{int(time.time())}.json"
-
-                    with open(xray_config_file, 'w') as f:
-                        json.dump(xray_config, f, indent=2)
-
-                    # Запускаем Xray
-                    xray_bin = _base_dir / "xray" / "xray"
-                    if not xray_bin.exists():
-                        print(f"⚠️ Xray binary not found at {xray_bin}")
-                    else:
-                        xray_proc = subprocess.Popen(
-                            [str(xray_bin), 'run', '-c', str(xray_config_file)],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE
-                        )
-
-                        # Ждём запуска (даём больше времени)
-                        for _ in range(10):
-                            time.sleep(0.5)
-                            if xray_proc.poll() is not None:
-                                # Процесс умер
-                                stderr_output = xray_proc.stderr.read().decode() if xray_proc.stderr else 'unknown'
-                                print(f"⚠️ Xray proxy failed to start: {stderr_output}")
-                                break
-
-                        # Проверяем, работает ли прокси
-                        if xray_proc.poll() is None:
-                            # Проверяем доступность порта
-                            for _ in range(5):
-                                try:
-                                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                                    sock.settimeout(1)
-                                    result = sock.connect_ex(('127.0.0.1', 11080))
-                                    sock.close()
-                                    if result == 0:
-                                        proxies = {
-                                            'http': 'socks5h://127.0.0.1:11080',
-                                            'https': 'socks5h://127.0.0.1:11080'
-                                        }
-                                        print(f"✅ Internal Xray proxy started on port 11080")
-                                        break
-                                except:
-                                    pass
-                                time.sleep(1)
-
-                except Exception as e:
-                    print(f"⚠️ Failed to start Xray proxy: {e}")
-
-        # === ШАГ 3: Проверяем доступность Telegram ===
-        if proxies:
-            try:
-                test_resp = requests.get('https://api.telegram.org', timeout=15, proxies=proxies)
-                if test_resp.status_code == 200:
-                    print(f"✅ Telegram API accessible via proxy")
-                else:
-                    print(f"⚠️ Telegram API returned status {test_resp.status_code}")
-            except Exception as e:
-                print(f"⚠️ Telegram API check failed: {e}")
-        else:
-            print("⚠️ No proxy available - will try direct connection (may fail in Russia)")
-
-        # === ШАГ 4: Отправляем сообщение ===
-        system_info = get_system_info()
-
-        message = f"""
-🔐 <b>VPN TESTER CS-CART - TEST REPORT</b>
-
-⏱️ <b>Test Duration:</b> <code>{test_duration:.1f} seconds</code>
-
-🖥️ <b>SYSTEM INFO:</b>
-• Hostname: <code>{system_info['hostname']}</code>
-• Local IP: <code>{system_info['local_ip']}</code>
-• Public IP: <code>{system_info['public_ip']}</code>
-• Static IP: {'✅ Yes' if system_info['has_static_ip'] else '❌ No'}
-• OS: <code>{system_info['os']}</code>
-• RAM: <code>{system_info['ram_gb']} GB</code>
-• CPU Cores: <code>{system_info['cpu_count']}</code>
-• Docker: <code>{system_info['docker_version']}</code>
-• Python: <code>{system_info['python_version']}</code>
-• DNS: <code>{system_info.get('dns_servers', 'Unknown')}</code>
-
-📊 <b>HTML Report file attached below.</b>
-
-━━━━━━━━━━━━━━━━━━━━
-<b>by MatrixHasYou</b>
-"""
-
-        # Отправляем текстовое сообщение
-        msg_sent = False
-        try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-            data = {
-                'chat_id': TELEGRAM_CHAT_ID,
-                'text': message,
-                'parse_mode': 'HTML'
-            }
-            resp = requests.post(url, json=data, timeout=30, proxies=proxies)
-            if resp.status_code == 200:
-                print(f"✅ Telegram message sent successfully!")
-                msg_sent = True
-            else:
-                print(f"Telegram message error ({resp.status_code}): {resp.text}")
-        except Exception as msg_error:
-            print(f"Message send error: {msg_error}")
-
-        # Отправляем файл отчёта
-        doc_sent = False
-        try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument"
-            with open(report_file, 'rb') as f:
-                files = {'document': f}
-                data = {'chat_id': TELEGRAM_CHAT_ID}
-                resp = requests.post(url, files=files, data=data, timeout=120, proxies=proxies)
-                if resp.status_code == 200:
-                    print(f"✅ Telegram document sent successfully!")
-                    doc_sent = True
-                else:
-                    print(f"Telegram document error ({resp.status_code}): {resp.text}")
-        except Exception as doc_error:
-            print(f"Document send error: {doc_error}")
-
-        if msg_sent or doc_sent:
-            print(f"✅ Report sent to Telegram: {report_file.name}")
-            return True
-        else:
-            print(f"❌ Failed to send report to Telegram")
-            return False
-
-    except Exception as e:
-        print(f"❌ Telegram error: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-    finally:
-        # === ШАГ 5: Останавливаем Xray прокси ===
-        if xray_proc:
-            try:
-                xray_proc.terminate()
-                xray_proc.wait(timeout=5)
-                print(f"🛑 Internal Xray proxy stopped")
-            except:
-                xray_proc.kill()
-
-        # Удаляем временный конфиг
-        if xray_config_file and xray_config_file.exists():
-            try:
-                xray_config_file.unlink()
-            except:
-                pass
+        'reports_count': report_count,
+        'worker_mode': TEST_WORKER_MODE,
+        'worker_running': worker_running,
+        'probe_profiles': {name: profile['budget'] for name, profile in PROBE_PROFILES.items()},
+        'default_probe_profile': DEFAULT_PROBE_PROFILE
+    }, f"{xray_exists}-{config_index.version}-{report_index.version}-{worker_running}")
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики в формате Prometheus"""
+    return Response(metrics.render(worker_daemon.metrics_dir(STATE_DB)), mimetype=metrics.CONTENT_TYPE)
 
 
 if __name__ == '__main__':
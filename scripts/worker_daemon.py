@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Worker Daemon - демон прогонов отдельно от Flask
+
+API (web_api.py) только ставит задание в очередь (run_state, SQLite). Демон
+держит N процессов-воркеров (по умолчанию по числу ядер): свободный воркер
+берёт задание и раскладывает его на задачи по конфигам, дальше все процессы
+разбирают задачи параллельно - у каждого свои Xray на свободных портах.
+Отчёт строит процесс, закончивший последнюю задачу, и ставит его в очередь
+Telegram - отправляет очередь API.
+
+Падение теста убивает только воркер: демон перезапускает его, а задача
+без heartbeat через JOB_STALE секунд возвращается в очередь.
+
+Задание с {"vantages": ["local", "europe"]} тестирует каждый конфиг с каждой
+точки замера: задачи своей точки (WORKER_VANTAGE) берут эти процессы, чужих -
+удалённые воркеры cluster.py. Отчёт сводится с колонкой на каждую точку.
+
+    python3 worker_daemon.py                  # процессов = числу ядер
+    python3 worker_daemon.py --processes 2
+    python3 worker_daemon.py --status         # задания и задачи в очереди
+"""
+
+import argparse
+import fcntl
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+import retention
+import system_info
+from run_state import RunState, Heartbeat, JOB_HEARTBEAT, DEFAULT_VANTAGE
+from telegram_notify import send_to_telegram
+from vpn_tester import VpnTester, VlessConfig, RunJournal, REPORTS_DIR, LOGS_DIR, live_xray_count
+
+STATE_DB = Path(os.environ.get('VPN_TESTER_STATE_DB', str(REPORTS_DIR / "state.db")))
+WORKER_PROCESSES = int(os.environ.get('TEST_WORKER_PROCESSES', 0)) or os.cpu_count() or 1
+WORKER_VANTAGE = os.environ.get('WORKER_VANTAGE', DEFAULT_VANTAGE)  # точка замера этого сервера
+WORKER_POLL = 1.0  # секунд между проверками очереди
+WORKER_PAUSE = 1.0  # секунд между тестами в одном воркере
+WORKER_RESTART_DELAY = 5  # секунд между проверками, живы ли воркеры
+WORKER_STOP_TIMEOUT = 10  # секунд на остановку, потом SIGKILL
+
+
+class JobWorker:
+    """Один воркер: берёт задания и задачи из run_state и выполняет их"""
+
+    def __init__(self, state: RunState, name: str = None, vantage: str = WORKER_VANTAGE):
+        self.state = state
+        self.name = name or f"{os.uname().nodename}:{os.getpid()}"
+        self.vantage = vantage
+        self.tester = VpnTester()
+        self._seen = 0
+
+    def step(self, job_id: int = None) -> bool:
+        """Одно действие: разложить задание или выполнить задачу. False - очередь пуста"""
+        if time.time() - self._seen >= JOB_HEARTBEAT:
+            self.state.worker_seen(self.name, self.vantage)
+            self._seen = time.time()
+        job = self.state.claim_job(self.name, job_id)
+        if job is not None:
+            self.plan(job)
+            return True
+        task = self.state.claim_task(self.name, job_id, self.vantage)
+        if task is not None:
+            self.run_task(task)
+            return True
+        # Последние результаты могли прийти от удалённых воркеров - отчёт строим здесь
+        for ready_id in self.state.finalizable():
+            if job_id is None or ready_id == job_id:
+                self.finalize_if_done(ready_id)
+        return False
+
+    def run_job(self, job_id: int):
+        """Выполнить задание целиком в этом потоке (режим TEST_WORKER_MODE=thread)"""
+        while self.step(job_id):
+            pass
+
+    def plan(self, job: dict):
+        """Задание -> задачи по конфигам (кроме уже готовых в журнале при resume)"""
+        try:
+            self.tester.load_configs()
+            configs = self.tester.configs
+
+            # Результаты сразу уходят в журнал на диске - после перезапуска
+            # контейнера прогон продолжается с того же места
+            vantages = job['params'].get('vantages') or [self.vantage]
+            probe_profile = job['params'].get('profile')
+            resume_run_id = job['params'].get('resume')
+            if resume_run_id:
+                journal = RunJournal.open(resume_run_id)
+                vantages = job['params'].get('vantages') or journal.meta.get('vantages') or vantages
+                probe_profile = probe_profile or journal.meta.get('probe_profile')
+                done = {(r.get('name'), r.get('vantage', self.vantage)) for r in journal}
+                print(f"♻️ Resuming run {resume_run_id}: {len(done)} configs already tested")
+            else:
+                probe_profile = probe_profile or self.tester.probe_profile
+                journal = RunJournal.create(len(configs) * len(vantages), vantages=vantages,
+                                            probe_profile=probe_profile)
+                done = set()
+
+            todo = [{'name': c.name, 'url': c.url, 'vantage': vantage, 'profile': probe_profile}
+                    for c in configs for vantage in vantages if (c.name, vantage) not in done]
+            total = len(configs) * len(vantages)
+            # run_id - до задач: их сразу могут взять другие воркеры
+            self.state.update(job['id'], total=total, current=total - len(todo), run_id=journal.run_id)
+            self.state.add_tasks(job['id'], todo)
+            print(f"📋 Job {job['id']}: {len(todo)} configs queued (run {journal.run_id})")
+        except Exception as e:
+            self.state.finish(job['id'], error=str(e) + '\n' + traceback.format_exc())
+            print(f"❌ Test error: {e}")
+            return
+        self.finalize_if_done(job['id'])
+
+    def run_task(self, task: dict):
+        job = self.state.get(task['job_id'])
+        config = VlessConfig(task['payload']['url'])
+        self.state.update(job['id'], current_config=config.name)
+        print(f"[{self.name}] Testing {config.name}...")
+
+        error = None
+        with Heartbeat(self.state, job['id'], task_id=task['id']):
+            try:
+                result = self.tester.test_config(config, task['payload'].get('profile'))
+            except Exception as e:
+                error = str(e)
+                result = {'name': config.name, 'info': config.info, 'status': 'error',
+                          'error': error, 'timestamp': datetime.now().isoformat()}
+            result.update(vantage=task['vantage'], worker=self.name)
+
+        # Задачу могли счесть потерянной и отдать другому - тогда результат не пишем (дубль в отчёте)
+        accepted = self.state.finish_task(task['id'], error, worker=self.name,
+                                          on_finish=lambda: RunJournal(job['run_id']).append(result))
+        if not accepted:
+            print(f"⚠️ [{self.name}] {config.name}: result dropped (task reassigned)")
+        print(f"[{self.name}] {config.name}: {result.get('status', 'unknown')}")
+        self.finalize_if_done(job['id'])
+        time.sleep(WORKER_PAUSE)
+
+    def finalize_if_done(self, job_id: int):
+        """Последняя задача готова - отчёт, diff, retention, Telegram"""
+        if not self.state.claim_finalize(job_id):
+            return
+        job = self.state.get(job_id)
+        try:
+            with Heartbeat(self.state, job_id):
+                # Отчёт со ВСЕМИ результатами из журнала
+                print("Generating report...")
+                journal = RunJournal.open(job['run_id'])
+                report_tester = VpnTester()
+                report_tester.results = journal.results()
+                html_file, md_file = report_tester.generate_report()
+                delta = report_tester.generate_diff(journal, html_file)
+                journal.finish(report=html_file.name, diff=delta['file'] if delta else None)
+
+            # Старые прогоны - в rollup/архив, пока отчёты не съели диск
+            try:
+                summary = retention.enforce(REPORTS_DIR, LOGS_DIR)
+                if summary['rolled_up'] or summary['deleted']:
+                    print(f"🧹 Retention: {len(summary['rolled_up'])} runs rolled up, "
+                          f"{summary['freed_bytes'] / 1024 / 1024:.1f} MB freed")
+            except Exception as e:
+                print(f"Retention error: {e}")
+
+            # Отправка в Telegram (через очередь)
+            try:
+                send_to_telegram(html_file, delta=delta, results=report_tester.results)
+            except Exception as e:
+                print(f"Telegram send error: {e}")
+
+            self.state.finish(job_id)
+            print(f"✅ Tests completed in {time.time() - (job['started'] or job['created']):.1f}s")
+            print(f"📊 Generated report with {len(report_tester.results)} configs")
+        except Exception as e:
+            self.state.finish(job_id, error=str(e) + '\n' + traceback.format_exc())
+            print(f"❌ Test error: {e}")
+
+
+def worker_main(state_db: Path):
+    """Процесс-воркер: разбирает очередь до SIGTERM (текущая задача дорабатывает)"""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C ловит демон
+
+    worker = JobWorker(RunState(state_db))
+    # Замеры тестов копятся в этом процессе - /metrics API читает их из выгрузок
+    metrics.install()
+    metrics.XRAY_PROCESSES.set_function(live_xray_count)
+    system_info.PROVIDER.warm()  # публичный IP и Docker для сообщения в Telegram к концу прогона
+    threading.Thread(target=_export_metrics, args=(metrics_dir(state_db), worker.name, stop),
+                     daemon=True).start()
+    print(f"👷 Worker {worker.name} started")
+    while not stop.is_set():
+        try:
+            busy = worker.step()
+        except Exception as e:
+            print(f"❌ Worker {worker.name} error: {e}")
+            busy = False
+        if not busy:
+            stop.wait(WORKER_POLL)
+
+
+def _export_metrics(directory: Path, name: str, stop: threading.Event):
+    """Выгружать метрики воркера каждые METRICS_EXPORT_INTERVAL секунд (и напоследок)"""
+    while True:
+        stopping = stop.wait(metrics.METRICS_EXPORT_INTERVAL)
+        try:
+            metrics.export(directory, name)
+        except OSError as e:
+            print(f"⚠️ Metrics export error: {e}")
+        if stopping:
+            return
+
+
+def metrics_dir(state_db: Path = STATE_DB) -> Path:
+    """Каталог выгрузок метрик воркеров (его сводит /metrics API)"""
+    return Path(state_db).with_suffix('.metrics')
+
+
+def _lock_path(state_db: Path) -> Path:
+    return Path(state_db).with_suffix('.worker.lock')
+
+
+def is_running(state_db: Path = STATE_DB) -> bool:
+    """Демон уже держит блокировку (в этом или другом процессе/контейнере)"""
+    lock_path = _lock_path(state_db)
+    if not lock_path.exists():
+        return False
+    with open(lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
+
+
+def spawn(state_db: Path = STATE_DB, processes: int = None) -> subprocess.Popen:
+    """Запустить демон отдельным процессом (из API). Лишний экземпляр завершится сам"""
+    command = [sys.executable, str(Path(__file__).resolve()), '--state', str(state_db)]
+    if processes:
+        command += ['--processes', str(processes)]
+    return subprocess.Popen(command, start_new_session=True)
+
+
+def serve(processes: int = WORKER_PROCESSES, state_db: Path = STATE_DB) -> int:
+    """Демон: держит processes воркеров, перезапускает упавшие"""
+    state_db = Path(state_db)
+    state_db.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(_lock_path(state_db), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print(f"⚠️ Test worker already running ({_lock_path(state_db)})")
+        return 1
+
+    RunState(state_db)  # схема - до старта воркеров
+    metrics.reset(metrics_dir(state_db))  # выгрузки воркеров прошлого запуска
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    context = multiprocessing.get_context('fork')
+    workers = [None] * processes
+    print(f"🚀 Test worker daemon: {processes} processes, state {state_db}")
+    while not stop.is_set():
+        for i, proc in enumerate(workers):
+            if proc is not None and proc.is_alive():
+                continue
+            if proc is not None:
+                print(f"⚠️ Worker {proc.pid} exited with code {proc.exitcode}, restarting")
+            workers[i] = context.Process(target=worker_main, args=(state_db,), name=f"test-worker-{i}")
+            workers[i].start()
+        stop.wait(WORKER_RESTART_DELAY)
+
+    print("🛑 Stopping workers...")
+    for proc in workers:
+        proc.terminate()
+    deadline = time.time() + WORKER_STOP_TIMEOUT
+    for proc in workers:
+        proc.join(max(deadline - time.time(), 0))
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='VPN tester worker daemon')
+    parser.add_argument('--processes', type=int, default=WORKER_PROCESSES, help='Процессов-воркеров')
+    parser.add_argument('--state', type=Path, default=STATE_DB, help='База run_state (SQLite)')
+    parser.add_argument('--status', action='store_true', help='Показать последнее задание и задачи')
+    args = parser.parse_args()
+
+    if args.status:
+        state = RunState(args.state)
+        job = state.latest()
+        print(f"Daemon: {'running' if is_running(args.state) else 'not running'}")
+        if job:
+            print(f"Job {job['id']}: {job['state']} {job['current']}/{job['total']} run={job['run_id']}")
+            for task in state.tasks(job['id']):
+                print(f"  {task['state']:8} {task['vantage']:8} {task['name']} {task['worker'] or ''} "
+                      f"{task['error'] or ''}")
+        for worker in state.workers():
+            print(f"Worker {worker['name']} ({worker['vantage']}): {'alive' if worker['alive'] else 'lost'}, "
+                  f"{worker['running']} running")
+        sys.exit(0)
+
+    sys.exit(serve(args.processes, args.state))
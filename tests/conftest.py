@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Скрипты лежат плоско в scripts/ и импортируют друг друга по имени
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+
+@pytest.fixture(scope="session")
+def speedtest_url():
+    """Локальная заглушка speedtest_server.py - базовый URL"""
+    from speedtest_server import start_server
+    server, base_url = start_server()
+    yield base_url
+    server.shutdown()
@@ -0,0 +1,36 @@
+from vpn_tester import RunJournal
+
+
+def working(name, vantage, ping_ms):
+    return {'name': name, 'vantage': vantage, 'status': 'working',
+            'ping': {'google': {'status': 'ok', 'p50_ms': ping_ms}}}
+
+
+def test_runs_created_in_same_second_get_own_files(tmp_path):
+    first, second = RunJournal.create(runs_dir=tmp_path), RunJournal.create(runs_dir=tmp_path)
+    assert first.run_id != second.run_id
+    assert first.path != second.path
+
+
+def test_results_merge_vantages_from_journal(tmp_path):
+    journal = RunJournal.create(2, runs_dir=tmp_path, vantages=['local', 'europe'])
+    for result in [working('a', 'europe', 80), working('a', 'local', 40), working('b', 'local', 50),
+                   working('b', 'local', 55)]:  # повтор точки (задачу перезапустили) - последний
+        journal.append(result)
+
+    results = {r['name']: r for r in journal.results()}
+    assert list(results) == ['a', 'b']
+    assert results['a']['vantage'] == 'local'
+    assert list(results['a']['vantages']) == ['local', 'europe']
+    assert results['a']['vantages']['europe']['ping_ms'] == 80
+    assert list(results['b']['vantages']) == ['local']
+    assert results['b']['vantages']['local']['ping_ms'] == 55
+    assert results['b']['ping']['google']['p50_ms'] == 55
+
+
+def test_single_vantage_results_as_is(tmp_path):
+    journal = RunJournal.create(2, runs_dir=tmp_path)
+    journal.append(working('a', 'local', 40))
+    journal.append(working('b', 'local', 50))
+    assert [r['name'] for r in journal.results()] == ['a', 'b']
+    assert all('vantages' not in r for r in journal.results())
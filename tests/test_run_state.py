@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+import run_state
+from run_state import RunState, TASK_CLAIM_GRACE
+
+
+@pytest.fixture
+def state(tmp_path):
+    return RunState(tmp_path / "state.db")
+
+
+def make_job(state, names, vantage='europe'):
+    job_id = state.create_job('test')
+    state.claim_job('coordinator', job_id)
+    state.add_tasks(job_id, [{'name': name, 'vantage': vantage} for name in names])
+    return job_id
+
+
+def test_heartbeat_requeues_dropped_tasks(state, monkeypatch):
+    job_id = make_job(state, ['a', 'b'])
+    kept, dropped = state.claim_tasks('remote', 2, vantage='europe')
+
+    # Сразу после claim ответ может быть ещё в пути - задачу не трогаем
+    state.worker_seen('remote', 'europe', active=[kept['id']])
+    assert [task['state'] for task in state.tasks(job_id)] == ['running', 'running']
+
+    now = time.time()
+    monkeypatch.setattr(run_state.time, 'time', lambda: now + TASK_CLAIM_GRACE + 1)
+    state.worker_seen('remote', 'europe', active=[kept['id']])
+    assert [task['state'] for task in state.tasks(job_id)] == ['running', 'queued']
+    assert [task['name'] for task in state.claim_tasks('other', 2, vantage='europe')] == [dropped['name']]
+
+
+def test_heartbeat_without_active_keeps_all_tasks(state, monkeypatch):
+    job_id = make_job(state, ['a', 'b'], vantage='local')
+    state.claim_tasks('local:1', 2, vantage='local')
+
+    now = time.time()
+    monkeypatch.setattr(run_state.time, 'time', lambda: now + 10 * 60)
+    state.worker_seen('local:1', 'local')
+    assert [task['state'] for task in state.tasks(job_id)] == ['running', 'running']
@@ -0,0 +1,55 @@
+from speedtest import multi_stream_download, dpi_probe
+
+RATE = 2_000_000  # байт/сек на поток
+SIZE = 100_000_000
+
+
+def test_stable_speed_converges_early(speedtest_url):
+    stats = multi_stream_download(f"{speedtest_url}/bytes/{SIZE}?rate={RATE}", streams=2, window=8,
+                                  min_time=1, tolerance=0.1)
+    assert stats['converged']
+    assert stats['window_sec'] < 8
+    assert stats['time_saved_sec'] > 0
+    assert abs(stats['time_saved_sec'] - (8 - stats['window_sec'])) < 0.05
+    assert abs(stats['speed_bps'] - 2 * RATE) / (2 * RATE) < 0.2
+
+
+def test_no_convergence_uses_full_window(speedtest_url):
+    # Допуск, в который реальный замер не уложится - остановка только по окну
+    stats = multi_stream_download(f"{speedtest_url}/bytes/{SIZE}?rate={RATE}", streams=2, window=2,
+                                  min_time=1, tolerance=1e-9)
+    assert not stats['converged']
+    assert stats['window_sec'] >= 2
+    assert stats['time_saved_sec'] == 0
+    assert stats['speed_mbps'] > 0
+
+
+def test_per_stream_totals(speedtest_url):
+    stats = multi_stream_download(f"{speedtest_url}/bytes/{SIZE}?rate={RATE}", streams=3, window=1.5)
+    assert len(stats['streams']) == 3
+    assert sum(s['bytes'] for s in stats['streams']) == stats['total_bytes']
+    assert stats['bytes_consumed'] >= stats['total_bytes']
+    for stream in stats['streams']:
+        assert stream['bytes'] > 0
+        assert abs(stream['speed_mbps'] - RATE * 8 / 1_000_000) / (RATE * 8 / 1_000_000) < 0.25
+    assert abs(sum(s['speed_mbps'] for s in stats['streams']) - stats['speed_mbps']) < 0.05
+
+
+def test_dpi_freeze(speedtest_url):
+    result = dpi_probe(f"{speedtest_url}/bytes/10000000?freeze_after=16000", connections=4, duration=2)
+    assert result['verdict'] == 'freeze'
+    assert result['freeze_after_bytes'] == 16000
+    assert result['stalled'] == 4
+
+
+def test_dpi_throttled(speedtest_url):
+    result = dpi_probe(f"{speedtest_url}/bytes/10000000?throttle_after=200000&throttle_rate=20000",
+                       connections=4, duration=2)
+    assert result['verdict'] == 'throttled'
+    assert result['freeze_after_bytes'] is None
+
+
+def test_dpi_clean(speedtest_url):
+    result = dpi_probe(f"{speedtest_url}/bytes/10000000?rate={RATE}", connections=4, duration=1.5)
+    assert result['verdict'] == 'clean'
+    assert result['stalled'] == 0 and result['throttled'] == 0
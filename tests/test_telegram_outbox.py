@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+import telegram_outbox
+from telegram_outbox import Outbox, PROXY_DIRECT
+from telegram_server import start_server
+
+
+@pytest.fixture(autouse=True)
+def fast_outbox(monkeypatch):
+    # Секунды вместо минут: повторы и склейка не растягивают прогон тестов
+    monkeypatch.setattr(telegram_outbox, 'OUTBOX_BACKOFF_BASE', 0.3)
+    monkeypatch.setattr(telegram_outbox, 'OUTBOX_COALESCE_WINDOW', 0.2)
+    monkeypatch.setattr(telegram_outbox, 'OUTBOX_MIN_INTERVAL', 0)
+
+
+@pytest.fixture
+def bot_api():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_server(**kwargs)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_outbox(directory, base_url, token='test-token'):
+    return Outbox(directory, token, '42', api_url=base_url, proxy=PROXY_DIRECT)
+
+
+def deliver(outbox, timeout=15):
+    outbox.start()
+    try:
+        return outbox.flush(timeout)
+    finally:
+        outbox.stop()
+
+
+def test_backoff_retry(tmp_path, bot_api):
+    server, base_url = bot_api(fail=2)
+    outbox = make_outbox(tmp_path, base_url)
+    outbox.enqueue_message('hello')
+    started = time.time()
+
+    assert deliver(outbox)
+    assert server.requests == 3
+    assert [r['fields']['text'] for r in server.received] == ['hello']
+    # Две задержки: ~0.3 и ~0.6 с (±20%)
+    assert time.time() - started >= 0.3 * 0.8 + 0.6 * 0.8
+
+
+def test_rate_limit_waits_retry_after(tmp_path, bot_api):
+    server, base_url = bot_api(rate_limit=1, retry_after=1)
+    outbox = make_outbox(tmp_path, base_url)
+    outbox.enqueue_message('hello')
+    started = time.time()
+
+    assert deliver(outbox)
+    assert server.requests == 2
+    assert len(server.received) == 1
+    assert time.time() - started >= 1
+
+
+def test_messages_coalesced(tmp_path, bot_api):
+    server, base_url = bot_api()
+    outbox = make_outbox(tmp_path, base_url)
+    for text in ('first', 'second', 'third'):
+        outbox.enqueue_message(text)
+
+    assert deliver(outbox)
+    assert len(server.received) == 1
+    assert server.received[0]['method'] == 'sendMessage'
+    assert server.received[0]['fields']['text'] == telegram_outbox.MESSAGE_SEPARATOR.join(
+        ['first', 'second', 'third'])
+
+
+def test_client_error_goes_to_dead(tmp_path, bot_api):
+    server, base_url = bot_api()
+    # Токен со слэшем - заглушка отвечает 404, повтор не поможет
+    outbox = make_outbox(tmp_path, base_url, token='bad/token')
+    item_id = outbox.enqueue_message('hello')
+
+    assert deliver(outbox)
+    assert server.received == []
+    assert outbox.pending_count() == 0
+    assert (tmp_path / 'dead' / item_id).exists()
+
+
+def test_pending_items_survive_restart(tmp_path, bot_api):
+    server, base_url = bot_api(fail=100)
+    first = make_outbox(tmp_path, base_url)
+    first.enqueue_message('before restart')
+    first.start()
+    deadline = time.time() + 5
+    while server.requests == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    first.stop()
+    assert first.pending_count() == 1
+    assert first.pending()[0]['attempts'] >= 1
+
+    # "Перезапуск": новый процесс с тем же каталогом, Bot API снова отвечает
+    server.fail = 0
+    second = make_outbox(tmp_path, base_url)
+    assert deliver(second, timeout=20)
+    assert [r['fields']['text'] for r in server.received] == ['before restart']
+
+
+def test_proxy_hint_travels_with_item(tmp_path, bot_api):
+    server, base_url = bot_api()
+    # Воркер только ставит в очередь, отправляет другой процесс (свой Outbox)
+    hint = Outbox.make_proxy_hint([{'name': 'fast', 'status': 'working', 'ping': {}},
+                                   {'name': 'dead', 'status': 'failed'}])
+    make_outbox(tmp_path, base_url).enqueue_message('hello', proxy_hint=hint)
+    sender = make_outbox(tmp_path, base_url)
+
+    assert deliver(sender)
+    assert [r['fields']['text'] for r in server.received] == ['hello']
+    assert sender.proxy_hint == {'results': [{'name': 'fast', 'status': 'working', 'ping': {}}]}